@@ -71,6 +71,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Тестовая база - файл, а не память: in-memory база SQLite доступна
+        # потокам только в режиме shared cache, где параллельная запись
+        # сразу падает с "database table is locked" вместо ожидания, а
+        # тесты параллельных операций (shop/tests.py) пишут из потоков
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -96,6 +101,32 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# Политика хеширования паролей: 'argon2' (нужен argon2-cffi), 'scrypt' или 'pbkdf2'.
+# Хешер политики стоит первым, остальные проверяют старые хеши; при входе
+# пароль со старым алгоритмом или параметрами перехешируется автоматически
+PASSWORD_HASHER_POLICY = 'scrypt'
+
+_POLICY_HASHERS = {
+    'argon2': 'shop.hashers.Argon2PasswordHasher',
+    'scrypt': 'shop.hashers.ScryptPasswordHasher',
+    'pbkdf2': 'shop.hashers.PBKDF2PasswordHasher',
+}
+PASSWORD_HASHERS = [_POLICY_HASHERS[PASSWORD_HASHER_POLICY]] + [
+    path for policy, path in _POLICY_HASHERS.items() if policy != PASSWORD_HASHER_POLICY
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+
+# Параметры хешеров (атрибуты соответствующих хешеров Django)
+PASSWORD_HASHER_PARAMS = {
+    'argon2': {'time_cost': 2, 'memory_cost': 65536, 'parallelism': 2},
+    'scrypt': {'work_factor': 2 ** 14, 'block_size': 8, 'parallelism': 1},
+    'pbkdf2': {'iterations': 600000},
+}
+
+# Сколько паролей процесс хеширует одновременно (0 - в потоке запроса)
+PASSWORD_HASHING_THREADS = 0
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
@@ -129,3 +160,64 @@ LOGIN_URL = '/admin/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
+
+# Catalog settings
+# Через сколько секунд фасетный индекс каталога перестраивается целиком
+# (изменения товаров в текущем процессе применяются сразу через сигналы)
+CATALOG_INDEX_TTL = 300
+# Количество товаров на странице каталога
+CATALOG_PAGE_SIZE = 24
+# Количество заказов на странице истории в личном кабинете
+ACCOUNT_ORDERS_PAGE_SIZE = 10
+# Количество отзывов на странице ленты отзывов товара
+REVIEWS_PAGE_SIZE = 10
+# Бэкенд поиска (для СУБД без FTS5 - shop.search.DatabaseSearchBackend)
+SEARCH_BACKEND = 'shop.search.SQLiteFTSSearchBackend'
+# Сколько секунд хранится в кэше статистика брендов и категорий
+# (при изменении товаров сбрасывается сигналами)
+STATS_CACHE_TIMEOUT = 600
+# Сколько секунд хранится в кэше набор данных страницы товара
+# (товар обновляется сигналами; списки похожих товаров - по истечении срока)
+PRODUCT_CACHE_TIMEOUT = 3600
+# Сколько секунд хранится в кэше количество товаров для значка корзины
+# (представления корзины обновляют его при каждом изменении)
+CART_COUNT_CACHE_TIMEOUT = 3600
+# Сколько секунд хранится ответ на запрос с заголовком Idempotency-Key
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+# Через сколько секунд ключ незавершенного запроса (процесс упал, не
+# записав ответ) можно занять заново; больше любого таймаута запроса
+IDEMPOTENCY_LEASE = 2 * 60
+# Сколько секунд после ввода пароля оформление заказа не требует его повторно
+REAUTH_WINDOW = 300
+# Ограничение частоты входа и регистрации: (емкость корзины токенов, период
+# полного наполнения в секундах) для каждого IP и для каждого логина
+RATE_LIMITS = {
+    'login': {'ip': (20, 60), 'login': (5, 60)},
+    'register': {'ip': (5, 600)},
+}
+# Откуда брать IP клиента (за nginx - например 'HTTP_X_REAL_IP')
+RATE_LIMIT_IP_META = 'REMOTE_ADDR'
+
+# Logging
+# Сообщения приложения shop (в том числе замеры этапов оформления заказа)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'shop': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
@@ -1,9 +1,10 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from .models import (
-    CustomUser, Brand, Category, Product, 
+    CustomUser, Brand, Category, Product, Note,
     Review, Cart, CartItem, Order, OrderItem, Wishlist
 )
+from .stats import EMPTY_STATS, get_brand_stats, get_category_stats
 
 
 @admin.register(CustomUser)
@@ -22,7 +23,7 @@ class BrandAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
     
     def product_count(self, obj):
-        return obj.products.count()
+        return get_brand_stats().get(obj.pk, EMPTY_STATS).product_count
     product_count.short_description = 'Количество товаров'
 
 
@@ -33,7 +34,7 @@ class CategoryAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
     
     def product_count(self, obj):
-        return obj.products.count()
+        return get_category_stats().get(obj.pk, EMPTY_STATS).product_count
     product_count.short_description = 'Количество товаров'
 
 
@@ -102,6 +103,17 @@ class ProductAdmin(admin.ModelAdmin):
     gender_display.short_description = 'Для кого'
 
 
+@admin.register(Note)
+class NoteAdmin(admin.ModelAdmin):
+    list_display = ('name', 'family', 'stem')
+    list_filter = ('family',)
+    # Семейство выводится из основы по словарю NOTE_FAMILIES (shop/notes.py):
+    # по нему же строится фасетный индекс каталога, а backfill_notes
+    # пересчитывает сохраненные семейства при изменении словаря
+    readonly_fields = ('family',)
+    search_fields = ('name', 'stem')
+
+
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
     list_display = ('product', 'user', 'rating', 'created_at')
@@ -142,17 +154,20 @@ class OrderItemInline(admin.TabularInline):
 class OrderAdmin(admin.ModelAdmin):
     list_display = (
         'order_number', 'user', 'status', 'payment_method', 
-        'total_price', 'city', 'created_at'
+        'total_price', 'total_items', 'items_summary', 'city', 'created_at'
     )
     list_filter = ('status', 'payment_method', 'city', 'created_at')
     list_editable = ('status',)
     search_fields = ('order_number', 'user__login', 'full_name', 'email', 'phone')
-    readonly_fields = ('order_number', 'created_at', 'updated_at')
+    readonly_fields = ('order_number', 'total_items', 'items_summary', 'created_at', 'updated_at')
     inlines = [OrderItemInline]
     
     fieldsets = (
         ('Информация о заказе', {
-            'fields': ('order_number', 'user', 'status', 'payment_method', 'total_price')
+            'fields': (
+                'order_number', 'user', 'status', 'payment_method', 'total_price',
+                'total_items', 'items_summary'
+            )
         }),
         ('Данные покупателя', {
             'fields': ('full_name', 'email', 'phone')
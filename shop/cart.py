@@ -0,0 +1,154 @@
+"""
+Изменение корзины.
+
+Каждая операция выполняется одним SQL-оператором без чтения перед записью,
+поэтому параллельные запросы (двойной клик, несколько вкладок) не теряют
+обновлений. Добавление товара - это INSERT ... ON CONFLICT DO UPDATE с
+прибавлением количества в БД, а получение корзины одновременно обновляет
+ее updated_at. Требуется СУБД с поддержкой ON CONFLICT и RETURNING
+(SQLite 3.35+ или PostgreSQL).
+
+Количество товаров для значка корзины в шапке хранится в кэше по id
+пользователя: представления корзины записывают туда уже посчитанный итог,
+поэтому /api/cart/count/ обычно отвечает без обращения к CartItem.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Cart, CartItem, Product
+
+
+MAX_CART_QUANTITY = 100
+MAX_BATCH_OPERATIONS = 50
+
+
+def _table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def touch_cart(user):
+    """
+    Получить id корзины пользователя, создав ее при необходимости,
+    и обновить дату ее изменения - одним запросом.
+    """
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {_table(Cart)} (user_id, created_at, updated_at) VALUES (%s, %s, %s) '
+            f'ON CONFLICT (user_id) DO UPDATE SET updated_at = excluded.updated_at '
+            f'RETURNING id',
+            [user.pk, now, now]
+        )
+        return cursor.fetchone()[0]
+
+
+def add_item(cart_id, product_id, quantity=1):
+    """
+    Добавить товар в корзину или увеличить его количество (не больше
+    MAX_CART_QUANTITY). Товар должен быть в наличии.
+    Возвращает (id элемента, новое количество) или None, если товара нет.
+    """
+    cart_items = _table(CartItem)
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {cart_items} (cart_id, product_id, quantity, added_at) '
+            f'SELECT %s, id, %s, %s FROM {_table(Product)} WHERE id = %s AND in_stock '
+            f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = CASE '
+            f'WHEN {cart_items}.quantity + excluded.quantity > %s THEN %s '
+            f'ELSE {cart_items}.quantity + excluded.quantity END '
+            f'RETURNING id, quantity',
+            [cart_id, quantity, now, product_id, MAX_CART_QUANTITY, MAX_CART_QUANTITY]
+        )
+        return cursor.fetchone()
+
+
+def set_item_quantity(cart_id, item_id, quantity):
+    """Установить количество элемента корзины. Возвращает False, если элемента нет"""
+    return CartItem.objects.filter(id=item_id, cart_id=cart_id).update(quantity=quantity) > 0
+
+
+def remove_item(cart_id, item_id):
+    """Удалить элемент корзины. Возвращает False, если элемента нет"""
+    deleted, _ = CartItem.objects.filter(id=item_id, cart_id=cart_id).delete()
+    return deleted > 0
+
+
+def _parse_operation(operation):
+    """Проверить операцию пакета и привести ее поля к нужным типам"""
+    if not isinstance(operation, dict):
+        raise ValueError('Операция должна быть объектом')
+    op = operation.get('op')
+    if op not in ('add', 'update', 'remove'):
+        raise ValueError(f'Неизвестная операция: {op}')
+    try:
+        if op == 'remove':
+            return {'op': op, 'item_id': int(operation['item_id'])}
+        if op == 'add':
+            parsed = {'op': op, 'product_id': int(operation['product_id']),
+                      'quantity': int(operation.get('quantity', 1))}
+        else:
+            parsed = {'op': op, 'item_id': int(operation['item_id']),
+                      'quantity': int(operation['quantity'])}
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f'Неверные данные операции {op}')
+    if not 1 <= parsed['quantity'] <= MAX_CART_QUANTITY:
+        raise ValueError(f'Количество должно быть от 1 до {MAX_CART_QUANTITY}')
+    return parsed
+
+
+def apply_batch(user, operations):
+    """
+    Применить список операций add / update / remove к корзине пользователя
+    в одной транзакции. Операции проверяются до первой записи (ValueError
+    при ошибке). Возвращает id корзины, результаты по каждой операции
+    и id затронутых элементов.
+    """
+    if not isinstance(operations, list) or not operations:
+        raise ValueError('Нужен непустой список операций')
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        raise ValueError(f'Не больше {MAX_BATCH_OPERATIONS} операций за раз')
+    operations = [_parse_operation(operation) for operation in operations]
+
+    results, touched = [], set()
+    with transaction.atomic():
+        cart_id = touch_cart(user)
+        for operation in operations:
+            if operation['op'] == 'add':
+                added = add_item(cart_id, operation['product_id'], operation['quantity'])
+                result = {'success': added is not None}
+                if added is not None:
+                    result['item_id'], result['quantity'] = added
+                    touched.add(added[0])
+            elif operation['op'] == 'update':
+                result = {'success': set_item_quantity(cart_id, operation['item_id'], operation['quantity'])}
+                touched.add(operation['item_id'])
+            else:
+                result = {'success': remove_item(cart_id, operation['item_id'])}
+                touched.discard(operation['item_id'])
+            results.append(result)
+    return cart_id, results, touched
+
+
+def _count_key(user_id):
+    return f'shop:cart_count:{user_id}'
+
+
+def get_cart_count(user):
+    """Количество товаров в корзине пользователя (из кэша, при промахе - из БД)"""
+    count = cache.get(_count_key(user.pk))
+    if count is None:
+        count = CartItem.objects.filter(cart__user=user).aggregate(count=Sum('quantity'))['count'] or 0
+        remember_cart_count(user.pk, count)
+    return count
+
+
+def remember_cart_count(user_id, count):
+    cache.set(_count_key(user_id), count, getattr(settings, 'CART_COUNT_CACHE_TIMEOUT', 3600))
+
+
+def forget_cart_count(user_id):
+    cache.delete(_count_key(user_id))
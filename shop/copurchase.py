@@ -0,0 +1,152 @@
+"""
+"С этим товаром покупают" по истории заказов.
+
+Матрица совместных покупок хранится разреженно - таблицей CoPurchase
+(товар, другой товар, число заказов с обоими), по строке на каждое
+направление пары. Команда build_copurchases читает позиции новых заказов
+(после отметки JobWatermark) потоком, сгруппированным по заказу,
+считает пары в памяти и при накоплении MAX_PENDING_PAIRS пар сбрасывает
+их в таблицу одним upsert вместе с новой отметкой, поэтому память
+ограничена, а прерванный расчет продолжается с места остановки.
+
+После обновления у затронутых товаров остаются только MAX_PAIRS_PER_PRODUCT
+самых частых пар: редкие пары хвоста отбрасываются, и счетчики вернувшихся
+пар начинаются заново (приближение ради ограниченного размера таблицы).
+Чтение рекомендаций - запрос по индексу (product, -count).
+"""
+from collections import Counter
+from datetime import timedelta
+from itertools import combinations, groupby
+
+from django.db import connection, transaction
+from django.db.models import F, Sum, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import CoPurchase, JobWatermark, OrderItem
+from .product_cache import products_by_ids
+
+
+WATERMARK = 'copurchase'
+
+# Сколько пар копить в памяти до записи в БД
+MAX_PENDING_PAIRS = 200000
+# Сколько пар хранить для каждого товара
+MAX_PAIRS_PER_PRODUCT = 50
+# Заказы с большим числом разных товаров (оптовые) не показательны и дают квадрат пар
+MAX_BASKET_SIZE = 30
+# Заказ учитывается, когда с его создания прошло столько времени:
+# транзакции, начатые раньше, к этому моменту уже завершены
+ORDER_SETTLE_DELAY = timedelta(minutes=1)
+# Сколько рекомендаций показывать
+RECOMMENDATIONS_COUNT = 4
+
+
+def _flush(pairs, watermark):
+    """Прибавить накопленные пары к таблице и сдвинуть отметку (одна транзакция)"""
+    table = connection.ops.quote_name(CoPurchase._meta.db_table)
+    count_column = connection.ops.quote_name('count')
+    rows = [
+        row
+        for (first, second), count in pairs.items()
+        for row in ((first, second, count), (second, first, count))
+    ]
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {table} (product_id, other_id, {count_column}) VALUES (%s, %s, %s) '
+                f'ON CONFLICT (product_id, other_id) DO UPDATE SET '
+                f'{count_column} = {table}.{count_column} + excluded.{count_column}',
+                rows
+            )
+        JobWatermark.objects.filter(name=WATERMARK).update(position=watermark)
+
+
+def _prune(product_ids, chunk_size=500):
+    """Оставить у товаров product_ids только MAX_PAIRS_PER_PRODUCT самых частых пар"""
+    product_ids = sorted(product_ids)
+    for start in range(0, len(product_ids), chunk_size):
+        chunk = product_ids[start:start + chunk_size]
+        extra = (
+            CoPurchase.objects.filter(product_id__in=chunk)
+            .annotate(position=Window(
+                RowNumber(),
+                partition_by=F('product_id'),
+                order_by=[F('count').desc(), F('other_id')]
+            ))
+            .filter(position__gt=MAX_PAIRS_PER_PRODUCT)
+            .values_list('id', flat=True)
+        )
+        CoPurchase.objects.filter(id__in=list(extra)).delete()
+
+
+def update_copurchases(chunk_size=10000):
+    """
+    Учесть заказы, созданные после отметки. Возвращает
+    (количество обработанных заказов, множество id товаров с новыми парами)
+    """
+    watermark, created = JobWatermark.objects.get_or_create(name=WATERMARK)
+    upper = (
+        OrderItem.objects.filter(
+            order_id__gt=watermark.position,
+            order__created_at__lt=timezone.now() - ORDER_SETTLE_DELAY
+        )
+        .order_by('-order_id')
+        .values_list('order_id', flat=True)
+        .first()
+    )
+    if upper is None:
+        return 0, set()
+
+    lines = (
+        OrderItem.objects.filter(order_id__gt=watermark.position, order_id__lte=upper)
+        .exclude(order__status='cancelled')
+        .order_by('order_id')
+        .values_list('order_id', 'product_id')
+        .iterator(chunk_size=chunk_size)
+    )
+    pairs = Counter()
+    touched = set()
+    orders = 0
+    last_order_id = watermark.position
+    for order_id, group in groupby(lines, key=lambda line: line[0]):
+        products = sorted({product_id for _, product_id in group})
+        orders += 1
+        last_order_id = order_id
+        if 1 < len(products) <= MAX_BASKET_SIZE:
+            pairs.update(combinations(products, 2))
+            touched.update(products)
+        # Сбрасываем только на границе заказа, чтобы отметка не разрезала заказ
+        if len(pairs) >= MAX_PENDING_PAIRS:
+            _flush(pairs, last_order_id)
+            pairs.clear()
+    _flush(pairs, upper)
+    _prune(touched)
+    return orders, touched
+
+
+def bought_together_ids(product_id, limit=RECOMMENDATIONS_COUNT * 2):
+    """id товаров, которые чаще всего покупают вместе с product_id"""
+    return list(
+        CoPurchase.objects.filter(product_id=product_id)
+        .order_by('-count', 'other_id')
+        .values_list('other_id', flat=True)[:limit]
+    )
+
+
+def recommend_for_cart(product_ids, limit=RECOMMENDATIONS_COUNT):
+    """Товары, которые чаще всего покупают вместе с товарами корзины"""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return []
+    ids = list(
+        CoPurchase.objects.filter(product_id__in=product_ids, other__in_stock=True)
+        .exclude(other_id__in=product_ids)
+        .values('other_id')
+        .annotate(score=Sum('count'))
+        .order_by('-score', 'other_id')
+        .values_list('other_id', flat=True)[:limit]
+    )
+    if not ids:
+        return []
+    return list(products_by_ids(ids, limit))
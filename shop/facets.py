@@ -0,0 +1,296 @@
+"""
+Фасетный индекс каталога.
+
+Индекс хранится в памяти процесса и строится по товарам в наличии.
+Для каждого значения фасета хранится битовая карта (int, где номер бита -
+id товара), поэтому любая комбинация фильтров и количество товаров
+для каждой опции считаются пересечением битовых карт без запросов к БД.
+"""
+import threading
+import time
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+
+from .notes import NOTE_FAMILIES
+
+
+# Диапазоны цены со скидкой: значение фильтра -> (название, от, до)
+PRICE_RANGES = {
+    '0-5000': ('до 5 000 ₽', None, 5000),
+    '5000-15000': ('5 000 - 15 000 ₽', 5000, 15000),
+    '15000-30000': ('15 000 - 30 000 ₽', 15000, 30000),
+    '30000+': ('от 30 000 ₽', 30000, None),
+}
+
+FACETS = ('category', 'brand', 'gender', 'concentration', 'notes', 'price_range')
+
+# Фасеты, где можно выбрать несколько значений сразу и товар должен
+# подходить под все (например, древесные И цитрусовые ноты)
+CONJUNCTIVE_FACETS = ('notes',)
+
+PRODUCT_FIELDS = (
+    'id', 'category_id', 'brand_id', 'gender', 'concentration', 'effective_price',
+)
+
+FacetOption = namedtuple('FacetOption', ['value', 'label', 'count'])
+
+
+def price_ranges_for(price):
+    """Диапазоны цен, в которые попадает цена (границы включаются)"""
+    price = Decimal(price)
+    return [
+        key for key, (label, low, high) in PRICE_RANGES.items()
+        if (low is None or price >= low) and (high is None or price <= high)
+    ]
+
+
+def product_facets(row, note_families):
+    """
+    Значения фасетов товара по словарю полей PRODUCT_FIELDS.
+    note_families - семейства нот товара из таблиц Note / ProductNote,
+    тех же, по которым фильтрует apply_filters.
+    """
+    return {
+        'category': [str(row['category_id'])] if row['category_id'] else [],
+        'brand': [str(row['brand_id'])],
+        'gender': [row['gender']],
+        'concentration': [row['concentration']],
+        'notes': [family for family in NOTE_FAMILIES if family in note_families],
+        'price_range': price_ranges_for(row['effective_price']),
+    }
+
+
+def _note_families(products):
+    """Семейства нот товаров QuerySet products: {id товара: {семейство}}"""
+    from .models import ProductNote
+
+    families = defaultdict(set)
+    rows = (
+        ProductNote.objects.filter(product__in=products)
+        .exclude(note__family='')
+        .values_list('product_id', 'note__family')
+        .distinct()
+    )
+    for product_id, family in rows.iterator(chunk_size=2000):
+        families[product_id].add(family)
+    return families
+
+
+def iter_bits(bitmap):
+    """Перебрать номера установленных битов по возрастанию"""
+    while bitmap:
+        low = bitmap & -bitmap
+        yield low.bit_length() - 1
+        bitmap ^= low
+
+
+class FacetResult:
+    """Результат запроса к фасетному индексу"""
+
+    def __init__(self, bitmap, options, filters):
+        self.bitmap = bitmap
+        self.options = options
+        # Фильтры, которые были применены (неизвестные значения отброшены)
+        self.filters = filters
+
+    @property
+    def total(self):
+        return self.bitmap.bit_count()
+
+    @property
+    def ids(self):
+        return list(iter_bits(self.bitmap))
+
+
+class CatalogFacetIndex:
+    """Фасетный индекс товаров в наличии"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        self._bitmaps = {facet: defaultdict(int) for facet in FACETS}
+        self._all = 0
+        self._facets_by_product = {}
+        self._labels = {'category': {}, 'brand': {}}
+        self.built_at = None
+
+    def rebuild(self):
+        """Полностью перестроить индекс по базе данных"""
+        from .models import Brand, Category, Product
+
+        with self._lock:
+            self._reset()
+            self._labels['category'] = {
+                str(pk): name for pk, name in Category.objects.values_list('id', 'name')
+            }
+            self._labels['brand'] = {
+                str(pk): name for pk, name in Brand.objects.values_list('id', 'name')
+            }
+            products = Product.objects.filter(in_stock=True)
+            note_families = _note_families(products)
+            for row in products.values(*PRODUCT_FIELDS).iterator(chunk_size=2000):
+                self._add(row['id'], product_facets(row, note_families[row['id']]))
+            self.built_at = time.monotonic()
+
+    def is_stale(self):
+        ttl = getattr(settings, 'CATALOG_INDEX_TTL', 300)
+        return self.built_at is None or time.monotonic() - self.built_at > ttl
+
+    def _add(self, pk, facets):
+        bit = 1 << pk
+        for facet, values in facets.items():
+            for value in values:
+                self._bitmaps[facet][value] |= bit
+        self._facets_by_product[pk] = facets
+        self._all |= bit
+
+    def discard(self, pk):
+        """Убрать товар из индекса"""
+        with self._lock:
+            facets = self._facets_by_product.pop(pk, None)
+            if facets is None:
+                return
+            mask = ~(1 << pk)
+            for facet, values in facets.items():
+                for value in values:
+                    self._bitmaps[facet][value] &= mask
+            self._all &= mask
+
+    def update_product(self, product):
+        """Обновить товар в индексе после сохранения (ноты уже записаны в ProductNote)"""
+        from .models import Product
+
+        with self._lock:
+            if self.built_at is None:
+                return
+            self.discard(product.pk)
+            if product.in_stock:
+                row = {field: getattr(product, field) for field in PRODUCT_FIELDS}
+                note_families = _note_families(Product.objects.filter(pk=product.pk))
+                self._add(product.pk, product_facets(row, note_families[product.pk]))
+
+    def set_label(self, facet, pk, name):
+        with self._lock:
+            if name is None:
+                self._labels[facet].pop(str(pk), None)
+            else:
+                self._labels[facet][str(pk)] = name
+
+    def _is_known(self, facet, value):
+        # Несуществующие категория и бренд игнорируются, как и раньше в каталоге
+        return facet not in self._labels or value in self._labels[facet]
+
+    def _choices(self, facet):
+        from .models import Product
+
+        if facet in self._labels:
+            return sorted(self._labels[facet].items(), key=lambda item: item[1])
+        if facet == 'gender':
+            return Product.GENDER_CHOICES
+        if facet == 'concentration':
+            return Product.CONCENTRATION_CHOICES
+        if facet == 'notes':
+            return [(key, label) for key, (label, stems) in NOTE_FAMILIES.items()]
+        return [(key, value[0]) for key, value in PRICE_RANGES.items()]
+
+    def query(self, filters):
+        """
+        Найти товары по фильтрам и посчитать количество товаров
+        для каждой опции каждого фасета за один проход.
+
+        filters - словарь {фасет: значение}; для CONJUNCTIVE_FACETS значением
+        может быть список. Пустые значения игнорируются.
+        Количество для опции фасета считается с учетом всех остальных
+        активных фильтров, но без фильтра по самому фасету
+        (для CONJUNCTIVE_FACETS - вместе с уже выбранными значениями).
+        """
+        with self._lock:
+            applied = {}
+            for facet, value in filters.items():
+                if facet not in FACETS or not value:
+                    continue
+                if facet in CONJUNCTIVE_FACETS:
+                    values = [value] if isinstance(value, str) else list(value)
+                    known = dict(self._choices(facet))
+                    values = [v for v in values if v in known]
+                    if values:
+                        applied[facet] = values
+                elif self._is_known(facet, value):
+                    applied[facet] = value
+
+            active = {}
+            for facet, value in applied.items():
+                if facet in CONJUNCTIVE_FACETS:
+                    facet_bitmap = self._all
+                    for v in value:
+                        facet_bitmap &= self._bitmaps[facet].get(v, 0)
+                    active[facet] = facet_bitmap
+                else:
+                    active[facet] = self._bitmaps[facet].get(value, 0)
+
+            bitmap = self._all
+            for facet_bitmap in active.values():
+                bitmap &= facet_bitmap
+
+            options = {}
+            for facet in FACETS:
+                base = self._all
+                for other, facet_bitmap in active.items():
+                    if other != facet or facet in CONJUNCTIVE_FACETS:
+                        base &= facet_bitmap
+                options[facet] = [
+                    FacetOption(value, label, (base & self._bitmaps[facet].get(value, 0)).bit_count())
+                    for value, label in self._choices(facet)
+                ]
+
+        return FacetResult(bitmap, options, applied)
+
+
+catalog_index = CatalogFacetIndex()
+_build_lock = threading.Lock()
+
+
+def get_catalog_index():
+    """Получить индекс каталога, перестроив его при необходимости"""
+    if catalog_index.is_stale():
+        with _build_lock:
+            if catalog_index.is_stale():
+                catalog_index.rebuild()
+    return catalog_index
+
+
+def apply_filters(queryset, filters):
+    """Применить к QuerySet товаров те же фильтры, что и в индексе"""
+    from django.db.models import Exists, OuterRef
+    from .models import ProductNote
+
+    lookups = {}
+    if filters.get('category', '').isdigit():
+        lookups['category_id'] = filters['category']
+    if filters.get('brand', '').isdigit():
+        lookups['brand_id'] = filters['brand']
+    if filters.get('gender'):
+        lookups['gender'] = filters['gender']
+    if filters.get('concentration'):
+        lookups['concentration'] = filters['concentration']
+    if filters.get('price_range') in PRICE_RANGES:
+        label, low, high = PRICE_RANGES[filters['price_range']]
+        if low is not None:
+            lookups['effective_price__gte'] = low
+        if high is not None:
+            lookups['effective_price__lte'] = high
+    queryset = queryset.filter(**lookups)
+
+    # Каждое выбранное семейство нот - отдельное условие EXISTS
+    # по индексу (note, product) таблицы ProductNote
+    notes = filters.get('notes') or []
+    for family in ([notes] if isinstance(notes, str) else notes):
+        if family in NOTE_FAMILIES:
+            queryset = queryset.filter(Exists(
+                ProductNote.objects.filter(product=OuterRef('pk'), note__family=family)
+            ))
+    return queryset
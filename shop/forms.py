@@ -1,6 +1,8 @@
 from django import forms
 from django.core.validators import RegexValidator
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 from .models import CustomUser
 
 
@@ -99,17 +101,51 @@ class RegistrationForm(forms.ModelForm):
         model = CustomUser
         fields = ['name', 'surname', 'patronymic', 'login', 'email', 'password']
     
-    def clean_login(self):
-        login = self.cleaned_data.get('login')
-        if CustomUser.objects.filter(login=login).exists():
-            raise ValidationError('Пользователь с таким логином уже существует')
-        return login
+    # Уникальные поля и сообщения о занятом значении
+    unique_messages = {
+        'login': 'Пользователь с таким логином уже существует',
+        'email': 'Пользователь с таким email уже существует',
+    }
     
-    def clean_email(self):
-        email = self.cleaned_data.get('email')
-        if CustomUser.objects.filter(email=email).exists():
-            raise ValidationError('Пользователь с таким email уже существует')
-        return email
+    def clean(self):
+        cleaned_data = super().clean()
+        # Логин и email проверяются одним запросом
+        values = {
+            field: cleaned_data[field]
+            for field in self.unique_messages
+            if cleaned_data.get(field)
+        }
+        if values:
+            condition = Q()
+            for field, value in values.items():
+                condition |= Q(**{field: value})
+            for row in CustomUser.objects.filter(condition).values(*values):
+                self._add_taken_errors(field for field, value in values.items() if row[field] == value)
+        return cleaned_data
+    
+    def validate_unique(self):
+        # Уникальность логина и email уже проверена в clean()
+        exclude = self._get_validation_exclusions()
+        exclude.update(self.unique_messages)
+        self.instance.validate_unique(exclude=exclude)
+    
+    def _add_taken_errors(self, fields):
+        for field in fields:
+            if field not in self.errors:
+                self.add_error(field, self.unique_messages[field])
+    
+    def _taken_fields(self, error):
+        """Поля, нарушившие уникальность при вставке (по тексту ошибки БД)"""
+        message = str(error)
+        fields = [field for field in self.unique_messages if field in message]
+        if fields:
+            return fields
+        # Текст ошибки не назвал поле - уточняем одним запросом
+        condition = Q(login=self.cleaned_data['login']) | Q(email=self.cleaned_data['email'])
+        fields = set()
+        for row in CustomUser.objects.filter(condition).values('login', 'email'):
+            fields.update(field for field in self.unique_messages if row[field] == self.cleaned_data[field])
+        return fields
     
     def clean_password_repeat(self):
         password = self.cleaned_data.get('password')
@@ -119,10 +155,19 @@ class RegistrationForm(forms.ModelForm):
         return password_repeat
     
     def save(self, commit=True):
+        """
+        Создать пользователя. Если логин или email успели занять между
+        проверкой и вставкой, ошибки добавляются в форму и возвращается None
+        """
         user = super().save(commit=False)
         user.set_password(self.cleaned_data['password'])
         if commit:
-            user.save()
+            try:
+                with transaction.atomic():
+                    user.save()
+            except IntegrityError as e:
+                self._add_taken_errors(self._taken_fields(e))
+                return None
         return user
 
 
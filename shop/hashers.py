@@ -0,0 +1,99 @@
+"""
+Хешеры паролей с настраиваемыми параметрами.
+
+Политика хеширования выбирается настройкой PASSWORD_HASHER_POLICY
+('argon2', 'scrypt' или 'pbkdf2'): хешер политики стоит первым в
+PASSWORD_HASHERS (см. settings.py), остальные остаются для проверки
+старых хешей.
+Параметры задаются в PASSWORD_HASHER_PARAMS. Хешеры сохраняют имена
+алгоритмов Django, поэтому при смене политики или параметров Django сам
+перехеширует пароль при следующем успешном входе (must_update).
+
+Argon2 требует пакет argon2-cffi (pip install argon2-cffi); без него
+политику 'argon2' использовать нельзя.
+
+Если PASSWORD_HASHING_THREADS больше нуля, само вычисление хеша
+выполняется в ограниченном пуле потоков: одновременно в процессе
+считается не больше стольких хешей, сколько потоков в пуле.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+
+def _get_pool():
+    global _pool
+    threads = getattr(settings, 'PASSWORD_HASHING_THREADS', 0)
+    if threads <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool._max_workers != threads:
+            _pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='password-hasher')
+        return _pool
+
+
+def _in_pool(func, *args, **kwargs):
+    _local.in_pool = True
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _local.in_pool = False
+
+
+def _run(func, *args, **kwargs):
+    """Выполнить func в пуле хеширования (или сразу, если пул выключен)"""
+    pool = _get_pool()
+    # verify() у некоторых хешеров сам вызывает encode(): внутри пула считаем на месте
+    if pool is None or getattr(_local, 'in_pool', False):
+        return func(*args, **kwargs)
+    return pool.submit(_in_pool, func, *args, **kwargs).result()
+
+
+def argon2_available():
+    try:
+        import argon2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class TunedHasherMixin:
+    """Параметры из PASSWORD_HASHER_PARAMS[policy] и вычисление хеша в пуле потоков"""
+    policy = None
+
+    def __init__(self):
+        params = getattr(settings, 'PASSWORD_HASHER_PARAMS', {}).get(self.policy, {})
+        for name, value in params.items():
+            setattr(self, name, value)
+
+    def encode(self, password, salt, *args, **kwargs):
+        return _run(super().encode, password, salt, *args, **kwargs)
+
+    def verify(self, password, encoded):
+        return _run(super().verify, password, encoded)
+
+
+class Argon2PasswordHasher(TunedHasherMixin, hashers.Argon2PasswordHasher):
+    policy = 'argon2'
+
+
+class ScryptPasswordHasher(TunedHasherMixin, hashers.ScryptPasswordHasher):
+    policy = 'scrypt'
+
+
+class PBKDF2PasswordHasher(TunedHasherMixin, hashers.PBKDF2PasswordHasher):
+    policy = 'pbkdf2'
+
+
+# Хешер каждой политики (PASSWORD_HASHERS в настройках собирается из тех же путей)
+POLICIES = {
+    hasher.policy: hasher
+    for hasher in (Argon2PasswordHasher, ScryptPasswordHasher, PBKDF2PasswordHasher)
+}
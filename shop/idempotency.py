@@ -0,0 +1,137 @@
+"""
+Ключи идемпотентности для POST API.
+
+Клиент передает заголовок Idempotency-Key. Первый запрос с ключом
+занимает строку IdempotencyKey и выполняется; успешный JSON-ответ
+сохраняется, и повтор запроса с тем же ключом в течение
+IDEMPOTENCY_KEY_TTL секунд получает его без повторного выполнения.
+Неуспешные ответы не сохраняются: ключ освобождается, и исправленный
+запрос можно отправить снова. Если процесс упал, не записав ответ, ключ
+можно занять заново через IDEMPOTENCY_LEASE секунд. Запросы без
+заголовка обрабатываются как обычно.
+
+Отпечаток запроса - HMAC пути и тела на SECRET_KEY: тело оформления
+заказа содержит пароль, и по отпечатку в таблице его нельзя подобрать.
+"""
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+from .models import IdempotencyKey
+
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 64
+
+
+def _ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+
+def _lease():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LEASE', 2 * 60))
+
+
+def _fingerprint(request):
+    value = request.path.encode() + b'\0' + request.body
+    return salted_hmac('shop.idempotency', value, algorithm='sha256').hexdigest()
+
+
+def _is_reclaimable(record):
+    """Просроченный ключ или ключ запроса, не записавшего ответ за IDEMPOTENCY_LEASE"""
+    now = timezone.now()
+    if record.created_at < now - _ttl():
+        return True
+    return record.status_code is None and record.created_at < now - _lease()
+
+
+def _claim(user, key, fingerprint):
+    """Занять ключ. Возвращает (True, своя запись или None) или (False, существующая запись)"""
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                return True, IdempotencyKey.objects.create(user=user, key=key, fingerprint=fingerprint)
+        except IntegrityError:
+            record = IdempotencyKey.objects.filter(user=user, key=key).first()
+            if record is None:
+                continue
+            if not _is_reclaimable(record):
+                return False, record
+            IdempotencyKey.objects.filter(
+                pk=record.pk, created_at=record.created_at, status_code=record.status_code
+            ).delete()
+    # Ключ дважды освободился между попытками - выполняем без записи
+    record = IdempotencyKey.objects.filter(user=user, key=key).first()
+    return record is None, record
+
+
+def _is_success(response):
+    if not isinstance(response, JsonResponse) or response.status_code >= 400:
+        return False
+    try:
+        return bool(json.loads(response.content).get('success'))
+    except (ValueError, AttributeError):
+        return False
+
+
+def purge_expired():
+    """Удалить просроченные ключи. Возвращает количество удаленных"""
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lt=timezone.now() - _ttl()).delete()
+    return deleted
+
+
+def idempotent(view):
+    """Декоратор POST API: повтор запроса с тем же Idempotency-Key возвращает первый ответ"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return JsonResponse({
+                'success': False,
+                'error': f'Ключ идемпотентности длиннее {MAX_KEY_LENGTH} символов'
+            }, status=400)
+
+        fingerprint = _fingerprint(request)
+        claimed, record = _claim(request.user, key, fingerprint)
+        if not claimed:
+            if record.fingerprint != fingerprint:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Ключ идемпотентности уже использован для другого запроса'
+                }, status=422)
+            if record.status_code is None:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Запрос с этим ключом еще выполняется'
+                }, status=409)
+            response = HttpResponse(
+                record.response_body,
+                status=record.status_code,
+                content_type='application/json'
+            )
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        # Своя запись - по pk: если запрос выполнялся дольше IDEMPOTENCY_LEASE
+        # и ключ заняли заново, чужую запись он не перезапишет
+        own = IdempotencyKey.objects.filter(pk=record.pk) if record else IdempotencyKey.objects.none()
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception:
+            own.delete()
+            raise
+        if _is_success(response):
+            own.update(status_code=response.status_code, response_body=response.content.decode())
+        else:
+            own.delete()
+        return response
+
+    return wrapper
@@ -0,0 +1,73 @@
+import json
+import threading
+import time
+import uuid
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.test import RequestFactory, override_settings
+
+from shop import views
+from shop.models import RateLimitBucket
+from shop.ratelimit import login_digest
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест входа: поток запросов с неверным паролем к login_api '
+        'без ограничителя частоты и с ним. Показывает процессорное время '
+        'и количество выполненных хеширований пароля'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=60, help='Количество запросов в каждом прогоне')
+        parser.add_argument('--threads', type=int, default=4, help='Количество параллельных потоков')
+        parser.add_argument(
+            '--distributed', action='store_true',
+            help='Каждый запрос с нового IP (атака на один логин из ботнета)'
+        )
+
+    def handle(self, *args, **options):
+        login = f'load-test-{uuid.uuid4().hex[:12]}'
+        self.stdout.write('Без ограничителя:')
+        with override_settings(RATE_LIMITS={}):
+            self._attack(login, options)
+        self.stdout.write('С ограничителем:')
+        self._attack(login, options)
+        # Убираем корзины, созданные тестом
+        RateLimitBucket.objects.filter(
+            Q(key__startswith='login:ip:198.51.100.') | Q(key=f'login:login:{login_digest(login)}')
+        ).delete()
+
+    def _attack(self, login, options):
+        total, threads = options['requests'], options['threads']
+        body = json.dumps({'login': login, 'password': 'wrong-password'})
+        factory = RequestFactory()
+        statuses = []
+        lock = threading.Lock()
+
+        def worker(numbers):
+            for number in numbers:
+                ip = f'198.51.100.{number % 250 if options["distributed"] else 1}'
+                request = factory.post('/api/login/', body, content_type='application/json', REMOTE_ADDR=ip)
+                request.user = AnonymousUser()
+                response = views.login_api(request)
+                with lock:
+                    statuses.append(response.status_code)
+
+        chunks = [range(i, total, threads) for i in range(threads)]
+        workers = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+        cpu, wall = time.process_time(), time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+
+        rejected = statuses.count(429)
+        self.stdout.write(
+            f'  запросов {len(statuses)}, отклонено {rejected}, хеширований {len(statuses) - rejected}; '
+            f'CPU {cpu:.2f} с ({cpu * 1000 / len(statuses):.1f} мс на запрос), '
+            f'время {wall:.2f} с'
+        )
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.models import Note, Product
+from shop.notes import note_family, sync_product_notes
+
+
+class Command(BaseCommand):
+    help = 'Заполнить таблицу нот (Note / ProductNote) по полям нот всех товаров'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Сколько товаров обрабатывать в одной транзакции'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        # Семейства уже известных нот могли поменяться вместе со словарем
+        updated = 0
+        for note in Note.objects.all().iterator(chunk_size=chunk_size):
+            family = note_family(note.stem)
+            if note.family != family:
+                note.family = family
+                note.save(update_fields=['family'])
+                updated += 1
+
+        fields = ('id', 'notes_top', 'notes_middle', 'notes_base')
+        last_id, processed = 0, 0
+        while True:
+            products = list(
+                Product.objects.filter(id__gt=last_id).order_by('id').only(*fields)[:chunk_size]
+            )
+            if not products:
+                break
+            with transaction.atomic():
+                for product in products:
+                    sync_product_notes(product)
+            last_id = products[-1].id
+            processed += len(products)
+            self.stdout.write(f'Обработано товаров: {processed}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: товаров {processed}, обновлено семейств нот {updated}'
+        ))
@@ -0,0 +1,51 @@
+from itertools import groupby
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from shop.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = 'Заполнить количество товаров и состав (total_items, items_summary) существующих заказов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Сколько заказов обрабатывать в одной транзакции'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        last_id, processed = 0, 0
+        while True:
+            orders = list(
+                Order.objects.filter(id__gt=last_id).order_by('id')
+                .only('id', 'total_items', 'items_summary')[:chunk_size]
+            )
+            if not orders:
+                break
+            # Позиции всей пачки заказов - одним запросом
+            rows = (
+                OrderItem.objects.filter(order_id__in=[order.id for order in orders])
+                .order_by('order_id', 'id')
+                .values_list('order_id', 'product_name', 'quantity')
+            )
+            lines = {
+                order_id: [(name, quantity) for _, name, quantity in group]
+                for order_id, group in groupby(rows, key=lambda row: row[0])
+            }
+            for order in orders:
+                order_lines = lines.get(order.id, [])
+                order.total_items = sum(quantity for name, quantity in order_lines)
+                order.items_summary = Order.build_items_summary(order_lines)
+            with transaction.atomic():
+                Order.objects.bulk_update(orders, ['total_items', 'items_summary'])
+            last_id = orders[-1].id
+            processed += len(orders)
+            self.stdout.write(f'Обработано заказов: {processed}')
+
+        self.stdout.write(self.style.SUCCESS(f'Готово: заказов {processed}'))
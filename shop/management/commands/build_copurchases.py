@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.copurchase import update_copurchases
+from shop.models import Product
+from shop.product_cache import forget_products
+
+
+class Command(BaseCommand):
+    help = (
+        'Обновить "С этим товаром покупают" по заказам, созданным после прошлого запуска '
+        '(для периодического запуска; первый запуск обрабатывает всю историю)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=10000,
+            help='Сколько позиций заказов читать из БД за один раз'
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        orders, touched = update_copurchases(options['chunk_size'])
+        self.stdout.write(
+            f'Заказов: {orders}, товаров с новыми парами: {len(touched)}, '
+            f'время {time.perf_counter() - started:.2f} с'
+        )
+
+        # Наборы страниц этих товаров хранят id "покупают вместе" - сбрасываем их
+        touched = sorted(touched)
+        for start in range(0, len(touched), 500):
+            forget_products(
+                Product.objects.filter(id__in=touched[start:start + 500]).values_list('slug', flat=True)
+            )
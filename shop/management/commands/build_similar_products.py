@@ -0,0 +1,40 @@
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from shop import similarity
+from shop.product_cache import SIMILAR_IDS_COUNT
+
+
+class Command(BaseCommand):
+    help = (
+        'Рассчитать похожие товары по нотам, полу, концентрации, цене и бренду '
+        '(таблица ProductNeighbor) и обновить кэш страниц товаров. Требует numpy'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--neighbors', type=int, default=SIMILAR_IDS_COUNT,
+            help='Сколько соседей хранить для каждого товара'
+        )
+        parser.add_argument(
+            '--block-size', type=int, default=1024,
+            help='Сколько строк матрицы близостей считать за один шаг'
+        )
+
+    def handle(self, *args, **options):
+        if not similarity.numpy_available():
+            raise CommandError('Для расчета похожих товаров нужен numpy: pip install numpy')
+
+        started = time.perf_counter()
+        neighbors = similarity.compute_neighbors(options['neighbors'], options['block_size'])
+        computed = time.perf_counter() - started
+        saved = similarity.save_neighbors(neighbors)
+        self.stdout.write(
+            f'Товаров: {len(neighbors)}, записей соседей: {saved}; '
+            f'расчет {computed:.2f} с, всего {time.perf_counter() - started:.2f} с'
+        )
+
+        # Наборы страниц товаров хранят id похожих товаров - перестраиваем их
+        call_command('refresh_product_cache', stdout=self.stdout)
@@ -0,0 +1,93 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+
+from shop import cart as cart_ops
+from shop.models import CartItem, CustomUser, Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Проверка корзины под параллельной нагрузкой: несколько потоков '
+        'одновременно добавляют, меняют и удаляют товары одной корзины, '
+        'после чего проверяется итоговое состояние'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Количество параллельных потоков')
+        parser.add_argument('--clicks', type=int, default=10, help='Сколько раз каждый поток добавляет общий товар')
+
+    def handle(self, *args, **options):
+        threads, clicks = options['threads'], options['clicks']
+        if threads * clicks >= cart_ops.MAX_CART_QUANTITY:
+            raise CommandError(
+                f'threads * clicks должно быть меньше {cart_ops.MAX_CART_QUANTITY}'
+            )
+        products = list(Product.objects.filter(in_stock=True).order_by('id')[:threads + 1])
+        if len(products) < threads + 1:
+            raise CommandError(f'Нужно хотя бы {threads + 1} товаров в наличии')
+        shared, own = products[0], products[1:]
+
+        user = CustomUser.objects.create_user(
+            login=f'cart-stress-{uuid.uuid4().hex[:12]}',
+            email=f'{uuid.uuid4().hex[:12]}@cart-stress.local',
+            name='Stress',
+            surname='Test',
+        )
+        try:
+            self._run(user, shared, own, clicks)
+        finally:
+            user.delete()
+
+    def _run(self, user, shared, own, clicks):
+        # Сколько запросов к БД стоит одно добавление
+        with CaptureQueriesContext(connection) as queries:
+            cart_id = cart_ops.touch_cart(user)
+            cart_ops.add_item(cart_id, shared.pk)
+        self.stdout.write(f'Запросов на одно добавление: {len(queries)}')
+
+        errors = []
+        start = threading.Barrier(len(own))
+
+        def worker(product):
+            try:
+                start.wait()
+                for _ in range(clicks):
+                    cart_ops.add_item(cart_ops.touch_cart(user), shared.pk)
+                # Своим товаром поток проверяет добавление, изменение и удаление
+                item_id, _ = cart_ops.add_item(cart_ops.touch_cart(user), product.pk)
+                cart_ops.add_item(cart_ops.touch_cart(user), product.pk)
+                cart_ops.set_item_quantity(cart_ops.touch_cart(user), item_id, 5)
+                if product.pk % 2:
+                    cart_ops.remove_item(cart_ops.touch_cart(user), item_id)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker, args=(product,)) for product in own]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        operations = len(own) * (clicks + 4)
+        self.stdout.write(f'Операций: {operations} за {elapsed:.2f} с ({operations / elapsed:.0f} в секунду)')
+
+        actual = dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'))
+        expected = {shared.pk: len(own) * clicks + 1}
+        expected.update({product.pk: 5 for product in own if not product.pk % 2})
+
+        for error in errors:
+            self.stderr.write(f'Ошибка в потоке: {error!r}')
+        if errors:
+            raise CommandError(f'Ошибок в потоках: {len(errors)}')
+        if actual != expected:
+            raise CommandError(f'Состояние корзины не совпадает: ожидалось {expected}, получено {actual}')
+        self.stdout.write(self.style.SUCCESS('Итоговое состояние корзины верное, обновления не потеряны'))
@@ -0,0 +1,64 @@
+import os
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from shop.hashers import POLICIES, argon2_available
+
+
+class Command(BaseCommand):
+    help = (
+        'Бенчмарк хешеров паролей: сколько проверок пароля (входов) в секунду '
+        'выдерживает одно ядро для каждой политики, и пропускная способность '
+        'при ограниченном пуле потоков хеширования'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=10, help='Проверок пароля на каждую политику')
+        parser.add_argument(
+            '--threads', type=int, default=0,
+            help='Размер пула хеширования для замера пропускной способности (0 - не замерять)'
+        )
+
+    def handle(self, *args, **options):
+        rounds = options['rounds']
+        for policy, hasher_class in POLICIES.items():
+            if policy == 'argon2' and not argon2_available():
+                self.stdout.write(f'{policy}: пропущено (не установлен argon2-cffi)')
+                continue
+            with override_settings(PASSWORD_HASHING_THREADS=0):
+                hasher = hasher_class()
+                encoded = hasher.encode('benchmark-password', hasher.salt())
+                cpu = time.process_time()
+                for _ in range(rounds):
+                    hasher.verify('benchmark-password', encoded)
+                cpu = (time.process_time() - cpu) / rounds
+            self.stdout.write(
+                f'{policy}: {cpu * 1000:.1f} мс CPU на проверку, {1 / cpu:.1f} входов/с на ядро'
+            )
+            if options['threads']:
+                self._throughput(hasher_class, encoded, rounds, options['threads'])
+
+    def _throughput(self, hasher_class, encoded, rounds, threads):
+        # Запросов вдвое больше, чем потоков в пуле: лишние ждут своей очереди
+        clients = threads * 2
+        with override_settings(PASSWORD_HASHING_THREADS=threads):
+            hasher = hasher_class()
+
+            def worker():
+                for _ in range(rounds):
+                    hasher.verify('benchmark-password', encoded)
+
+            workers = [threading.Thread(target=worker) for _ in range(clients)]
+            wall = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            wall = time.perf_counter() - wall
+        self.stdout.write(
+            f'  пул {threads} потоков, {clients} клиентов: {clients * rounds / wall:.1f} входов/с '
+            f'(ядер в системе: {os.cpu_count()})'
+        )
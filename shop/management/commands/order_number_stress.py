@@ -0,0 +1,97 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+
+from shop.models import CustomUser, Order
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочная проверка выдачи номеров заказов: потоки параллельно '
+        'создают заказы, после чего проверяется, что номера уникальны и идут '
+        'подряд. Заказы создаются за сегодняшний день и расходуют реальные '
+        'номера, поэтому запускать только на тестовой базе'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Количество параллельных потоков')
+        parser.add_argument('--orders', type=int, default=250, help='Сколько заказов создает каждый поток')
+
+    def handle(self, *args, **options):
+        user = CustomUser.objects.create_user(
+            login=f'order-stress-{uuid.uuid4().hex[:12]}',
+            email=f'{uuid.uuid4().hex[:12]}@order-stress.local',
+            name='Stress',
+            surname='Test',
+        )
+        try:
+            self._run(user, options['threads'], options['orders'])
+        finally:
+            user.delete()
+
+    def _create_order(self, user):
+        with transaction.atomic():
+            return Order.objects.create(
+                user=user,
+                payment_method='cash',
+                total_price=0,
+                full_name='Stress Test',
+                email=user.email,
+                phone='',
+                address='-',
+                city='-',
+                postal_code='',
+            ).order_number
+
+    def _run(self, user, threads, orders):
+        # Какие запросы выполняет создание одного заказа
+        with CaptureQueriesContext(connection) as queries:
+            numbers = [self._create_order(user)]
+        for query in queries:
+            self.stdout.write(f'  {query["sql"]}')
+
+        errors = []
+        lock = threading.Lock()
+        start = threading.Barrier(threads)
+
+        def worker():
+            created = []
+            try:
+                start.wait()
+                for _ in range(orders):
+                    created.append(self._create_order(user))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections.close_all()
+                with lock:
+                    numbers.extend(created)
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        created = len(numbers) - 1
+        self.stdout.write(f'Создано заказов: {created} за {elapsed:.2f} с ({created / elapsed:.0f} в секунду)')
+
+        for error in errors[:10]:
+            self.stderr.write(f'Ошибка в потоке: {error!r}')
+        if errors:
+            raise CommandError(f'Ошибок в потоках: {len(errors)}')
+        if len(set(numbers)) != len(numbers):
+            raise CommandError('Найдены повторяющиеся номера заказов')
+
+        values = sorted(int(number.rsplit('-', 1)[1]) for number in numbers)
+        if values != list(range(values[0], values[0] + len(values))):
+            raise CommandError('В номерах заказов есть пропуски')
+        self.stdout.write(self.style.SUCCESS(
+            f'Номера {numbers[0]} ... уникальны и идут без пропусков'
+        ))
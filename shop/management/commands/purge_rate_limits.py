@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from shop.ratelimit import purge_idle
+
+
+class Command(BaseCommand):
+    help = 'Удалить корзины токенов ограничителя частоты, которые уже полностью наполнились'
+
+    def handle(self, *args, **options):
+        deleted = purge_idle()
+        self.stdout.write(self.style.SUCCESS(f'Удалено корзин: {deleted}'))
@@ -0,0 +1,45 @@
+import time
+
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+
+from shop.models import CustomUser
+from shop.reauth import is_recently_reauthenticated, mark_reauthenticated
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнить процессорное время подтверждения заказа: проверка пароля '
+        '(check_password) против проверки токена недавнего подтверждения'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Количество проверок каждого вида')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        user = CustomUser(login='benchmark', email='benchmark@example.com')
+        user.set_password('benchmark-password')
+
+        request = RequestFactory().post('/api/order/create/')
+        request.user = user
+        request.session = SessionBase()
+        mark_reauthenticated(request)
+
+        started = time.process_time()
+        for _ in range(iterations):
+            assert user.check_password('benchmark-password')
+        password_ms = (time.process_time() - started) * 1000 / iterations
+
+        started = time.process_time()
+        for _ in range(iterations):
+            assert is_recently_reauthenticated(request)
+        token_ms = (time.process_time() - started) * 1000 / iterations
+
+        self.stdout.write(f'check_password: {password_ms:.2f} мс CPU на заказ')
+        self.stdout.write(f'Токен подтверждения: {token_ms:.3f} мс CPU на заказ')
+        self.stdout.write(self.style.SUCCESS(
+            f'Экономия: {password_ms - token_ms:.2f} мс CPU на каждый заказ в окне подтверждения '
+            f'(в {password_ms / max(token_ms, 1e-6):.0f} раз быстрее)'
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Полностью перестроить поисковый индекс товаров'
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Поисковый индекс перестроен ({backend.__class__.__name__})'
+        ))
@@ -0,0 +1,76 @@
+import math
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from shop.models import Product, Review
+
+
+class Command(BaseCommand):
+    help = 'Пересчитать денормализованный рейтинг товаров по отзывам и исправить расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Сколько товаров обрабатывать в одной транзакции'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        aggregates = {
+            'rating_sum': Sum('rating'),
+            'rating_count': Count('id'),
+            **{
+                f'rating_{rating}': Count('id', filter=Q(rating=rating))
+                for rating in range(1, 6)
+            },
+        }
+        fields = list(Product.RATING_FIELDS)
+
+        last_id, processed, fixed = 0, 0, 0
+        while True:
+            # Строки пачки товаров заблокированы до конца транзакции: отзыв,
+            # сохраненный во время сверки, применит свою разницу к исправленному
+            # значению (change_rating ждет блокировку), а не потеряется
+            with transaction.atomic():
+                products = list(
+                    Product.objects.select_for_update()
+                    .filter(id__gt=last_id).order_by('id').only('id', *fields)[:chunk_size]
+                )
+                if not products:
+                    break
+                # Оценки всей пачки товаров - одним сгруппированным запросом
+                rows = {
+                    row.pop('product'): row
+                    for row in Review.objects.filter(product__in=products)
+                    .order_by().values('product').annotate(**aggregates)
+                }
+                changed = [product for product in products if self._reconcile(product, rows, aggregates)]
+                if changed:
+                    Product.objects.bulk_update(changed, fields)
+            last_id = products[-1].id
+            processed += len(products)
+            fixed += len(changed)
+            self.stdout.write(f'Обработано товаров: {processed}')
+
+        self.stdout.write(self.style.SUCCESS(f'Готово: товаров {processed}, исправлено {fixed}'))
+
+    @staticmethod
+    def _reconcile(product, rows, aggregates):
+        """Записать в товар рейтинг по отзывам. Возвращает True, если он отличался"""
+        row = rows.get(product.id, {})
+        expected = {name: row.get(name) or 0 for name in aggregates}
+        average = expected['rating_sum'] / expected['rating_count'] if expected['rating_count'] else 0
+        # Среднее - число с плавающей точкой, посчитанное в БД: сравниваем с допуском
+        if (
+            all(getattr(product, name) == value for name, value in expected.items())
+            and math.isclose(product.rating_average, average, abs_tol=1e-9)
+        ):
+            return False
+        for name, value in expected.items():
+            setattr(product, name, value)
+        product.rating_average = average
+        return True
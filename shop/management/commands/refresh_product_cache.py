@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from shop.models import Product
+from shop.product_cache import build_bundle, store_bundles
+
+
+class Command(BaseCommand):
+    help = (
+        'Перестроить кэш страниц товаров (товар, бренд, категория и похожие товары). '
+        'Для периодического запуска: обновляет списки похожих товаров'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Сколько товаров загружать за один запрос'
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        last_id, processed = 0, 0
+        while True:
+            products = list(
+                Product.objects.filter(in_stock=True, id__gt=last_id)
+                .select_related('brand', 'category')
+                .order_by('id')[:chunk_size]
+            )
+            if not products:
+                break
+            store_bundles(build_bundle(product) for product in products)
+            last_id = products[-1].id
+            processed += len(products)
+            self.stdout.write(f'Обработано товаров: {processed}')
+
+        self.stdout.write(self.style.SUCCESS(f'Готово: товаров {processed}'))
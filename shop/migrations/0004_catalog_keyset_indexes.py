@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_reset_category_fields'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['in_stock', 'created_at', 'id'], name='shop_produc_in_stoc_4d9a14_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['in_stock', 'name', 'id'], name='shop_produc_in_stoc_1b5a3f_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['in_stock', 'is_bestseller', 'created_at', 'id'], name='shop_produc_in_stoc_34dd65_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_catalog_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Note',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Название')),
+                ('stem', models.CharField(max_length=100, unique=True, verbose_name='Основа')),
+                ('family', models.CharField(blank=True, choices=[('woody', 'Древесные'), ('floral', 'Цветочные'), ('fresh', 'Свежие'), ('oriental', 'Ориентальные'), ('citrus', 'Цитрусовые')], db_index=True, max_length=20, verbose_name='Семейство')),
+            ],
+            options={
+                'verbose_name': 'Нота',
+                'verbose_name_plural': 'Ноты',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductNote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('level', models.CharField(choices=[('top', 'Верхняя'), ('middle', 'Сердце'), ('base', 'База')], max_length=10, verbose_name='Уровень')),
+                ('note', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_notes', to='shop.note', verbose_name='Нота')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_notes', to='shop.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Нота товара',
+                'verbose_name_plural': 'Ноты товаров',
+                'indexes': [models.Index(fields=['note', 'product'], name='shop_produc_note_id_eaeee3_idx')],
+                'unique_together': {('product', 'note', 'level')},
+            },
+        ),
+    ]
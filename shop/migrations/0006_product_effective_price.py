@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:45
+
+from django.db import migrations, models
+from django.db.models import ExpressionWrapper, F
+from django.db.models.functions import Round
+
+
+def fill_effective_price(apps, schema_editor):
+    """Рассчитываем цену со скидкой для существующих товаров"""
+    Product = apps.get_model('shop', 'Product')
+    Product.objects.update(
+        effective_price=Round(
+            ExpressionWrapper(
+                F('price') * (100 - F('discount')) / 100,
+                output_field=models.DecimalField(max_digits=10, decimal_places=2)
+            ),
+            2
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_note_taxonomy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Цена со скидкой'),
+        ),
+        migrations.RunPython(fill_effective_price, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['in_stock', 'effective_price', 'id'], name='shop_produc_in_stoc_919acb_idx'),
+        ),
+    ]
@@ -0,0 +1,75 @@
+import re
+
+from django.db import migrations
+
+
+# Копия shop.search.FTS_TABLE и стемминга shop.search.stem_text на момент
+# миграции: миграция не должна зависеть от текущего кода приложения
+FTS_TABLE = 'shop_product_fts'
+
+_WORD = re.compile(r'[0-9a-zа-я]+')
+_ENDINGS = (
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ей', 'ом', 'ем',
+    'ам', 'ям', 'ах', 'ях', 'ую', 'юю', 'ов', 'ев',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+)
+
+
+def stem_word(word):
+    if not re.fullmatch('[а-я]+', word):
+        return word
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def stem_text(text):
+    text = (text or '').lower().replace('ё', 'е')
+    return ' '.join(stem_word(word) for word in _WORD.findall(text))
+
+
+def create_fts_table(apps, schema_editor):
+    """Создаем полнотекстовый индекс FTS5 и заполняем его товарами в наличии"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+        f"USING fts5(name, brand, notes, description, "
+        f"tokenize='porter unicode61 remove_diacritics 2')"
+    )
+    Product = apps.get_model('shop', 'Product')
+    rows = [
+        (
+            product.pk,
+            stem_text(product.name),
+            stem_text(product.brand.name),
+            stem_text(' '.join([product.notes_top, product.notes_middle, product.notes_base])),
+            stem_text(product.description),
+        )
+        for product in Product.objects.filter(in_stock=True).select_related('brand')
+    ]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, brand, notes, description) '
+            f'VALUES (%s, %s, %s, %s, %s)',
+            rows
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:56
+
+import datetime
+
+from django.db import migrations, models
+
+
+def fill_order_number_sequence(apps, schema_editor):
+    """Продолжаем нумерацию с последних уже выданных номеров за каждый день"""
+    Order = apps.get_model('shop', 'Order')
+    OrderNumberSequence = apps.get_model('shop', 'OrderNumberSequence')
+    last_values = {}
+    for number in Order.objects.values_list('order_number', flat=True).iterator():
+        try:
+            prefix, date_str, value = number.split('-')
+            day = datetime.datetime.strptime(date_str, '%Y%m%d').date()
+            value = int(value)
+        except ValueError:
+            continue
+        last_values[day] = max(last_values.get(day, 0), value)
+    OrderNumberSequence.objects.bulk_create([
+        OrderNumberSequence(day=day, last_value=value) for day, value in last_values.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_product_fts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNumberSequence',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False, verbose_name='День')),
+                ('last_value', models.PositiveIntegerField(default=0, verbose_name='Последний выданный номер')),
+            ],
+            options={
+                'verbose_name': 'Счетчик номеров заказов',
+                'verbose_name_plural': 'Счетчики номеров заказов',
+            },
+        ),
+        migrations.RunPython(fill_order_number_sequence, migrations.RunPython.noop),
+    ]
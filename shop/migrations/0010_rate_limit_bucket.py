@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitBucket',
+            fields=[
+                ('key', models.CharField(max_length=150, primary_key=True, serialize=False, verbose_name='Ключ')),
+                ('tokens', models.FloatField(verbose_name='Токены')),
+                ('updated_at', models.FloatField(db_index=True, verbose_name='Время обновления (Unix)')),
+            ],
+            options={
+                'verbose_name': 'Корзина токенов',
+                'verbose_name_plural': 'Корзины токенов',
+            },
+        ),
+    ]
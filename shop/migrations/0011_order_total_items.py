@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:05
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def fill_total_items(apps, schema_editor):
+    """Заполняем количество товаров существующих заказов одним UPDATE"""
+    Order = apps.get_model('shop', 'Order')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    Order.objects.update(total_items=Coalesce(
+        Subquery(
+            OrderItem.objects.filter(order=OuterRef('pk'))
+            .values('order')
+            .annotate(total=Sum('quantity'))
+            .values('total')
+        ),
+        0
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_rate_limit_bucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total_items',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество товаров'),
+        ),
+        migrations.RunPython(fill_total_items, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+        ),
+    ]
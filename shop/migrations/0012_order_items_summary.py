@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_order_total_items'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_summary',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Состав заказа'),
+        ),
+    ]
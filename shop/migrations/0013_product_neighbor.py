@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_order_items_summary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductNeighbor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField(verbose_name='Место')),
+                ('score', models.FloatField(verbose_name='Близость')),
+                ('neighbor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product', verbose_name='Похожий товар')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='neighbors', to='shop.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Похожий товар',
+                'verbose_name_plural': 'Похожие товары',
+                'unique_together': {('product', 'rank')},
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_product_neighbor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobWatermark',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False, verbose_name='Задача')),
+                ('position', models.BigIntegerField(default=0, verbose_name='Обработано до id')),
+            ],
+            options={
+                'verbose_name': 'Отметка задачи',
+                'verbose_name_plural': 'Отметки задач',
+            },
+        ),
+        migrations.CreateModel(
+            name='CoPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Количество заказов')),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product', verbose_name='Покупают вместе')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='copurchases', to='shop.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Совместная покупка',
+                'verbose_name_plural': 'Совместные покупки',
+                'indexes': [models.Index(fields=['product', '-count'], name='copurchase_product_count_idx')],
+                'unique_together': {('product', 'other')},
+            },
+        ),
+    ]
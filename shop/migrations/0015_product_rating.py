@@ -0,0 +1,78 @@
+# Generated by Django 4.2.7 on 2026-10-18 12:17
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def fill_ratings(apps, schema_editor):
+    """Рейтинг товаров с уже существующими отзывами (иначе удаление старого отзыва
+    увело бы счетчики в минус)"""
+    Product = apps.get_model('shop', 'Product')
+    Review = apps.get_model('shop', 'Review')
+    rows = (
+        Review.objects.order_by().values('product')
+        .annotate(
+            rating_sum=Sum('rating'),
+            rating_count=Count('id'),
+            **{f'rating_{rating}': Count('id', filter=Q(rating=rating)) for rating in range(1, 6)}
+        )
+    )
+    for row in rows.iterator():
+        product_id = row.pop('product')
+        row['rating_average'] = row['rating_sum'] / row['rating_count']
+        Product.objects.filter(pk=product_id).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0014_copurchase'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок 1'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок 2'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок 3'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок 4'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Оценок 5'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_average',
+            field=models.FloatField(default=0, editable=False, verbose_name='Средняя оценка'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество оценок'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Сумма оценок'),
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('in_stock', True)), fields=['rating_average', 'rating_count', 'id'], name='product_rating_idx'),
+        ),
+    ]
@@ -1,7 +1,15 @@
-from django.db import models
+from collections import namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import connection, models, transaction
+from django.db.models import Count, ExpressionWrapper, F, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.core.validators import RegexValidator, MinValueValidator, MaxValueValidator
 from django.urls import reverse
+from django.utils import timezone
+
+from .notes import NOTE_FAMILY_CHOICES
 
 
 class CustomUserManager(BaseUserManager):
@@ -132,6 +140,67 @@ class Category(models.Model):
         return self.name
 
 
+def calculate_effective_price(price, discount):
+    """Цена со скидкой, округленная до копеек"""
+    price = Decimal(price)
+    if discount:
+        price = price * (100 - discount) / 100
+    return price.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+
+class ProductQuerySet(models.QuerySet):
+    """
+    QuerySet товаров, который поддерживает effective_price в актуальном
+    состоянии и при массовых операциях (update, bulk_create, bulk_update).
+    """
+    
+    def update(self, **kwargs):
+        if ('price' in kwargs or 'discount' in kwargs) and 'effective_price' not in kwargs:
+            kwargs['effective_price'] = self._effective_price_expression(
+                kwargs.get('price', F('price')),
+                kwargs.get('discount', F('discount'))
+            )
+        return super().update(**kwargs)
+    
+    def update_effective_price(self):
+        """Пересчитать effective_price одним UPDATE на стороне БД"""
+        return super().update(
+            effective_price=self._effective_price_expression(F('price'), F('discount'))
+        )
+    
+    @staticmethod
+    def _effective_price_expression(price, discount):
+        # В UPDATE правая часть видит старые значения столбцов, поэтому
+        # новые price/discount подставляются в выражение напрямую
+        if not hasattr(price, 'resolve_expression'):
+            price = Value(Decimal(price))
+        if not hasattr(discount, 'resolve_expression'):
+            discount = Value(int(discount))
+        return Round(
+            ExpressionWrapper(
+                price * (100 - discount) / 100,
+                output_field=models.DecimalField(max_digits=10, decimal_places=2)
+            ),
+            2
+        )
+    
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.effective_price = obj.get_discounted_price()
+        return super().bulk_create(objs, *args, **kwargs)
+    
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        fields = list(fields)
+        if 'price' in fields or 'discount' in fields:
+            objs = list(objs)
+            for obj in objs:
+                obj.effective_price = obj.get_discounted_price()
+            if 'effective_price' not in fields:
+                fields.append('effective_price')
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
+
 class Product(models.Model):
     """Товар (парфюм)"""
     
@@ -195,6 +264,14 @@ class Product(models.Model):
         default=0,
         validators=[MinValueValidator(0), MaxValueValidator(100)]
     )
+    # Денормализованная цена со скидкой: по ней фильтруем и сортируем каталог
+    effective_price = models.DecimalField(
+        'Цена со скидкой',
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        editable=False
+    )
     
     # Объем
     volume = models.IntegerField(
@@ -229,6 +306,17 @@ class Product(models.Model):
     is_limited = models.BooleanField('Лимитированная серия', default=False)
     in_stock = models.BooleanField('В наличии', default=True)
     
+    # Денормализованный рейтинг по отзывам: меняется только вместе с отзывом
+    # (Review.save и удаление отзыва), сверяется командой reconcile_ratings
+    rating_sum = models.PositiveIntegerField('Сумма оценок', default=0, editable=False)
+    rating_count = models.PositiveIntegerField('Количество оценок', default=0, editable=False)
+    rating_average = models.FloatField('Средняя оценка', default=0, editable=False)
+    rating_1 = models.PositiveIntegerField('Оценок 1', default=0, editable=False)
+    rating_2 = models.PositiveIntegerField('Оценок 2', default=0, editable=False)
+    rating_3 = models.PositiveIntegerField('Оценок 3', default=0, editable=False)
+    rating_4 = models.PositiveIntegerField('Оценок 4', default=0, editable=False)
+    rating_5 = models.PositiveIntegerField('Оценок 5', default=0, editable=False)
+    
     # Технические поля
     country = models.CharField('Страна производства', max_length=100)
     created_at = models.DateTimeField('Дата добавления', auto_now_add=True)
@@ -243,19 +331,85 @@ class Product(models.Model):
             models.Index(fields=['brand']),
             models.Index(fields=['category']),
             models.Index(fields=['gender']),
+            # Индексы для keyset-пагинации каталога по товарам в наличии
+            models.Index(fields=['in_stock', 'created_at', 'id']),
+            models.Index(fields=['in_stock', 'name', 'id']),
+            models.Index(fields=['in_stock', 'is_bestseller', 'created_at', 'id']),
+            models.Index(fields=['in_stock', 'effective_price', 'id']),
+            # Сортировка по рейтингу: частичный индекс по товарам в наличии
+            # (условие in_stock в запросе совпадает с условием индекса)
+            models.Index(
+                fields=['rating_average', 'rating_count', 'id'],
+                condition=Q(in_stock=True),
+                name='product_rating_idx'
+            ),
         ]
     
+    RATING_FIELDS = (
+        'rating_sum', 'rating_count', 'rating_average',
+        'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5',
+    )
+    
+    objects = ProductQuerySet.as_manager()
+    
     def __str__(self):
         return f"{self.brand.name} - {self.name}"
     
+    def save(self, *args, **kwargs):
+        """Пересчитать цену со скидкой перед сохранением"""
+        self.effective_price = self.get_discounted_price()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'price', 'discount'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'effective_price'}
+        super().save(*args, **kwargs)
+    
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        # Рейтинг могли изменить отзывы после загрузки товара: обычный save()
+        # не перезаписывает его столбцы (их меняет только change_rating).
+        # Остальное поведение save() не меняется: пропавшая строка вставляется заново
+        if update_fields is None:
+            values = [value for value in values if value[0].attname not in self.RATING_FIELDS]
+        return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+    
+    @classmethod
+    def change_rating(cls, product_id, added=None, removed=None):
+        """
+        Учесть оценку added и/или убрать оценку removed одним UPDATE.
+        Вызывается в транзакции вместе с изменением отзыва
+        """
+        delta_sum = (added or 0) - (removed or 0)
+        delta_count = (added is not None) - (removed is not None)
+        new_sum = F('rating_sum') + delta_sum
+        new_count = F('rating_count') + delta_count
+        changes = {
+            'rating_sum': new_sum,
+            'rating_count': new_count,
+            # В SET используются старые значения столбцов, поэтому среднее - по новым выражениям
+            'rating_average': Coalesce(
+                ExpressionWrapper(
+                    Cast(new_sum, models.FloatField()) / NullIf(new_count, 0),
+                    output_field=models.FloatField()
+                ),
+                Value(0.0)
+            ),
+        }
+        for rating, delta in ((added, 1), (removed, -1)):
+            if rating is not None:
+                field = f'rating_{rating}'
+                changes[field] = changes.get(field, F(field)) + delta
+        cls.objects.filter(pk=product_id).update(**changes)
+    
+    @property
+    def rating_histogram(self):
+        """Количество оценок от 5 до 1: [(оценка, количество), ...]"""
+        return [(rating, getattr(self, f'rating_{rating}')) for rating in range(5, 0, -1)]
+    
     def get_absolute_url(self):
         return reverse('product_detail', kwargs={'slug': self.slug})
     
     def get_discounted_price(self):
         """Рассчитать цену со скидкой"""
-        if self.discount:
-            return self.price * (100 - self.discount) / 100
-        return self.price
+        return calculate_effective_price(self.price, self.discount)
     
     def get_category_display_name(self):
         """Получить отображаемое название категории"""
@@ -266,6 +420,136 @@ class Product(models.Model):
         return dict(self.GENDER_CHOICES).get(self.gender, self.gender)
 
 
+class Note(models.Model):
+    """Нота аромата (нормализованная)"""
+    name = models.CharField('Название', max_length=100)
+    stem = models.CharField('Основа', max_length=100, unique=True)
+    family = models.CharField(
+        'Семейство',
+        max_length=20,
+        choices=NOTE_FAMILY_CHOICES,
+        blank=True,
+        db_index=True
+    )
+    
+    class Meta:
+        verbose_name = 'Нота'
+        verbose_name_plural = 'Ноты'
+        ordering = ['name']
+    
+    def __str__(self):
+        return self.name
+
+
+class ProductNote(models.Model):
+    """Нота в составе парфюма"""
+    LEVEL_CHOICES = [
+        ('top', 'Верхняя'),
+        ('middle', 'Сердце'),
+        ('base', 'База'),
+    ]
+    
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        verbose_name='Товар',
+        related_name='product_notes'
+    )
+    note = models.ForeignKey(
+        Note,
+        on_delete=models.CASCADE,
+        verbose_name='Нота',
+        related_name='product_notes'
+    )
+    level = models.CharField('Уровень', max_length=10, choices=LEVEL_CHOICES)
+    
+    class Meta:
+        verbose_name = 'Нота товара'
+        verbose_name_plural = 'Ноты товаров'
+        unique_together = ['product', 'note', 'level']
+        indexes = [
+            models.Index(fields=['note', 'product']),
+        ]
+    
+    def __str__(self):
+        return f"{self.note} ({self.get_level_display()}) в {self.product_id}"
+
+
+class ProductNeighbor(models.Model):
+    """
+    Похожий товар (рассчитывается офлайн командой build_similar_products,
+    см. shop/similarity.py). rank - место соседа по убыванию близости
+    """
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        verbose_name='Товар',
+        related_name='neighbors'
+    )
+    neighbor = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        verbose_name='Похожий товар',
+        related_name='+'
+    )
+    rank = models.PositiveSmallIntegerField('Место')
+    score = models.FloatField('Близость')
+    
+    class Meta:
+        verbose_name = 'Похожий товар'
+        verbose_name_plural = 'Похожие товары'
+        # Индекс (product, rank) - чтение соседей товара одним запросом
+        unique_together = ['product', 'rank']
+    
+    def __str__(self):
+        return f"{self.neighbor_id} ({self.rank}) для {self.product_id}"
+
+
+class CoPurchase(models.Model):
+    """
+    Сколько заказов содержали оба товара (строка на каждое направление пары).
+    Заполняется командой build_copurchases, см. shop/copurchase.py
+    """
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        verbose_name='Товар',
+        related_name='copurchases'
+    )
+    other = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        verbose_name='Покупают вместе',
+        related_name='+'
+    )
+    count = models.PositiveIntegerField('Количество заказов', default=0)
+    
+    class Meta:
+        verbose_name = 'Совместная покупка'
+        verbose_name_plural = 'Совместные покупки'
+        unique_together = ['product', 'other']
+        indexes = [
+            # Самые частые пары товара - чтение по индексу
+            models.Index(fields=['product', '-count'], name='copurchase_product_count_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.product_id} + {self.other_id}: {self.count}"
+
+
+class JobWatermark(models.Model):
+    """Отметка фоновой задачи: до какого id данные уже обработаны"""
+    name = models.CharField('Задача', max_length=50, primary_key=True)
+    position = models.BigIntegerField('Обработано до id', default=0)
+    
+    class Meta:
+        verbose_name = 'Отметка задачи'
+        verbose_name_plural = 'Отметки задач'
+    
+    def __str__(self):
+        return f"{self.name}: {self.position}"
+
+
 class Review(models.Model):
     """Отзыв о товаре"""
     product = models.ForeignKey(
@@ -295,9 +579,37 @@ class Review(models.Model):
         verbose_name_plural = 'Отзывы'
         ordering = ['-created_at']
         unique_together = ['product', 'user']  # Один отзыв от пользователя на товар
+        indexes = [
+            # Лента отзывов товара от новых к старым (keyset-пагинация)
+            models.Index(fields=['product', '-created_at', '-id'], name='review_product_created_idx'),
+        ]
     
     def __str__(self):
         return f"Отзыв от {self.user} на {self.product.name}"
+    
+    def save(self, *args, **kwargs):
+        """Сохранить отзыв и обновить рейтинг товара в одной транзакции"""
+        with transaction.atomic():
+            previous = None
+            if not self._state.adding:
+                previous = (
+                    Review.objects.select_for_update()
+                    .filter(pk=self.pk)
+                    .values_list('product_id', 'rating')
+                    .first()
+                )
+            # Отзыв перенесли на другой товар: сигнал post_save (он срабатывает
+            # внутри super().save()) сбросит кэш и старого товара
+            self._previous_product_id = previous[0] if previous is not None else None
+            super().save(*args, **kwargs)
+            if previous == (self.product_id, self.rating):
+                return
+            if previous is not None and previous[0] == self.product_id:
+                Product.change_rating(self.product_id, added=self.rating, removed=previous[1])
+                return
+            if previous is not None:
+                Product.change_rating(previous[0], removed=previous[1])
+            Product.change_rating(self.product_id, added=self.rating)
 
 
 class Cart(models.Model):
@@ -318,13 +630,50 @@ class Cart(models.Model):
     def __str__(self):
         return f"Корзина пользователя {self.user}"
     
+    def get_summary(self):
+        """Итоги корзины (количество и стоимость со скидкой) одним запросом"""
+        return CartItem.objects.filter(cart=self).summary()
+    
     def get_total_price(self):
         """Получить общую стоимость товаров в корзине"""
-        return sum(item.get_total_price() for item in self.items.all() if item.product)
+        return self.get_summary().total_price
     
     def get_total_items(self):
         """Получить общее количество товаров в корзине"""
-        return sum(item.quantity for item in self.items.all())
+        return self.get_summary().total_items
+
+
+CartSummary = namedtuple(
+    'CartSummary', ['positions', 'total_items', 'total_price', 'item_total'], defaults=[None]
+)
+
+
+class CartItemQuerySet(models.QuerySet):
+    @staticmethod
+    def _line_total():
+        return ExpressionWrapper(
+            F('quantity') * F('product__effective_price'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2)
+        )
+    
+    def with_line_total(self):
+        """Добавить к элементам сумму позиции по эффективной цене (line_total)"""
+        return self.annotate(line_total=self._line_total())
+    
+    def summary(self, item_id=None):
+        """
+        Количество позиций, штук и стоимость по эффективной цене товаров.
+        Если передан item_id, тем же запросом считается и сумма этого элемента.
+        """
+        line_total = self._line_total()
+        totals = {
+            'positions': Count('id'),
+            'total_items': Coalesce(Sum('quantity'), 0),
+            'total_price': Coalesce(Sum(line_total), Value(Decimal('0')), output_field=line_total.output_field),
+        }
+        if item_id is not None:
+            totals['item_total'] = Sum(line_total, filter=Q(id=item_id))
+        return CartSummary(**self.order_by().aggregate(**totals))
 
 
 class CartItem(models.Model):
@@ -347,6 +696,8 @@ class CartItem(models.Model):
     )
     added_at = models.DateTimeField('Дата добавления', auto_now_add=True)
     
+    objects = CartItemQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Элемент корзины'
         verbose_name_plural = 'Элементы корзины'
@@ -357,13 +708,53 @@ class CartItem(models.Model):
     
     def get_total_price(self):
         """Получить общую стоимость этого элемента"""
-        return self.product.get_discounted_price() * self.quantity
+        return self.product.effective_price * self.quantity
     
     def can_increase(self):
         """Можно ли увеличить количество (проверка наличия)"""
         # Здесь можно добавить логику проверки наличия на складе
         return self.product.in_stock
 
+
+class OrderNumberSequence(models.Model):
+    """
+    Счетчик номеров заказов за день.
+    
+    Номер выдается одним оператором INSERT ... ON CONFLICT DO UPDATE,
+    увеличивающим счетчик в БД, без поиска последнего заказа. Если номер
+    берется внутри транзакции заказа, откат заказа откатывает и счетчик,
+    поэтому номера идут без пропусков.
+    """
+    day = models.DateField('День', primary_key=True)
+    last_value = models.PositiveIntegerField('Последний выданный номер', default=0)
+    
+    class Meta:
+        verbose_name = 'Счетчик номеров заказов'
+        verbose_name_plural = 'Счетчики номеров заказов'
+    
+    def __str__(self):
+        return f"{self.day}: {self.last_value}"
+    
+    @classmethod
+    def next_value(cls, day):
+        """Следующее значение счетчика за день"""
+        table = connection.ops.quote_name(cls._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (day, last_value) VALUES (%s, 1) '
+                f'ON CONFLICT (day) DO UPDATE SET last_value = {table}.last_value + 1 '
+                f'RETURNING last_value',
+                [connection.ops.adapt_datefield_value(day)]
+            )
+            return cursor.fetchone()[0]
+    
+    @classmethod
+    def next_number(cls):
+        """Следующий номер заказа вида ORD-ГГГГММДД-NNNN"""
+        day = timezone.localdate()
+        return f"ORD-{day:%Y%m%d}-{cls.next_value(day):04d}"
+
+
 class Order(models.Model):
     """Заказ"""
     STATUS_CHOICES = [
@@ -415,6 +806,11 @@ class Order(models.Model):
     # Комментарии
     comment = models.TextField('Комментарий к заказу', blank=True)
     
+    # Денормализованные данные позиций, чтобы списки заказов не читали OrderItem:
+    # количество товаров (сумма quantity) и краткий состав "Название × 2, ..."
+    total_items = models.PositiveIntegerField('Количество товаров', default=0)
+    items_summary = models.CharField('Состав заказа', max_length=255, blank=True)
+    
     created_at = models.DateTimeField('Дата создания заказа', auto_now_add=True)
     updated_at = models.DateTimeField('Дата обновления', auto_now=True)
     
@@ -422,6 +818,10 @@ class Order(models.Model):
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
         ordering = ['-created_at']
+        indexes = [
+            # История заказов в личном кабинете (keyset пагинация)
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+        ]
     
     def __str__(self):
         return f"Заказ №{self.order_number} от {self.user}"
@@ -429,26 +829,46 @@ class Order(models.Model):
     def save(self, *args, **kwargs):
         """Генерация номера заказа при создании"""
         if not self.order_number:
-            import datetime
-            date_str = datetime.datetime.now().strftime('%Y%m%d')
-            last_order = Order.objects.filter(order_number__startswith=f'ORD-{date_str}').order_by('-id').first()
-            if last_order:
-                last_num = int(last_order.order_number.split('-')[-1])
-                new_num = last_num + 1
-            else:
-                new_num = 1
-            self.order_number = f'ORD-{date_str}-{new_num:04d}'
+            self.order_number = OrderNumberSequence.next_number()
         super().save(*args, **kwargs)
     
-    @property
-    def total_items(self):
-        """Общее количество товаров в заказе"""
-        return sum(item.quantity for item in self.items.all())
-    
-    @property
-    def can_be_deleted(self):
-        """Можно ли удалить заказ"""
-        return self.status == 'pending'
+    @classmethod
+    def build_items_summary(cls, lines):
+        """
+        Краткий состав заказа по парам (название, количество).
+        Не помещающиеся позиции заменяются на "и еще N поз."
+        """
+        max_length = cls._meta.get_field('items_summary').max_length
+        parts = [f'{name} × {quantity}' for name, quantity in lines]
+        shown, length = [], 0
+        for index, part in enumerate(parts):
+            rest = len(parts) - index - 1
+            suffix = len(f' и еще {rest} поз.') if rest else 0
+            part_length = length + (2 if shown else 0) + len(part)
+            if part_length + suffix > max_length:
+                break
+            shown.append(part)
+            length = part_length
+        if parts and not shown:
+            # Не поместилось даже первое название - обрезаем его
+            rest = len(parts) - 1
+            suffix = f' и еще {rest} поз.' if rest else ''
+            return parts[0][:max_length - len(suffix) - 1] + '…' + suffix
+        summary = ', '.join(shown)
+        rest = len(parts) - len(shown)
+        if rest:
+            summary = f'{summary} и еще {rest} поз.'
+        return summary[:max_length]
+    
+    def refresh_items_totals(self):
+        """Пересчитать total_items и items_summary по позициям заказа"""
+        lines = list(self.items.order_by('id').values_list('product_name', 'quantity'))
+        self.total_items = sum(quantity for name, quantity in lines)
+        self.items_summary = self.build_items_summary(lines)
+        Order.objects.filter(pk=self.pk).update(
+            total_items=self.total_items,
+            items_summary=self.items_summary
+        )
     
     def can_be_deleted(self):
         """Можно ли удалить заказ (только если он в обработке)"""
@@ -514,4 +934,49 @@ class Wishlist(models.Model):
         verbose_name_plural = 'Списки желаний'
     
     def __str__(self):
-        return f"Список желаний пользователя {self.user}"
\ No newline at end of file
+        return f"Список желаний пользователя {self.user}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    Ключ идемпотентности запроса (заголовок Idempotency-Key).
+    Хранит ответ на первый успешный запрос с этим ключом, чтобы повтор
+    вернул его без повторного выполнения. Пока запрос выполняется,
+    status_code пустой.
+    """
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь',
+        related_name='idempotency_keys'
+    )
+    key = models.CharField('Ключ', max_length=64)
+    fingerprint = models.CharField('Отпечаток запроса', max_length=64)
+    status_code = models.PositiveSmallIntegerField('Код ответа', null=True, blank=True)
+    response_body = models.TextField('Тело ответа', blank=True)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True, db_index=True)
+    
+    class Meta:
+        verbose_name = 'Ключ идемпотентности'
+        verbose_name_plural = 'Ключи идемпотентности'
+        unique_together = ['user', 'key']
+    
+    def __str__(self):
+        return f"{self.key} ({self.user})"
+
+
+class RateLimitBucket(models.Model):
+    """
+    Корзина токенов ограничителя частоты запросов (см. shop.ratelimit).
+    Отрицательный tokens означает, что последний запрос был отклонен.
+    """
+    key = models.CharField('Ключ', max_length=150, primary_key=True)
+    tokens = models.FloatField('Токены')
+    updated_at = models.FloatField('Время обновления (Unix)', db_index=True)
+    
+    class Meta:
+        verbose_name = 'Корзина токенов'
+        verbose_name_plural = 'Корзины токенов'
+    
+    def __str__(self):
+        return f"{self.key}: {self.tokens:.2f}"
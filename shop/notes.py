@@ -0,0 +1,123 @@
+"""
+Таксономия нот аромата.
+
+Строки notes_top / notes_middle / notes_base разбиваются на отдельные ноты,
+каждая нота нормализуется (нижний регистр, ё -> е, отбрасывание окончаний)
+и получает семейство. Результат хранится в таблицах Note / ProductNote,
+поэтому фильтр по семействам нот выполняется индексированным соединением,
+а не поиском подстроки.
+"""
+import re
+
+
+# Семейства нот: значение фильтра -> (название, основы слов)
+NOTE_FAMILIES = {
+    'woody': ('Древесные', (
+        'древ', 'сандал', 'кедр', 'ветивер', 'пачул', 'дуб', 'мох', 'береза', 'гваяк',
+        'woody', 'wood', 'sandal', 'cedar', 'vetiver', 'patchouli', 'oud',
+    )),
+    'floral': ('Цветочные', (
+        'цвет', 'роз', 'жасмин', 'ирис', 'фиалк', 'пион', 'ландыш', 'тубероз', 'магнол',
+        'флердоранж', 'лаванд', 'floral', 'flower', 'rose', 'jasmine', 'iris', 'violet', 'lavender',
+    )),
+    'fresh': ('Свежие', (
+        'свеж', 'морск', 'озон', 'мят', 'огурц', 'зелен', 'аквати',
+        'fresh', 'marine', 'aquatic', 'mint', 'green',
+    )),
+    'oriental': ('Ориентальные', (
+        'вост', 'ванил', 'амбр', 'специ', 'ладан', 'кориц', 'перец', 'перц', 'мускус', 'смол',
+        'oriental', 'amber', 'vanilla', 'spice', 'pepper', 'incense', 'musk',
+    )),
+    'citrus': ('Цитрусовые', (
+        'цитрус', 'бергамот', 'лимон', 'апельсин', 'мандарин', 'грейпфрут', 'лайм', 'нероли',
+        'citrus', 'bergamot', 'lemon', 'orange', 'mandarin', 'grapefruit', 'lime', 'neroli',
+    )),
+}
+
+NOTE_FAMILY_CHOICES = [(key, label) for key, (label, stems) in NOTE_FAMILIES.items()]
+
+NOTE_LEVELS = ('top', 'middle', 'base')
+
+# Окончания прилагательных и существительных, от длинных к коротким.
+# Суффикс -ов-/-ев- относительных прилагательных отбрасывается вместе
+# с окончанием: "сандаловый" и "сандал" дают одну основу
+_ENDINGS = (
+    'овыми', 'евыми', 'ового', 'евого', 'овому', 'евому',
+    'овая', 'евая', 'овое', 'евое', 'овые', 'евые', 'овый', 'евый', 'овой', 'евой',
+    'овую', 'евую', 'овых', 'евых', 'овым', 'евым', 'овом', 'евом',
+    'иями', 'ями', 'ами', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими',
+    'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ей', 'ом', 'ем',
+    'ам', 'ям', 'ах', 'ях', 'ую', 'юю', 'ов', 'ев',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+)
+_SEPARATORS = re.compile(r'[,;/\n]+|\s+и\s+|\s+and\s+')
+_WORD = re.compile(r'[a-zа-я]+')
+
+
+def stem_word(word):
+    """Отбросить окончание русского слова (оставляя не меньше 3 букв)"""
+    if not re.fullmatch('[а-я]+', word):
+        return word
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def normalize(text):
+    return text.lower().replace('ё', 'е')
+
+
+def split_notes(text):
+    """
+    Разбить строку нот на пары (название, основа).
+    Пример: 'Бергамот, розовый перец и древесные ноты' ->
+    [('бергамот', 'бергамот'), ('розовый перец', 'розов перец'), ...]
+    """
+    notes = []
+    for part in _SEPARATORS.split(normalize(text or '')):
+        words = _WORD.findall(part)
+        if not words:
+            continue
+        name = ' '.join(words)
+        stem = ' '.join(stem_word(word) for word in words)
+        notes.append((name[:100], stem[:100]))
+    return notes
+
+
+def note_family(stem):
+    """
+    Семейство ноты по ее основе.
+    Если в ноте упомянуто несколько семейств ('свежие цитрусовые'),
+    берется последнее: в русских словосочетаниях главное слово стоит в конце.
+    """
+    best, best_position = '', -1
+    for family, (label, stems) in NOTE_FAMILIES.items():
+        for family_stem in stems:
+            position = stem.rfind(family_stem)
+            if position > best_position:
+                best, best_position = family, position
+    return best
+
+
+def sync_product_notes(product):
+    """Записать ноты товара в таблицы Note / ProductNote"""
+    from .models import Note, ProductNote
+
+    parsed = {}
+    for level in NOTE_LEVELS:
+        for name, stem in split_notes(getattr(product, f'notes_{level}')):
+            parsed.setdefault((stem, level), name)
+
+    stems = {stem: name for (stem, level), name in parsed.items()}
+    Note.objects.bulk_create(
+        [Note(name=name, stem=stem, family=note_family(stem)) for stem, name in stems.items()],
+        ignore_conflicts=True
+    )
+    note_ids = dict(Note.objects.filter(stem__in=stems).values_list('stem', 'id'))
+
+    ProductNote.objects.filter(product=product).delete()
+    ProductNote.objects.bulk_create([
+        ProductNote(product=product, note_id=note_ids[stem], level=level)
+        for (stem, level) in parsed
+    ])
@@ -0,0 +1,120 @@
+"""
+Оформление заказа.
+
+Заказ собирается из корзины за фиксированное число запросов независимо от
+количества позиций: блокировка корзины, одно чтение позиций вместе с
+товарами, создание заказа, один bulk_create позиций заказа и одно удаление
+позиций корзины. Длительность каждого этапа пишется в лог shop.orders.
+"""
+import logging
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+
+from . import cart as cart_ops
+from .models import CartItem, Order, OrderItem
+
+
+logger = logging.getLogger(__name__)
+
+
+class OrderError(Exception):
+    """Заказ нельзя оформить (пустая корзина, товара нет в наличии)"""
+
+
+class StageTimer:
+    """Замер длительности этапов, в миллисекундах"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = round((time.perf_counter() - started) * 1000, 2)
+
+    @property
+    def total(self):
+        return round((time.perf_counter() - self.started) * 1000, 2)
+
+    def format(self):
+        return ' '.join(f'{name}_ms={value}' for name, value in self.stages.items())
+
+
+def create_order(user, data):
+    """
+    Оформить заказ из корзины пользователя.
+
+    Первой операцией транзакции обновляется строка корзины (touch_cart):
+    она блокируется до конца транзакции, поэтому параллельные изменения
+    корзины и повторное оформление ждут, а SQLite сразу берет блокировку
+    записи и не упирается в повышение блокировки посреди транзакции.
+    """
+    timer = StageTimer()
+    full_name = f"{user.surname} {user.name} {user.patronymic or ''}".strip()
+
+    with transaction.atomic():
+        with timer.stage('lock_cart'):
+            cart_id = cart_ops.touch_cart(user)
+
+        with timer.stage('read_items'):
+            items = list(
+                CartItem.objects.filter(cart_id=cart_id)
+                .select_related('product')
+                .only('quantity', 'product__name', 'product__in_stock', 'product__effective_price')
+                .order_by('id')
+            )
+        if not items:
+            raise OrderError('Корзина пуста')
+        for item in items:
+            if not item.product.in_stock:
+                raise OrderError(f'Товар "{item.product.name}" отсутствует на складе')
+
+        with timer.stage('create_order'):
+            # Номер заказа выдает Order.save() из счетчика OrderNumberSequence
+            order = Order.objects.create(
+                user=user,
+                status='pending',
+                payment_method=data.get('payment_method', 'cash'),
+                total_price=sum(item.product.effective_price * item.quantity for item in items),
+                full_name=full_name,
+                email=user.email,
+                phone=user.phone_number or '',
+                address=data.get('address', 'Не указан'),
+                city=data.get('city', 'Не указан'),
+                postal_code=data.get('postal_code', ''),
+                comment=data.get('comment', ''),
+                total_items=sum(item.quantity for item in items),
+                items_summary=Order.build_items_summary(
+                    (item.product.name, item.quantity) for item in items
+                ),
+            )
+
+        with timer.stage('create_items'):
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product_id=item.product_id,
+                    product_name=item.product.name,
+                    product_price=item.product.effective_price,
+                    quantity=item.quantity,
+                )
+                for item in items
+            ])
+
+        with timer.stage('clear_cart'):
+            CartItem.objects.filter(cart_id=cart_id).delete()
+
+    cart_ops.forget_cart_count(user.pk)
+
+    logger.info(
+        'order_created order=%s user=%s items=%d total_ms=%s %s',
+        order.order_number, user.pk, len(items), timer.total, timer.format(),
+        extra={'order_number': order.order_number, 'stages': timer.stages},
+    )
+    return order
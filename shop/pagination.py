@@ -0,0 +1,176 @@
+"""
+Keyset (seek) пагинация.
+
+Вместо OFFSET следующая страница выбирается условием "после последней
+записи предыдущей страницы" по ключу сортировки, поэтому стоимость
+запроса не растет с номером страницы. Позиция передается клиенту
+непрозрачным токеном (cursor).
+"""
+import base64
+import datetime
+import decimal
+import json
+from collections.abc import Sequence
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class CursorEncoder(json.JSONEncoder):
+    """
+    JSON для значений ключа сортировки. В отличие от DjangoJSONEncoder
+    не обрезает микросекунды, иначе сравнение по дате было бы неточным.
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.date)):
+            return o.isoformat()
+        if isinstance(o, decimal.Decimal):
+            return str(o)
+        return super().default(o)
+
+
+def encode_cursor(values, direction, number):
+    """Упаковать ключ сортировки в токен для URL"""
+    payload = json.dumps({'k': values, 'd': direction, 'n': number}, cls=CursorEncoder)
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Распаковать токен; ValueError, если токен поврежден"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values, direction, number = payload['k'], payload['d'], int(payload['n'])
+    except (TypeError, KeyError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Некорректный курсор') from e
+    if direction not in ('next', 'prev') or not isinstance(values, list) or number < 1:
+        raise ValueError('Некорректный курсор')
+    # В ключе сортировки только скаляры: объекты и списки не приводятся к полям
+    if not all(value is None or isinstance(value, (str, int, float)) for value in values):
+        raise ValueError('Некорректный курсор')
+    return values, direction, number
+
+
+def _seek_filter(ordering, values, reverse=False):
+    """
+    Условие "строго после ключа values" для сортировки ordering:
+    (a > x) OR (a = x AND b > y) OR ...
+    """
+    condition = Q()
+    equal = {}
+    for field, value in zip(ordering, values):
+        descending = field.startswith('-')
+        name = field.lstrip('-')
+        lookup = 'lt' if descending != reverse else 'gt'
+        condition |= Q(**equal, **{f'{name}__{lookup}': value})
+        equal[name] = value
+    return condition
+
+
+def _reverse_ordering(ordering):
+    return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+
+class KeysetPage(Sequence):
+    """Страница результатов, совместимая по интерфейсу с django.core.paginator.Page"""
+
+    def __init__(self, object_list, number, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<KeysetPage {self.number} of {self.paginator.num_pages}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Пагинатор по ключу сортировки.
+
+    ordering должен однозначно упорядочивать записи, поэтому последним
+    полем всегда идет первичный ключ. count можно передать заранее
+    (например, из фасетного индекса), чтобы не выполнять COUNT(*).
+    """
+
+    def __init__(self, queryset, ordering, per_page, count=None):
+        ordering = list(ordering)
+        if ordering[-1].lstrip('-') not in ('id', 'pk'):
+            ordering.append('id')
+        self.queryset = queryset
+        self.ordering = ordering
+        self.per_page = per_page
+        self._count = count
+
+    @cached_property
+    def count(self):
+        if self._count is not None:
+            return self._count
+        return self.queryset.count()
+
+    @property
+    def num_pages(self):
+        return max(1, -(-self.count // self.per_page))
+
+    def _key(self, obj):
+        key = []
+        for field in self.ordering:
+            value = obj
+            for part in field.lstrip('-').split('__'):
+                value = getattr(value, part)
+            key.append(value)
+        return key
+
+    def page(self, cursor=None):
+        """Получить страницу по токену (None - первая страница)"""
+        values, direction, number = None, 'next', 1
+        queryset = self.queryset
+        if cursor:
+            try:
+                values, direction, number = decode_cursor(cursor)
+                if len(values) != len(self.ordering):
+                    raise ValueError('Курсор от другой сортировки')
+                queryset = queryset.filter(
+                    _seek_filter(self.ordering, values, reverse=direction == 'prev')
+                )
+            except (TypeError, ValueError, ValidationError):
+                # Некорректный курсор - начинаем с первой страницы
+                values, direction, number = None, 'next', 1
+                queryset = self.queryset
+
+        backwards = direction == 'prev'
+        ordering = _reverse_ordering(self.ordering) if backwards else self.ordering
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = values is not None, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        next_cursor = previous_cursor = None
+        if rows and has_next:
+            next_cursor = encode_cursor(self._key(rows[-1]), 'next', number + 1)
+        if rows and has_previous and number > 1:
+            previous_cursor = encode_cursor(self._key(rows[0]), 'prev', number - 1)
+        return KeysetPage(rows, number, self, next_cursor, previous_cursor)
@@ -0,0 +1,164 @@
+"""
+Кэш страницы товара.
+
+Для каждого товара в наличии в кэше хранится набор данных страницы:
+товар с брендом и категорией, заранее вычисленный список id похожих
+товаров (из таблицы ProductNeighbor, а пока она не рассчитана - той же
+категории или бренда) и id товаров, которые покупают вместе с ним
+(таблица CoPurchase). Страница товара при попадании в
+кэш не выполняет запросов за товаром; похожие товары и товары,
+которые покупают вместе, выбираются по первичным ключам одним запросом.
+
+Набор сбрасывается сигналами при сохранении товара, бренда или
+категории (товара - после фиксации транзакции) и строится заново при
+следующем просмотре. Списки похожих товаров других карточек сигналы не трогают,
+поэтому у записей есть срок жизни PRODUCT_CACHE_TIMEOUT, а команда
+refresh_product_cache перестраивает все наборы (для периодического
+запуска).
+
+Отдельно кэшируется первая страница ленты отзывов товара (API отзывов):
+ее сбрасывает сигнал при любом изменении отзыва товара, следующие
+страницы читаются из БД по индексу (product, -created_at, -id).
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, IntegerField, Q, When
+
+
+ProductBundle = namedtuple(
+    'ProductBundle', ['product', 'similar_ids', 'bought_together_ids'], defaults=[()]
+)
+
+# Сколько похожих товаров показывается на странице
+SIMILAR_PRODUCTS_COUNT = 4
+# Сколько id похожих товаров хранится: часть может закончиться до обновления кэша
+SIMILAR_IDS_COUNT = 8
+
+
+def _key(slug):
+    return f'shop:product:{slug}'
+
+
+def _reviews_key(product_id):
+    return f'shop:product:{product_id}:reviews'
+
+
+def _timeout():
+    return getattr(settings, 'PRODUCT_CACHE_TIMEOUT', 3600)
+
+
+def _similar_ids(product):
+    from .models import Product, ProductNeighbor
+
+    # Рассчитанные соседи (shop/similarity.py) - одно чтение по индексу
+    similar_ids = list(
+        ProductNeighbor.objects.filter(product=product)
+        .order_by('rank')
+        .values_list('neighbor_id', flat=True)[:SIMILAR_IDS_COUNT]
+    )
+    if similar_ids:
+        return similar_ids
+    # Соседи еще не рассчитаны - товары той же категории или бренда
+    return list(
+        Product.objects.filter(in_stock=True)
+        .exclude(id=product.id)
+        .filter(Q(category=product.category_id) | Q(brand=product.brand_id))
+        .values_list('id', flat=True)[:SIMILAR_IDS_COUNT]
+    )
+
+
+def build_bundle(product):
+    """Набор данных страницы для товара (бренд и категория должны быть загружены)"""
+    from .copurchase import bought_together_ids
+
+    return ProductBundle(product, _similar_ids(product), bought_together_ids(product.id))
+
+
+def store_bundles(bundles):
+    """Записать готовые наборы в кэш одним обращением"""
+    cache.set_many({_key(bundle.product.slug): bundle for bundle in bundles}, _timeout())
+
+
+def refresh_product(slug):
+    """Перестроить набор товара slug. Возвращает набор или None, если товара нет в наличии"""
+    from .models import Product
+
+    product = (
+        Product.objects.select_related('brand', 'category')
+        .filter(slug=slug, in_stock=True)
+        .first()
+    )
+    if product is None:
+        cache.delete(_key(slug))
+        return None
+    bundle = build_bundle(product)
+    cache.set(_key(slug), bundle, _timeout())
+    return bundle
+
+
+def get_product_bundle(slug):
+    """Набор данных страницы товара slug (None - товара нет в наличии)"""
+    bundle = cache.get(_key(slug))
+    if bundle is None:
+        bundle = refresh_product(slug)
+    return bundle
+
+
+def products_by_ids(ids, limit):
+    """Товары в наличии в порядке ids (ленивый QuerySet по первичным ключам)"""
+    from .models import Product
+
+    position = Case(
+        *[When(id=product_id, then=rank) for rank, product_id in enumerate(ids)],
+        output_field=IntegerField()
+    )
+    return (
+        Product.objects.filter(id__in=ids, in_stock=True)
+        .select_related('brand')
+        .order_by(position)[:limit]
+    )
+
+
+def page_products(bundle):
+    """
+    Похожие товары и товары, которые покупают вместе с товаром страницы.
+
+    Оба списка выбираются одним запросом по первичным ключам и
+    раскладываются в порядке id из набора.
+    """
+    from .copurchase import RECOMMENDATIONS_COUNT
+    from .models import Product
+
+    ids = set(bundle.similar_ids) | set(bundle.bought_together_ids)
+    if not ids:
+        return [], []
+    products = Product.objects.filter(id__in=ids, in_stock=True).select_related('brand').in_bulk()
+
+    def pick(product_ids, limit):
+        return [products[product_id] for product_id in product_ids if product_id in products][:limit]
+
+    return (
+        pick(bundle.similar_ids, SIMILAR_PRODUCTS_COUNT),
+        pick(bundle.bought_together_ids, RECOMMENDATIONS_COUNT),
+    )
+
+
+def forget_products(slugs):
+    """Сбросить наборы товаров (следующий просмотр построит их заново)"""
+    cache.delete_many([_key(slug) for slug in slugs])
+
+
+def get_first_reviews_page(product_id):
+    """Закэшированная первая страница отзывов товара (None - нет в кэше)"""
+    return cache.get(_reviews_key(product_id))
+
+
+def store_first_reviews_page(product_id, data):
+    cache.set(_reviews_key(product_id), data, _timeout())
+
+
+def forget_reviews(product_ids):
+    """Сбросить первые страницы отзывов товаров"""
+    cache.delete_many([_reviews_key(product_id) for product_id in product_ids])
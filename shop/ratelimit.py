@@ -0,0 +1,120 @@
+"""
+Ограничение частоты запросов входа и регистрации.
+
+Корзины токенов ("token bucket") хранятся в таблице RateLimitBucket,
+поэтому лимит общий для всех процессов gunicorn. Пополнение и списание
+токена выполняются одним оператором INSERT ... ON CONFLICT DO UPDATE:
+значение пересчитывается в БД, и параллельные запросы не обходят лимит.
+Проверка выполняется до разбора формы и хеширования пароля.
+
+Настройка RATE_LIMITS: {область: {вид ключа: (емкость, период в секундах)}},
+где вид ключа - 'ip' или 'login'. Корзина вмещает "емкость" запросов и
+полностью наполняется за "период". Пустой словарь отключает ограничение.
+"""
+import hashlib
+import json
+import math
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+from django.http import JsonResponse
+
+from .models import RateLimitBucket
+
+
+def _table():
+    return connection.ops.quote_name(RateLimitBucket._meta.db_table)
+
+
+def consume(key, capacity, period, now=None):
+    """
+    Списать токен из корзины key. Возвращает 0, если запрос разрешен,
+    иначе через сколько секунд появится следующий токен.
+    """
+    rate = capacity / period
+    now = time.time() if now is None else now
+    table = _table()
+    key_column = connection.ops.quote_name('key')
+    # Отрицательное значение хранит отклоненный запрос: реальный остаток на 1 больше
+    available = (
+        f'(CASE WHEN {table}.tokens < 0 THEN {table}.tokens + 1 ELSE {table}.tokens END'
+        f' + (%s - {table}.updated_at) * %s)'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {table} ({key_column}, tokens, updated_at) VALUES (%s, %s, %s) '
+            f'ON CONFLICT ({key_column}) DO UPDATE SET '
+            f'tokens = (CASE WHEN {available} > %s THEN %s ELSE {available} END) - 1, '
+            f'updated_at = excluded.updated_at '
+            f'RETURNING tokens',
+            [key, capacity - 1, now, now, rate, capacity, capacity, now, rate]
+        )
+        tokens = cursor.fetchone()[0]
+    if tokens >= 0:
+        return 0
+    return -tokens / rate
+
+
+def client_ip(request):
+    """IP клиента из заголовка RATE_LIMIT_IP_META (за прокси - например HTTP_X_REAL_IP)"""
+    return request.META.get(getattr(settings, 'RATE_LIMIT_IP_META', 'REMOTE_ADDR'), '') or 'unknown'
+
+
+def login_digest(login):
+    """Ключ корзины для логина: хеш, чтобы длина ключа не зависела от ввода"""
+    return hashlib.sha256(login.strip().lower().encode()).hexdigest()[:32]
+
+
+def _login_value(request):
+    try:
+        value = json.loads(request.body).get('login')
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(value, str) or not value:
+        return None
+    return login_digest(value)
+
+
+def check(scope, request):
+    """Проверить все лимиты области scope. Возвращает секунды ожидания или 0"""
+    limits = getattr(settings, 'RATE_LIMITS', {}).get(scope, {})
+    values = {'ip': lambda: client_ip(request), 'login': lambda: _login_value(request)}
+    wait = 0
+    for kind, (capacity, period) in limits.items():
+        value = values[kind]()
+        if value is None:
+            continue
+        wait = max(wait, consume(f'{scope}:{kind}:{value}', capacity, period))
+    return wait
+
+
+def rate_limit(scope):
+    """Декоратор API: при превышении лимита ответ 429 без вызова представления"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            wait = check(scope, request)
+            if wait:
+                response = JsonResponse({
+                    'success': False,
+                    'error': 'Слишком много попыток, попробуйте позже'
+                }, status=429)
+                response['Retry-After'] = str(math.ceil(wait))
+                return response
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def purge_idle(now=None):
+    """Удалить корзины, которые уже успели наполниться (эквивалентны отсутствующим)"""
+    periods = [
+        period
+        for limits in getattr(settings, 'RATE_LIMITS', {}).values()
+        for capacity, period in limits.values()
+    ]
+    now = time.time() if now is None else now
+    deleted, _ = RateLimitBucket.objects.filter(updated_at__lt=now - max(periods, default=0)).delete()
+    return deleted
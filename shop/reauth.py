@@ -0,0 +1,45 @@
+"""
+Недавнее подтверждение пароля.
+
+После успешной проверки пароля (вход или оформление заказа) в сессию
+записывается подписанный HMAC токен с меткой времени. В течение
+REAUTH_WINDOW секунд оформление заказа не требует пароля и не запускает
+дорогое хеширование. Токен привязан к пользователю и к хешу его пароля,
+поэтому смена пароля сразу делает его недействительным.
+"""
+from django.conf import settings
+from django.core import signing
+
+
+SESSION_KEY = '_shop_reauth'
+SALT = 'shop.reauth'
+
+
+def _window():
+    return getattr(settings, 'REAUTH_WINDOW', 300)
+
+
+def _payload(user):
+    return {'u': user.pk, 'h': user.get_session_auth_hash()}
+
+
+def mark_reauthenticated(request, user=None):
+    """Запомнить, что пользователь только что подтвердил пароль"""
+    user = user or request.user
+    request.session[SESSION_KEY] = signing.dumps(_payload(user), salt=SALT)
+
+
+def is_recently_reauthenticated(request):
+    """Подтверждал ли пользователь пароль в последние REAUTH_WINDOW секунд"""
+    token = request.session.get(SESSION_KEY)
+    if not token or not request.user.is_authenticated:
+        return False
+    try:
+        payload = signing.loads(token, salt=SALT, max_age=_window())
+    except signing.BadSignature:
+        return False
+    return payload == _payload(request.user)
+
+
+def forget_reauthentication(request):
+    request.session.pop(SESSION_KEY, None)
@@ -0,0 +1,183 @@
+"""
+Поиск по товарам.
+
+Бэкенд выбирается настройкой SEARCH_BACKEND:
+- SQLiteFTSSearchBackend - полнотекстовый индекс FTS5 с ранжированием BM25;
+- DatabaseSearchBackend - поиск через icontains (для других СУБД).
+
+Для русского языка слова стеммируются до записи в индекс и в запросе
+(см. shop.notes.stem_word), английские слова стеммирует токенизатор porter.
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .notes import normalize, stem_word
+
+
+FTS_TABLE = 'shop_product_fts'
+
+# Веса колонок для BM25: совпадение в названии важнее, чем в описании
+FTS_COLUMNS = ('name', 'brand', 'notes', 'description')
+FTS_WEIGHTS = (10.0, 5.0, 3.0, 1.0)
+
+_WORD = re.compile(r'[0-9a-zа-я]+')
+
+
+def stem_text(text):
+    """Привести текст к последовательности основ слов"""
+    return ' '.join(stem_word(word) for word in _WORD.findall(normalize(text or '')))
+
+
+def build_match_query(query):
+    """
+    Превратить пользовательский запрос в выражение MATCH для FTS5:
+    каждое слово ищется как префикс основы, слова объединяются через AND.
+    """
+    terms = [stem_word(word) for word in _WORD.findall(normalize(query))]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+class BaseSearchBackend:
+    """Интерфейс бэкенда поиска"""
+
+    def search(self, query):
+        """
+        Вернуть ленивый список найденных товаров, отсортированных по
+        релевантности. Список поддерживает count() и срезы, поэтому
+        его можно передавать в django.core.paginator.Paginator.
+        """
+        raise NotImplementedError
+
+    def paginate(self, query, page=1, per_page=None):
+        """Страница результатов поиска"""
+        per_page = per_page or settings.CATALOG_PAGE_SIZE
+        return Paginator(self.search(query), per_page).get_page(page)
+
+    def index_product(self, product):
+        pass
+
+    def remove_product(self, pk):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """Поиск подстрокой по полям товара (без индекса)"""
+
+    def search(self, query):
+        Product = _product_model()
+        if not query:
+            return Product.objects.none()
+        return Product.objects.filter(
+            Q(name__icontains=query) |
+            Q(brand__name__icontains=query) |
+            Q(description__icontains=query) |
+            Q(notes_top__icontains=query) |
+            Q(notes_middle__icontains=query) |
+            Q(notes_base__icontains=query),
+            in_stock=True
+        ).select_related('brand').order_by('-created_at')
+
+
+class FTSResults:
+    """Ленивый результат поиска по FTS5: count() и срезы выполняются в БД"""
+
+    def __init__(self, match):
+        self.match = match
+
+    def count(self):
+        if not self.match:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+                [self.match]
+            )
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        if not self.match:
+            return []
+        start = key.start or 0
+        limit = -1 if key.stop is None else max(key.stop - start, 0)
+        weights = ', '.join(str(weight) for weight in FTS_WEIGHTS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}, {weights}) LIMIT %s OFFSET %s',
+                [self.match, limit, start]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        products = _product_model().objects.select_related('brand').in_bulk(ids)
+        return [products[pk] for pk in ids if pk in products]
+
+
+class SQLiteFTSSearchBackend(BaseSearchBackend):
+    """
+    Полнотекстовый поиск SQLite FTS5.
+
+    Таблица создается миграцией 0007, обновляется сигналами при сохранении
+    товаров и брендов и полностью перестраивается командой
+    rebuild_search_index. В индекс попадают только товары в наличии.
+    """
+
+    def search(self, query):
+        return FTSResults(build_match_query(query))
+
+    def _row(self, product):
+        return (
+            product.pk,
+            stem_text(product.name),
+            stem_text(product.brand.name),
+            stem_text(' '.join([product.notes_top, product.notes_middle, product.notes_base])),
+            stem_text(product.description),
+        )
+
+    def index_product(self, product):
+        self.remove_product(product.pk)
+        if not product.in_stock:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(FTS_COLUMNS)}) VALUES (%s, %s, %s, %s, %s)',
+                self._row(product)
+            )
+
+    def remove_product(self, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [pk])
+
+    def rebuild(self):
+        products = _product_model().objects.filter(in_stock=True).select_related('brand')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, {", ".join(FTS_COLUMNS)}) VALUES (%s, %s, %s, %s, %s)',
+                (self._row(product) for product in products.iterator(chunk_size=2000))
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+
+
+def _product_model():
+    from .models import Product
+    return Product
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    """Бэкенд поиска из настройки SEARCH_BACKEND"""
+    backend = getattr(settings, 'SEARCH_BACKEND', 'shop.search.DatabaseSearchBackend')
+    return import_string(backend)()
@@ -0,0 +1,130 @@
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.db import transaction
+from django.dispatch import receiver
+
+from .facets import catalog_index
+from .models import Product, Brand, Category, Order, OrderItem, Review
+from .notes import NOTE_LEVELS, sync_product_notes
+from .product_cache import forget_products, forget_reviews
+from .search import get_search_backend
+from .stats import invalidate_stats
+from .suggest import suggest_index
+
+
+NOTE_FIELDS = tuple(f'notes_{level}' for level in NOTE_LEVELS)
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, raw=False, **kwargs):
+    """Запомнить прежние slug (набор страницы хранится в кэше по slug) и ноты"""
+    instance._previous_slug = instance._previous_notes = None
+    if instance.pk and not raw:
+        previous = Product.objects.filter(pk=instance.pk).values_list('slug', *NOTE_FIELDS).first()
+        if previous is not None:
+            instance._previous_slug, instance._previous_notes = previous[0], previous[1:]
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, **kwargs):
+    """Обновить ноты товара и товар в фасетном индексе каталога"""
+    if not raw:
+        # Ноты переписываются, только если строки нот изменились
+        notes = tuple(getattr(instance, field) for field in NOTE_FIELDS)
+        if getattr(instance, '_previous_notes', None) != notes:
+            sync_product_notes(instance)
+        get_search_backend().index_product(instance)
+    catalog_index.update_product(instance)
+    suggest_index.update_product(instance)
+    invalidate_stats()
+    # Набор страницы не перестраивается здесь: его построит следующий просмотр.
+    # Сброс - после фиксации транзакции, чтобы параллельный просмотр не
+    # закэшировал товар в состоянии до сохранения
+    slugs = {instance.slug, getattr(instance, '_previous_slug', None)} - {None}
+    transaction.on_commit(lambda: forget_products(slugs))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    """Убрать удаленный товар из фасетного индекса и поиска"""
+    catalog_index.discard(instance.pk)
+    get_search_backend().remove_product(instance.pk)
+    suggest_index.remove_product(instance.pk)
+    invalidate_stats()
+    forget_products([instance.slug])
+
+
+@receiver(post_save, sender=Brand)
+def brand_saved(sender, instance, raw=False, **kwargs):
+    """Название бренда входит в поисковый индекс и подсказки его товаров"""
+    suggest_index.update_brand(instance)
+    if raw:
+        return
+    backend = get_search_backend()
+    for product in instance.products.filter(in_stock=True).select_related('brand'):
+        backend.index_product(product)
+        suggest_index.update_product(product)
+
+
+@receiver(post_delete, sender=Brand)
+def brand_deleted(sender, instance, **kwargs):
+    suggest_index.remove_brand(instance.pk)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+def facet_label_saved(sender, instance, **kwargs):
+    """Обновить название бренда или категории в фильтрах каталога"""
+    facet = 'brand' if sender is Brand else 'category'
+    catalog_index.set_label(facet, instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Brand)
+@receiver(post_delete, sender=Category)
+def facet_label_deleted(sender, instance, **kwargs):
+    facet = 'brand' if sender is Brand else 'category'
+    catalog_index.set_label(facet, instance.pk, None)
+
+
+@receiver(post_save, sender=Brand)
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+def product_group_changed(sender, instance, **kwargs):
+    """Бренд и категория входят в кэшированные наборы страниц их товаров
+    (товары удаленного бренда удаляются каскадом и сбрасываются сами)"""
+    forget_products(instance.products.values_list('slug', flat=True))
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def order_item_changed(sender, instance, raw=False, origin=None, **kwargs):
+    """Позицию изменили вручную (админка): пересчитать количество и состав заказа.
+    create_order создает позиции через bulk_create и заполняет эти поля сам"""
+    if raw:
+        return
+    # Позиции удаляются каскадом вместе с заказом (или пользователем):
+    # пересчитывать удаляемый заказ незачем
+    if origin is not None and getattr(origin, 'model', type(origin)) is not OrderItem:
+        return
+    Order(pk=instance.order_id).refresh_items_totals()
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    """Убрать оценку из рейтинга товара (удаление выполняется в транзакции,
+    в том числе каскадное); создание и изменение отзыва учитывает Review.save"""
+    Product.change_rating(instance.product_id, removed=instance.rating)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def review_changed(sender, instance, **kwargs):
+    """Рейтинг входит в кэшированный набор страницы товара, отзыв - в первую
+    страницу ленты отзывов. Кэш сбрасывается после фиксации транзакции, иначе
+    параллельный запрос успел бы снова закэшировать старые данные"""
+    product_ids = {instance.product_id, getattr(instance, '_previous_product_id', None)} - {None}
+
+    def forget():
+        forget_reviews(product_ids)
+        forget_products(Product.objects.filter(pk__in=product_ids).values_list('slug', flat=True))
+
+    transaction.on_commit(forget)
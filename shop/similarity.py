@@ -0,0 +1,211 @@
+"""
+Похожие товары по содержанию.
+
+Для каждого товара в наличии строится вектор признаков: ноты (основы
+из таблицы ProductNote с весом уровня и IDF, чтобы частые ноты вроде
+бергамота значили меньше редких), семейства нот, пол, концентрация,
+ценовой диапазон и бренд. Каждая группа признаков нормируется и берется
+со своим весом из SIMILARITY_WEIGHTS, поэтому косинусная близость
+векторов - взвешенная сумма близостей по группам.
+
+Ближайшие соседи считаются офлайн командой build_similar_products
+блоками матричного умножения NumPy и сохраняются в таблицу
+ProductNeighbor. На странице товара соседи читаются одним запросом по
+индексу (product, rank) при построении кэшированного набора страницы.
+
+NumPy нужен только для расчета (pip install numpy); сайт без него
+работает и показывает похожие товары той же категории или бренда.
+"""
+import math
+from collections import defaultdict
+from itertools import islice
+
+from django.db import transaction
+
+from .models import Product, ProductNeighbor, ProductNote
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Вес группы признаков в итоговой близости
+SIMILARITY_WEIGHTS = {
+    'notes': 0.45,
+    'families': 0.15,
+    'gender': 0.15,
+    'price': 0.1,
+    'brand': 0.1,
+    'concentration': 0.05,
+}
+
+# Вес ноты в зависимости от уровня пирамиды
+NOTE_LEVEL_WEIGHTS = {'top': 0.6, 'middle': 0.8, 'base': 1.0}
+
+# Количество ценовых диапазонов (по квантилям цен товаров в наличии)
+PRICE_BANDS = 5
+
+
+def numpy_available():
+    return np is not None
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def _one_hot(values, columns):
+    index = {value: position for position, value in enumerate(columns)}
+    matrix = np.zeros((len(values), len(columns)), dtype=np.float32)
+    for row, value in enumerate(values):
+        if value in index:
+            matrix[row, index[value]] = 1
+    return matrix
+
+
+def _note_features(ids, notes):
+    """Матрицы нот (TF-IDF по основам) и семейств нот"""
+    position = {product_id: row for row, product_id in enumerate(ids)}
+    weights = defaultdict(float)
+    family_weights = defaultdict(float)
+    document_frequency = defaultdict(set)
+    for product_id, stem, family, level in notes:
+        level_weight = NOTE_LEVEL_WEIGHTS.get(level, 1.0)
+        weights[product_id, stem] += level_weight
+        document_frequency[stem].add(product_id)
+        if family:
+            family_weights[product_id, family] += level_weight
+
+    # Нота одного товара не делает похожим ни один другой товар
+    stems = sorted(stem for stem, products in document_frequency.items() if len(products) > 1)
+    stem_column = {stem: column for column, stem in enumerate(stems)}
+    note_matrix = np.zeros((len(ids), len(stems)), dtype=np.float32)
+    for (product_id, stem), weight in weights.items():
+        if stem in stem_column:
+            idf = math.log(len(ids) / len(document_frequency[stem])) + 1
+            note_matrix[position[product_id], stem_column[stem]] = weight * idf
+
+    families = sorted({family for product_id, family in family_weights})
+    family_column = {family: column for column, family in enumerate(families)}
+    family_matrix = np.zeros((len(ids), len(families)), dtype=np.float32)
+    for (product_id, family), weight in family_weights.items():
+        family_matrix[position[product_id], family_column[family]] = weight
+    return note_matrix, family_matrix
+
+
+def _gender_features(genders):
+    # Унисекс наполовину похож и на мужские, и на женские ароматы
+    rows = {'women': (1, 0, 0.5), 'men': (0, 1, 0.5), 'unisex': (0.5, 0.5, 1)}
+    return np.array([rows.get(gender, (0, 0, 0)) for gender in genders], dtype=np.float32)
+
+
+def _price_features(prices):
+    """Ценовой диапазон; соседний диапазон засчитывается наполовину"""
+    prices = np.asarray(prices, dtype=np.float64)
+    edges = np.quantile(prices, np.linspace(0, 1, PRICE_BANDS + 1)[1:-1])
+    bands = np.searchsorted(edges, prices, side='right')
+    matrix = np.zeros((len(prices), PRICE_BANDS), dtype=np.float32)
+    rows = np.arange(len(prices))
+    matrix[rows, bands] = 1
+    matrix[rows[bands > 0], bands[bands > 0] - 1] = 0.5
+    upper = bands < PRICE_BANDS - 1
+    matrix[rows[upper], bands[upper] + 1] = 0.5
+    return matrix
+
+
+def build_vectors(products, notes):
+    """
+    Нормированные векторы признаков.
+
+    products - строки (id, brand_id, gender, concentration, effective_price),
+    notes - строки (product_id, основа ноты, семейство, уровень).
+    Возвращает массив id и матрицу векторов в том же порядке.
+    """
+    ids = np.array([row[0] for row in products], dtype=np.int64)
+    note_matrix, family_matrix = _note_features(ids.tolist(), notes)
+    groups = {
+        'notes': note_matrix,
+        'families': family_matrix,
+        'gender': _gender_features([row[2] for row in products]),
+        'concentration': _one_hot(
+            [row[3] for row in products],
+            [value for value, label in Product.CONCENTRATION_CHOICES]
+        ),
+        'price': _price_features([float(row[4]) for row in products]),
+        'brand': _one_hot([row[1] for row in products], sorted({row[1] for row in products})),
+    }
+    vectors = np.hstack([
+        _normalize_rows(matrix) * math.sqrt(SIMILARITY_WEIGHTS[name])
+        for name, matrix in groups.items()
+    ]).astype(np.float32)
+    return ids, _normalize_rows(vectors)
+
+
+def nearest_neighbors(ids, vectors, count, block_size=1024):
+    """
+    Для каждого товара count ближайших по косинусной близости.
+    Матрица близостей считается блоками по block_size строк, поэтому
+    память - block_size x количество товаров, а не квадрат.
+    Возвращает {id товара: [(id соседа, близость), ...]} по убыванию близости.
+    """
+    count = min(count, len(ids) - 1)
+    if count <= 0:
+        return {}
+    neighbors = {}
+    for start in range(0, len(ids), block_size):
+        block = vectors[start:start + block_size]
+        scores = block @ vectors.T
+        # Товар не сосед сам себе
+        rows = np.arange(len(block))
+        scores[rows, rows + start] = -np.inf
+        top = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        for row in rows:
+            neighbors[int(ids[start + row])] = [
+                (int(ids[column]), float(score))
+                for column, score in zip(top[row], top_scores[row])
+                if score > 0
+            ]
+    return neighbors
+
+
+def compute_neighbors(count, block_size=1024):
+    """Рассчитать соседей всех товаров в наличии по данным из БД"""
+    products = list(
+        Product.objects.filter(in_stock=True).order_by('id')
+        .values_list('id', 'brand_id', 'gender', 'concentration', 'effective_price')
+    )
+    if len(products) < 2:
+        return {}
+    notes = (
+        ProductNote.objects.filter(product__in_stock=True)
+        .values_list('product_id', 'note__stem', 'note__family', 'level')
+        .iterator(chunk_size=5000)
+    )
+    ids, vectors = build_vectors(products, notes)
+    return nearest_neighbors(ids, vectors, count, block_size)
+
+
+def save_neighbors(neighbors, batch_size=1000):
+    """Заменить таблицу соседей рассчитанными значениями (в одной транзакции)"""
+    rows = (
+        ProductNeighbor(product_id=product_id, neighbor_id=neighbor_id, rank=rank, score=score)
+        for product_id, product_neighbors in neighbors.items()
+        for rank, (neighbor_id, score) in enumerate(product_neighbors)
+    )
+    with transaction.atomic():
+        ProductNeighbor.objects.all().delete()
+        saved = 0
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            ProductNeighbor.objects.bulk_create(batch)
+            saved += len(batch)
+    return saved
@@ -0,0 +1,69 @@
+"""
+Сводная статистика по брендам и категориям.
+
+Количество товаров, количество товаров в наличии, диапазон цен и дата
+последнего поступления считаются для всех брендов (категорий) одним
+сгруппированным запросом и хранятся в кэше. Кэш сбрасывается сигналами
+при изменении товаров; массовые update() сигналов не вызывают, поэтому
+у записей есть и срок жизни STATS_CACHE_TIMEOUT.
+"""
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, Q
+
+
+GroupStats = namedtuple('GroupStats', [
+    'product_count', 'in_stock_count', 'min_price', 'max_price', 'newest'
+])
+
+EMPTY_STATS = GroupStats(0, 0, None, None, None)
+
+# Поле товара, по которому группируется статистика -> ключ кэша
+STATS_GROUPS = {
+    'brand': 'shop:stats:brand',
+    'category': 'shop:stats:category',
+}
+
+
+def _aggregate(field):
+    """Статистика по всем значениям поля field одним GROUP BY"""
+    from .models import Product
+
+    in_stock = Q(in_stock=True)
+    rows = (
+        Product.objects.order_by()
+        .values(field)
+        .annotate(
+            product_count=Count('id'),
+            in_stock_count=Count('id', filter=in_stock),
+            min_price=Min('effective_price', filter=in_stock),
+            max_price=Max('effective_price', filter=in_stock),
+            newest=Max('created_at', filter=in_stock),
+        )
+    )
+    return {
+        row.pop(field): GroupStats(**row)
+        for row in rows
+        if row[field] is not None
+    }
+
+
+def _get_stats(field):
+    timeout = getattr(settings, 'STATS_CACHE_TIMEOUT', 600)
+    return cache.get_or_set(STATS_GROUPS[field], lambda: _aggregate(field), timeout)
+
+
+def get_brand_stats():
+    """Статистика по брендам: {id бренда: GroupStats}"""
+    return _get_stats('brand')
+
+
+def get_category_stats():
+    """Статистика по категориям: {id категории: GroupStats}"""
+    return _get_stats('category')
+
+
+def invalidate_stats():
+    cache.delete_many(list(STATS_GROUPS.values()))
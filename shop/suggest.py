@@ -0,0 +1,357 @@
+"""
+Автодополнение поиска.
+
+Названия товаров, брендов и нот хранятся в памяти процесса в сжатом
+префиксном дереве (radix trie). Ключи транслитерируются в латиницу,
+поэтому "диор" находит "Dior", а опечатки в пределах нескольких правок
+("гуэрлен" - "Guerlain") находятся обходом дерева с построчным расчетом
+расстояния Левенштейна. Первая буква считается обычной правкой, поэтому
+транслит с другой первой буквой ("шанель" - "shanel" - "Chanel") тоже
+находится. Каждый узел хранит лучшие подсказки своего поддерева, поэтому
+ответ не зависит от размера каталога и не обращается к БД.
+"""
+import logging
+import re
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db import connection
+from django.urls import reverse
+
+from .notes import normalize, split_notes
+
+
+TOP_PER_NODE = 10
+
+# Веса типов подсказок: бренды выше товаров, товары выше нот
+WEIGHTS = {'brand': 30, 'product': 20, 'note': 10}
+
+_TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n',
+    'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f',
+    'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y',
+    'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+}
+_NON_WORD = re.compile(r'[^0-9a-z]+')
+
+Suggestion = namedtuple('Suggestion', ['id', 'type', 'label', 'url', 'weight'])
+
+logger = logging.getLogger(__name__)
+
+
+def suggest_key(text):
+    """Ключ для дерева: нижний регистр, транслит в латиницу, слова через пробел"""
+    text = ''.join(_TRANSLIT.get(char, char) for char in normalize(text))
+    return ' '.join(_NON_WORD.sub(' ', text).split())
+
+
+def max_edits(length):
+    """Допустимое число опечаток в зависимости от длины запроса"""
+    if length < 3:
+        return 0
+    if length < 6:
+        return 1
+    return 2
+
+
+class _Node:
+    __slots__ = ('children', 'entries', 'top')
+
+    def __init__(self):
+        # первая буква ребра -> [метка ребра, дочерний узел]
+        self.children = {}
+        self.entries = set()
+        # лучшие подсказки поддерева: [(ключ сортировки, id подсказки)]
+        self.top = []
+
+    def offer(self, rank):
+        if rank in self.top:
+            return
+        if len(self.top) >= TOP_PER_NODE and rank >= self.top[-1]:
+            return
+        self.top.append(rank)
+        self.top.sort()
+        del self.top[TOP_PER_NODE:]
+
+    def refill(self, ranks):
+        """Пересчитать лучшие подсказки по своим записям и верхушкам детей"""
+        candidates = set(ranks)
+        for label, child in self.children.values():
+            candidates.update(child.top)
+        self.top = sorted(candidates)[:TOP_PER_NODE]
+
+
+class SuggestIndex:
+    """Индекс подсказок на сжатом префиксном дереве"""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._root = _Node()
+        self._suggestions = {}
+        self._keys = {}
+        # изменения из сигналов, пришедшие во время перестройки
+        self._pending = None
+        self.built_at = None
+
+    def is_stale(self):
+        ttl = getattr(settings, 'CATALOG_INDEX_TTL', 300)
+        return self.built_at is None or time.monotonic() - self.built_at > ttl
+
+    # Построение
+
+    def rebuild(self):
+        """
+        Полностью перестроить индекс по базе данных.
+
+        Новое дерево строится отдельно, без блокировки, и подменяет старое
+        целиком; до подмены запросы обслуживает старое дерево. Изменения из
+        сигналов, пришедшие во время построения, повторяются на новом дереве.
+        """
+        from .models import Brand, Note, Product
+
+        with self._lock:
+            self._pending = []
+        try:
+            fresh = SuggestIndex()
+            for pk, name, slug in Brand.objects.values_list('id', 'name', 'slug'):
+                fresh._add(self._brand_suggestion(pk, name, slug))
+            products = Product.objects.filter(in_stock=True).values_list(
+                'id', 'name', 'slug', 'brand__name', 'is_bestseller'
+            )
+            for row in products.iterator(chunk_size=2000):
+                fresh._add(self._product_suggestion(*row))
+            for name in Note.objects.values_list('name', flat=True).iterator(chunk_size=2000):
+                fresh._add(self._note_suggestion(name))
+            with self._lock:
+                for action, value in self._pending:
+                    fresh._apply(action, value)
+                self._root, self._suggestions, self._keys = (
+                    fresh._root, fresh._suggestions, fresh._keys
+                )
+                self.built_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._pending = None
+
+    @staticmethod
+    def _brand_suggestion(pk, name, slug):
+        url = reverse('catalog') + f'?brand={pk}'
+        return Suggestion(('brand', pk), 'brand', name, url, WEIGHTS['brand'])
+
+    @staticmethod
+    def _product_suggestion(pk, name, slug, brand_name, is_bestseller):
+        url = reverse('product_detail', kwargs={'slug': slug})
+        weight = WEIGHTS['product'] + (1 if is_bestseller else 0)
+        return Suggestion(('product', pk), 'product', f'{brand_name} - {name}', url, weight)
+
+    @staticmethod
+    def _note_suggestion(name):
+        url = reverse('search') + f'?q={quote(name)}'
+        return Suggestion(('note', name), 'note', name, url, WEIGHTS['note'])
+
+    def _index_keys(self, suggestion):
+        """Ключи подсказки: вся строка и каждый ее хвост, начиная с нового слова"""
+        words = suggest_key(suggestion.label).split()
+        return {' '.join(words[i:]) for i in range(len(words))}
+
+    @staticmethod
+    def _rank(suggestion):
+        return (-suggestion.weight, suggestion.label, suggestion.id)
+
+    def _add(self, suggestion):
+        self._remove(suggestion.id)
+        rank = self._rank(suggestion)
+        keys = self._index_keys(suggestion)
+        for key in keys:
+            self._insert(key, suggestion.id, rank)
+        self._suggestions[suggestion.id] = suggestion
+        self._keys[suggestion.id] = keys
+
+    def _insert(self, key, suggestion_id, rank):
+        node = self._root
+        node.offer(rank)
+        while key:
+            child = node.children.get(key[0])
+            if child is None:
+                leaf = _Node()
+                node.children[key[0]] = [key, leaf]
+                node = leaf
+                node.offer(rank)
+                break
+            label, child_node = child
+            common = 0
+            while common < min(len(label), len(key)) and label[common] == key[common]:
+                common += 1
+            if common < len(label):
+                # Делим ребро: промежуточный узел наследует поддерево
+                middle = _Node()
+                middle.top = list(child_node.top)
+                middle.children[label[common]] = [label[common:], child_node]
+                child[0], child[1] = label[:common], middle
+                child_node = middle
+            node = child_node
+            node.offer(rank)
+            key = key[common:]
+        node.entries.add(suggestion_id)
+
+    def _remove(self, suggestion_id):
+        suggestion = self._suggestions.pop(suggestion_id, None)
+        if suggestion is None:
+            return
+        rank = self._rank(suggestion)
+        # Узлы на путях ключей с глубиной: верхушки пересчитываются снизу
+        # вверх, чтобы место удаленной подсказки заняли следующие из поддерева
+        path = {}
+        for key in self._keys.pop(suggestion_id, ()):
+            node, depth = self._root, 0
+            path[id(node)] = (depth, node)
+            while key:
+                child = node.children.get(key[0])
+                if child is None or not key.startswith(child[0]):
+                    break
+                key = key[len(child[0]):]
+                node, depth = child[1], depth + 1
+                path[id(node)] = (depth, node)
+            node.entries.discard(suggestion_id)
+        for depth, node in sorted(path.values(), key=lambda item: -item[0]):
+            if rank in node.top:
+                node.refill(self._rank(self._suggestions[entry]) for entry in node.entries)
+
+    # Инкрементальные обновления из сигналов
+
+    def _apply(self, action, value):
+        """Применить изменение; во время перестройки оно запоминается для нового дерева"""
+        if self._pending is not None:
+            self._pending.append((action, value))
+        if action == 'add':
+            self._add(value)
+        else:
+            self._remove(value)
+
+    def _is_tracking(self):
+        return self.built_at is not None or self._pending is not None
+
+    def update_product(self, product):
+        with self._lock:
+            if not self._is_tracking():
+                return
+            if product.in_stock:
+                self._apply('add', self._product_suggestion(
+                    product.pk, product.name, product.slug,
+                    product.brand.name, product.is_bestseller
+                ))
+            else:
+                self._apply('remove', ('product', product.pk))
+            for level in ('top', 'middle', 'base'):
+                for name, stem in split_notes(getattr(product, f'notes_{level}')):
+                    if ('note', name) not in self._suggestions:
+                        self._apply('add', self._note_suggestion(name))
+
+    def remove_product(self, pk):
+        with self._lock:
+            self._apply('remove', ('product', pk))
+
+    def update_brand(self, brand):
+        with self._lock:
+            if self._is_tracking():
+                self._apply('add', self._brand_suggestion(brand.pk, brand.name, brand.slug))
+
+    def remove_brand(self, pk):
+        with self._lock:
+            self._apply('remove', ('brand', pk))
+
+    # Поиск
+
+    def suggest(self, query, limit=8):
+        """Подсказки для введенного текста: сначала точный префикс, затем с опечатками"""
+        key = suggest_key(query)
+        if not key:
+            return []
+        with self._lock:
+            ranks = set(self._prefix_top(key))
+            if len(ranks) < limit and max_edits(len(key)):
+                ranks.update(self._fuzzy_top(key, max_edits(len(key))))
+            return [self._suggestions[rank[2]] for rank in sorted(ranks)[:limit]]
+
+    def _prefix_top(self, key):
+        node = self._root
+        while key:
+            child = node.children.get(key[0])
+            if child is None:
+                return []
+            label, child_node = child
+            if label.startswith(key):
+                return child_node.top
+            if not key.startswith(label):
+                return []
+            key = key[len(label):]
+            node = child_node
+        return node.top
+
+    def _fuzzy_top(self, key, edits):
+        """
+        Подсказки, ключ которых начинается со строки на расстоянии
+        Левенштейна не больше edits от запроса. Обход начинается со всех
+        ребер корня: первая буква может отличаться (транслит "ш" - "sh"
+        вместо "ch"), а ветки, где расстояние уже больше edits, отсекаются.
+        """
+        found = []
+        first_row = list(range(len(key) + 1))
+        stack = [
+            (child_node, child_label, first_row)
+            for child_label, child_node in self._root.children.values()
+        ]
+        while stack:
+            node, label, row = stack.pop()
+            matched = False
+            for char in label:
+                current = [row[0] + 1]
+                for i in range(1, len(key) + 1):
+                    cost = 0 if key[i - 1] == char else 1
+                    current.append(min(current[i - 1] + 1, row[i] + 1, row[i - 1] + cost))
+                row = current
+                if row[-1] <= edits:
+                    matched = True
+                    break
+                if min(row) > edits:
+                    break
+            if matched:
+                found.extend(node.top)
+            elif min(row) <= edits:
+                stack.extend(
+                    (child_node, child_label, row)
+                    for child_label, child_node in node.children.values()
+                )
+        return found
+
+
+suggest_index = SuggestIndex()
+_build_lock = threading.Lock()
+
+
+def _rebuild_in_background():
+    try:
+        suggest_index.rebuild()
+    except Exception:
+        logger.exception('Suggest index rebuild failed')
+    finally:
+        connection.close()
+        _build_lock.release()
+
+
+def get_suggest_index():
+    """
+    Получить индекс подсказок. В первый раз индекс строится в запросе,
+    устаревший перестраивается в фоновом потоке, а до подмены отвечает прежний.
+    """
+    if suggest_index.built_at is None:
+        with _build_lock:
+            if suggest_index.built_at is None:
+                suggest_index.rebuild()
+    elif suggest_index.is_stale() and _build_lock.acquire(blocking=False):
+        threading.Thread(target=_rebuild_in_background, daemon=True).start()
+    return suggest_index
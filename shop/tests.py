@@ -1,4 +1,939 @@
-from django.test import TestCase
+import base64
+import hashlib
+import json
+import threading
+from io import StringIO
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
+from . import cart as cart_ops, idempotency, suggest
+from .facets import CatalogFacetIndex, apply_filters, catalog_index
+from .models import (
+    Brand, Cart, CartItem, Category, CoPurchase, CustomUser, IdempotencyKey, Note, Order,
+    OrderItem, OrderNumberSequence, Product, ProductNote, RateLimitBucket, Review,
+)
+from .notes import NOTE_FAMILIES
+from .pagination import encode_cursor
+from .ratelimit import purge_idle
+from .search import DatabaseSearchBackend, get_search_backend
+from .suggest import SuggestIndex
+from .views import CATALOG_ORDERINGS
+from .product_cache import get_product_bundle
+
+
+def make_user(login, **extra):
+    return CustomUser.objects.create_user(
+        login=login,
+        email=f'{login}@example.com',
+        password='secret123',
+        name=extra.pop('name', 'Иван'),
+        surname=extra.pop('surname', 'Петров'),
+        **extra
+    )
+
+
+def make_brand(name='Chanel'):
+    return Brand.objects.create(
+        name=name, slug=name.lower().replace(' ', '-'), country='Франция', year_founded=1910
+    )
+
+
+def make_category(name='Люкс'):
+    return Category.objects.create(name=name, slug=f'category-{Category.objects.count()}')
+
+
+def run_concurrently(target, arguments):
+    """Запустить target(*args) для каждого набора аргументов в своем потоке
+    одновременно. Возвращает результаты в порядке arguments и ошибки потоков"""
+    start = threading.Barrier(len(arguments))
+    results, errors = [None] * len(arguments), []
+
+    def worker(position, args):
+        try:
+            start.wait()
+            results[position] = target(*args)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connections.close_all()
+
+    threads = [
+        threading.Thread(target=worker, args=(position, args))
+        for position, args in enumerate(arguments)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def make_product(slug, brand, **fields):
+    fields.setdefault('name', slug)
+    fields.setdefault('price', Decimal('1000'))
+    fields.setdefault('volume', 50)
+    fields.setdefault('description', 'Описание')
+    fields.setdefault('country', 'Франция')
+    fields.setdefault('image', 'products/test.jpg')
+    return Product.objects.create(slug=slug, brand=brand, **fields)
+
+
+class ProductCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = make_product('cached', make_brand())
+
+    def test_save_forgets_bundle_after_commit(self):
+        self.assertEqual(get_product_bundle('cached').product.price, Decimal('1000'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.price = Decimal('1500')
+            self.product.save()
+        # До фиксации транзакции набор не трогается и не перестраивается
+        self.assertEqual(get_product_bundle('cached').product.price, Decimal('1000'))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(get_product_bundle('cached').product.price, Decimal('1500'))
+
+    def test_slug_change_forgets_previous_slug(self):
+        get_product_bundle('cached')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.slug = 'renamed'
+            self.product.save()
+        self.assertIsNone(get_product_bundle('cached'))
+        self.assertEqual(get_product_bundle('renamed').product.pk, self.product.pk)
+
+    def test_page_renders_similar_products(self):
+        make_product('neighbor', self.product.brand, name='Coco Mademoiselle')
+        response = self.client.get('/product/cached/')
+        self.assertContains(response, 'Похожие ароматы')
+        self.assertContains(response, 'Coco Mademoiselle')
+
+    def test_warm_page_loads_recommendations_in_one_query(self):
+        make_product('neighbor', self.product.brand, name='Coco Mademoiselle')
+        together = make_product(
+            'together', make_brand('Dior'), name='Sauvage', category=make_category()
+        )
+        CoPurchase.objects.create(product=self.product, other=together, count=3)
+        self.client.get('/product/cached/')
+        with self.assertNumQueries(1):
+            response = self.client.get('/product/cached/')
+        self.assertEqual([product.slug for product in response.context['similar_products']], ['neighbor'])
+        self.assertEqual([product.slug for product in response.context['bought_together']], ['together'])
+
+
+class ReviewFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        brand = make_brand()
+        self.first = make_product('first', brand)
+        self.second = make_product('second', brand)
+        self.user = make_user('reviewer')
+
+    def feed(self, product):
+        return self.client.get(f'/api/product/{product.slug}/reviews/').json()
+
+    def test_moving_review_forgets_both_products(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            review = Review.objects.create(product=self.first, user=self.user, rating=5, text='Отлично')
+        # Прогреваем кэш лент и наборов страниц обоих товаров
+        self.assertEqual(self.feed(self.first)['count'], 1)
+        self.assertEqual(self.feed(self.second)['count'], 0)
+        self.assertEqual(get_product_bundle('first').product.rating_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            review.product = self.second
+            review.save()
+
+        first_feed = self.feed(self.first)
+        self.assertEqual((first_feed['count'], first_feed['reviews']), (0, []))
+        self.assertEqual(self.feed(self.second)['count'], 1)
+        self.assertEqual(get_product_bundle('first').product.rating_count, 0)
+        self.assertEqual(get_product_bundle('second').product.rating_count, 1)
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('buyer')
+        self.product = make_product('idem', make_brand())
+        self.client.force_login(self.user)
+
+    def post(self, url, data=None, key=None):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return self.client.post(
+            url, json.dumps(data or {}), content_type='application/json', **headers
+        )
+
+    def quantity(self):
+        return CartItem.objects.get(cart__user=self.user, product=self.product).quantity
+
+    def test_repeat_with_same_key_is_replayed(self):
+        url = f'/api/cart/add/{self.product.id}/'
+        first = self.post(url, key='add-1')
+        second = self.post(url, key='add-1')
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.quantity(), 1)
+
+    def test_requests_without_key_are_not_deduplicated(self):
+        url = f'/api/cart/add/{self.product.id}/'
+        self.post(url)
+        self.post(url)
+        self.assertEqual(self.quantity(), 2)
+
+    def test_same_key_for_another_request_is_rejected(self):
+        self.post(f'/api/cart/add/{self.product.id}/', key='add-1')
+        item = CartItem.objects.get(cart__user=self.user)
+        response = self.post(f'/api/cart/update/{item.id}/', {'quantity': 5}, key='add-1')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.quantity(), 1)
+
+    def test_failed_request_releases_key(self):
+        self.post(f'/api/cart/add/{self.product.id}/')
+        url = f'/api/cart/update/{CartItem.objects.get(cart__user=self.user).id}/'
+        self.assertFalse(self.post(url, {'quantity': 0}, key='update-1').json()['success'])
+        self.assertFalse(IdempotencyKey.objects.filter(key='update-1').exists())
+        # Исправленный запрос можно отправить с тем же ключом
+        self.assertTrue(self.post(url, {'quantity': 3}, key='update-1').json()['success'])
+        self.assertEqual(self.quantity(), 3)
+
+    def test_cart_mutation_apis_are_idempotent(self):
+        self.post(f'/api/cart/add/{self.product.id}/')
+        item = CartItem.objects.get(cart__user=self.user)
+        batch = {'operations': [{'op': 'add', 'product_id': self.product.id}]}
+        self.post('/api/cart/batch/', batch, key='batch-1')
+        replay = self.post('/api/cart/batch/', batch, key='batch-1')
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.quantity(), 2)
+
+        self.post(f'/api/cart/remove/{item.id}/', key='remove-1')
+        replay = self.post(f'/api/cart/remove/{item.id}/', key='remove-1')
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertTrue(replay.json()['success'])
+
+    def test_expired_key_can_be_reused(self):
+        url = f'/api/cart/add/{self.product.id}/'
+        self.post(url, key='add-1')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(days=2))
+        response = self.post(url, key='add-1')
+        self.assertFalse(response.has_header('Idempotent-Replayed'))
+        self.assertEqual(self.quantity(), 2)
+
+    def test_abandoned_in_flight_key_is_reclaimed_after_lease(self):
+        url = f'/api/cart/add/{self.product.id}/'
+        self.post(url, key='add-1')
+        # Процесс упал, не записав ответ
+        IdempotencyKey.objects.update(status_code=None, response_body='')
+        self.assertEqual(self.post(url, key='add-1').status_code, 409)
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(minutes=3))
+        self.assertTrue(self.post(url, key='add-1').json()['success'])
+        self.assertEqual(self.quantity(), 2)
+
+    def test_fingerprint_is_keyed_with_secret(self):
+        body = json.dumps({'password': 'secret123'}).encode()
+        request = RequestFactory().post('/api/orders/create/', body, content_type='application/json')
+        fingerprint = idempotency._fingerprint(request)
+        self.assertNotEqual(
+            fingerprint, hashlib.sha256(request.path.encode() + b'\0' + body).hexdigest()
+        )
+        with override_settings(SECRET_KEY='another-secret-key'):
+            self.assertNotEqual(idempotency._fingerprint(request), fingerprint)
+
+
+class CartConcurrencyTests(TransactionTestCase):
+    """Параллельные изменения корзины (двойной клик, несколько вкладок)"""
+    THREADS = 8
+    CLICKS = 10
+
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('concurrent')
+        brand = make_brand()
+        self.shared = make_product('shared', brand)
+        self.own = [make_product(f'own-{number}', brand) for number in range(self.THREADS)]
+
+    def items(self, cart_id):
+        return dict(CartItem.objects.filter(cart_id=cart_id).values_list('product_id', 'quantity'))
+
+    def test_touch_cart_creates_single_cart(self):
+        cart_ids, errors = run_concurrently(
+            cart_ops.touch_cart, [(self.user,)] * self.THREADS
+        )
+        self.assertEqual(errors, [])
+        self.assertEqual(len(set(cart_ids)), 1)
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 1)
+
+    def test_concurrent_adds_are_not_lost(self):
+        def clicks():
+            for _ in range(self.CLICKS):
+                cart_ops.add_item(cart_ops.touch_cart(self.user), self.shared.pk)
+
+        results, errors = run_concurrently(clicks, [()] * self.THREADS)
+        self.assertEqual(errors, [])
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(self.items(cart.id), {self.shared.pk: self.THREADS * self.CLICKS})
+
+    def test_add_is_capped_at_max_quantity(self):
+        cart_id = cart_ops.touch_cart(self.user)
+        quantity = cart_ops.MAX_CART_QUANTITY // 2 + 1
+        results, errors = run_concurrently(
+            cart_ops.add_item, [(cart_id, self.shared.pk, quantity)] * self.THREADS
+        )
+        self.assertEqual(errors, [])
+        self.assertEqual(self.items(cart_id), {self.shared.pk: cart_ops.MAX_CART_QUANTITY})
+
+    def test_mixed_operations(self):
+        """Каждый поток добавляет общий товар, а своим товаром проверяет
+        добавление, изменение количества и (у половины потоков) удаление"""
+        def operations(number, product):
+            for _ in range(self.CLICKS):
+                cart_ops.add_item(cart_ops.touch_cart(self.user), self.shared.pk)
+            item_id, _ = cart_ops.add_item(cart_ops.touch_cart(self.user), product.pk)
+            cart_ops.add_item(cart_ops.touch_cart(self.user), product.pk)
+            self.assertTrue(cart_ops.set_item_quantity(cart_ops.touch_cart(self.user), item_id, 5))
+            if number % 2:
+                self.assertTrue(cart_ops.remove_item(cart_ops.touch_cart(self.user), item_id))
+
+        results, errors = run_concurrently(operations, list(enumerate(self.own)))
+        self.assertEqual(errors, [])
+        self.assertEqual(Cart.objects.filter(user=self.user).count(), 1)
+        expected = {self.shared.pk: self.THREADS * self.CLICKS}
+        expected.update({product.pk: 5 for number, product in enumerate(self.own) if not number % 2})
+        self.assertEqual(self.items(Cart.objects.get(user=self.user).id), expected)
+
+
+class OrderNumberTests(TransactionTestCase):
+    """Номера заказов из счетчика OrderNumberSequence под параллельной нагрузкой"""
+    THREADS = 8
+    ORDERS = 15
+
+    def setUp(self):
+        self.user = make_user('numbers')
+
+    def create_order(self):
+        with transaction.atomic():
+            return Order.objects.create(
+                user=self.user,
+                payment_method='cash',
+                total_price=0,
+                full_name='Иван Петров',
+                email=self.user.email,
+                address='-',
+                city='-',
+            ).order_number
+
+    def create_orders(self):
+        return [self.create_order() for _ in range(self.ORDERS)]
+
+    def assertSequence(self, numbers, day, count):
+        self.assertEqual(
+            sorted(numbers), [f'ORD-{day:%Y%m%d}-{value:04d}' for value in range(1, count + 1)]
+        )
+
+    def test_parallel_numbers_are_unique_and_gap_free(self):
+        day = date(2026, 3, 14)
+        with mock.patch('django.utils.timezone.localdate', return_value=day):
+            results, errors = run_concurrently(self.create_orders, [()] * self.THREADS)
+        self.assertEqual(errors, [])
+        numbers = [number for numbers in results for number in numbers]
+        self.assertSequence(numbers, day, self.THREADS * self.ORDERS)
+        self.assertEqual(OrderNumberSequence.objects.get(day=day).last_value, len(numbers))
+
+    def test_sequence_resets_on_date_change(self):
+        first_day, next_day = date(2026, 3, 14), date(2026, 3, 15)
+        with mock.patch('django.utils.timezone.localdate', return_value=first_day):
+            first, errors = run_concurrently(self.create_orders, [()] * self.THREADS)
+        self.assertEqual(errors, [])
+        with mock.patch('django.utils.timezone.localdate', return_value=next_day):
+            second, errors = run_concurrently(self.create_orders, [()] * self.THREADS)
+        self.assertEqual(errors, [])
+        self.assertSequence(sum(first, []), first_day, self.THREADS * self.ORDERS)
+        self.assertSequence(sum(second, []), next_day, self.THREADS * self.ORDERS)
+
+    def test_rolled_back_order_does_not_leave_gap(self):
+        day = date(2026, 3, 14)
+        with mock.patch('django.utils.timezone.localdate', return_value=day):
+            first = self.create_order()
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    self.create_order()
+                    raise RuntimeError
+            second = self.create_order()
+        self.assertSequence([first, second], day, 2)
+
+
+@override_settings(RATE_LIMITS={
+    'login': {'ip': (3, 60), 'login': (2, 60)},
+    'register': {'ip': (1, 600)},
+})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        self.now = 1_000_000.0
+        clock = mock.patch('shop.ratelimit.time')
+        clock.start().time.side_effect = lambda: self.now
+        self.addCleanup(clock.stop)
+
+    def login(self, login='alice', ip='10.0.0.1'):
+        # Пустой пароль: форма не проходит проверку, хеширование не выполняется
+        return self.client.post(
+            '/api/login/', json.dumps({'login': login, 'password': ''}),
+            content_type='application/json', REMOTE_ADDR=ip
+        )
+
+    def register(self, ip='10.0.0.1'):
+        return self.client.post(
+            '/api/register/', json.dumps({}), content_type='application/json', REMOTE_ADDR=ip
+        )
+
+    def test_login_limited_after_burst(self):
+        self.assertNotEqual(self.login('alice').status_code, 429)
+        self.assertNotEqual(self.login('alice').status_code, 429)
+        response = self.login('alice')
+        self.assertEqual(response.status_code, 429)
+        # Лимит по логину: 2 попытки за 60 секунд - следующая через 30 секунд
+        self.assertEqual(response['Retry-After'], '30')
+
+    def test_login_bucket_is_per_login(self):
+        self.login('alice')
+        self.login('alice')
+        # Логин сравнивается без учета регистра и пробелов, IP-адрес другой
+        self.assertEqual(self.login(' ALICE ', ip='10.0.0.2').status_code, 429)
+        self.assertNotEqual(self.login('bob', ip='10.0.0.2').status_code, 429)
+
+    def test_login_bucket_is_per_ip(self):
+        for login in ('alice', 'bob', 'carol'):
+            self.assertNotEqual(self.login(login).status_code, 429)
+        self.assertEqual(self.login('dave').status_code, 429)
+        self.assertNotEqual(self.login('dave', ip='10.0.0.2').status_code, 429)
+
+    def test_bucket_refills_over_time(self):
+        self.login('alice')
+        self.login('alice')
+        self.assertEqual(self.login('alice').status_code, 429)
+        self.now += 29
+        self.assertEqual(self.login('alice').status_code, 429)
+        # Отклоненные попытки не копят долг: через 30 секунд появляется токен
+        self.now += 30
+        self.assertNotEqual(self.login('alice').status_code, 429)
+        self.assertEqual(self.login('alice').status_code, 429)
+
+    def test_register_limited_per_ip(self):
+        self.assertNotEqual(self.register().status_code, 429)
+        response = self.register()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '600')
+        self.assertNotEqual(self.register(ip='10.0.0.2').status_code, 429)
+        self.now += 600
+        self.assertNotEqual(self.register().status_code, 429)
+
+    def test_purge_removes_only_refilled_buckets(self):
+        self.login('alice')
+        self.now += 500
+        self.login('bob', ip='10.0.0.2')
+        # Самый длинный период в настройках - 600 секунд: корзины alice
+        # (по IP и по логину) наполнились, корзины bob - еще нет
+        self.assertEqual(purge_idle(now=self.now + 200), 2)
+        self.assertEqual(
+            sorted(key.split(':')[1] for key in RateLimitBucket.objects.values_list('key', flat=True)),
+            ['ip', 'login']
+        )
+        self.assertEqual(purge_idle(now=self.now + 601), 2)
+        self.assertFalse(RateLimitBucket.objects.exists())
+
+
+@override_settings(CATALOG_PAGE_SIZE=3)
+class CatalogPaginationTests(TestCase):
+    """Keyset-пагинация /api/catalog/ по всем сортировкам"""
+
+    @classmethod
+    def setUpTestData(cls):
+        brands = [make_brand(name) for name in ('Dior', 'Chanel', 'Amouage')]
+        # Много одинаковых значений ключей сортировки: порядок внутри
+        # группы определяет только id
+        prices = [
+            (1000, 0), (2000, 50), (1000, 0), (500, 0), (1000, 0), (4000, 75),
+            (2000, 0), (3000, 0), (1000, 0), (2000, 50), (700, 0),
+        ]
+        for number, (price, discount) in enumerate(prices):
+            make_product(
+                f'p{number}', brands[number % 3],
+                name=f'Аромат {number % 4}',
+                price=Decimal(price), discount=discount,
+                is_bestseller=number % 3 == 0,
+            )
+        make_product('hidden', brands[0], in_stock=False)
+        # Одинаковые даты и рейтинги у нескольких товаров
+        created = timezone.now() - timedelta(days=1)
+        Product.objects.filter(slug__in=['p1', 'p2', 'p3', 'p7']).update(created_at=created)
+        for slugs, average, count in ((['p0', 'p4', 'p8'], 4.5, 2), (['p5', 'p6'], 4.5, 3), (['p9'], 3.0, 1)):
+            Product.objects.filter(slug__in=slugs).update(rating_average=average, rating_count=count)
+
+    def setUp(self):
+        catalog_index.rebuild()
+
+    def get(self, **params):
+        response = self.client.get('/api/catalog/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def expected(self, sort):
+        return list(
+            Product.objects.filter(in_stock=True)
+            .order_by(*CATALOG_ORDERINGS[sort])
+            .values_list('id', flat=True)
+        )
+
+    def test_every_sort_walks_forward_and_back(self):
+        for sort in CATALOG_ORDERINGS:
+            with self.subTest(sort=sort):
+                expected = self.expected(sort)
+                page = self.get(sort=sort)
+                self.assertEqual((page['count'], page['num_pages']), (len(expected), 4))
+                self.assertIsNone(page['previous_cursor'])
+                pages = [[product['id'] for product in page['products']]]
+                while page['next_cursor']:
+                    page = self.get(sort=sort, cursor=page['next_cursor'])
+                    self.assertEqual(page['page'], len(pages) + 1)
+                    pages.append([product['id'] for product in page['products']])
+                self.assertEqual(sum(pages, []), expected)
+
+                # Обратно от последней страницы - те же страницы
+                back = [pages[-1]]
+                while page['previous_cursor']:
+                    page = self.get(sort=sort, cursor=page['previous_cursor'])
+                    back.append([product['id'] for product in page['products']])
+                self.assertEqual(back[::-1], pages)
+                self.assertEqual(page['page'], 1)
+
+    def test_filtered_pages(self):
+        brand = Brand.objects.get(name='Chanel')
+        expected = list(
+            Product.objects.filter(in_stock=True, brand=brand)
+            .order_by('effective_price', 'id').values_list('id', flat=True)
+        )
+        page = self.get(sort='price', brand=brand.id)
+        ids = [product['id'] for product in page['products']]
+        while page['next_cursor']:
+            page = self.get(sort='price', brand=brand.id, cursor=page['next_cursor'])
+            ids += [product['id'] for product in page['products']]
+        self.assertEqual((ids, page['count']), (expected, len(expected)))
+
+    def test_broken_cursor_returns_first_page(self):
+        first = self.get(sort='price')
+        cursors = [
+            'garbage',
+            '!!!',
+            encode_cursor(['1000.00'], 'next', 2),
+            encode_cursor(['1000.00', 1], 'sideways', 2),
+            encode_cursor(['not-a-price', 1], 'next', 2),
+            encode_cursor(['1000.00', 'not-an-id'], 'next', 2),
+            encode_cursor([['1000.00'], {'id': 1}], 'next', 2),
+            encode_cursor([None, None], 'prev', 2),
+            # Курсор другой сортировки (дата вместо цены)
+            encode_cursor([timezone.now(), 1], 'next', 2),
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                page = self.get(sort='price', cursor=cursor)
+                self.assertEqual(page['products'], first['products'])
+                self.assertEqual(page['page'], 1)
+
+    def test_crafted_cursor_payloads_return_first_page(self):
+        payloads = [
+            {'k': [{}, 1], 'd': 'next', 'n': 2},
+            {'k': [[], []], 'd': 'prev', 'n': 2},
+            {'k': [True, {'a': 1}, 3], 'd': 'next', 'n': 2},
+            {'k': ['2026-01-01T00:00:00', 1], 'd': {}, 'n': 2},
+            {'k': ['2026-01-01T00:00:00', 1], 'd': 'next', 'n': 0},
+            {'k': ['2026-01-01T00:00:00', 1], 'd': 'next', 'n': [2]},
+            {'k': 'abc', 'd': 'next', 'n': 2},
+            [1, 2, 3],
+            'строка',
+            None,
+        ]
+        for sort in CATALOG_ORDERINGS:
+            first = self.get(sort=sort)
+            for payload in payloads:
+                with self.subTest(sort=sort, payload=payload):
+                    cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+                    page = self.get(sort=sort, cursor=cursor)
+                    self.assertEqual(page['products'], first['products'])
+                    self.assertEqual(page['page'], 1)
+
+
+class CatalogFacetIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.dior, cls.chanel = make_brand('Dior'), make_brand('Chanel')
+        cls.niche = make_category('Ниша')
+        cls.woody_citrus = make_product(
+            'woody-citrus', cls.dior, gender='men', category=cls.niche,
+            notes_top='Бергамот, лимон', notes_base='Кедр и ветивер', price=Decimal('5000'),
+        )
+        cls.woody = make_product(
+            'woody', cls.chanel, gender='men', notes_base='Сандал', price=Decimal('12000'),
+        )
+        cls.floral = make_product(
+            'floral', cls.chanel, gender='women', category=cls.niche,
+            notes_middle='Роза, жасмин', price=Decimal('40000'), discount=50,
+        )
+        cls.hidden = make_product('hidden', cls.dior, notes_base='Кедр', in_stock=False)
+
+    def setUp(self):
+        self.index = CatalogFacetIndex()
+        self.index.rebuild()
+
+    def counts(self, result, facet):
+        return {option.value: option.count for option in result.options[facet] if option.count}
+
+    def test_no_filters(self):
+        result = self.index.query({})
+        self.assertEqual(result.total, 3)
+        self.assertEqual(set(result.ids), {self.woody_citrus.id, self.woody.id, self.floral.id})
+        self.assertEqual(self.counts(result, 'notes'), {'woody': 2, 'floral': 1, 'citrus': 1})
+        self.assertEqual(self.counts(result, 'gender'), {'men': 2, 'women': 1})
+
+    def test_option_counts_ignore_own_facet(self):
+        result = self.index.query({'gender': 'men', 'brand': str(self.chanel.id)})
+        self.assertEqual(result.ids, [self.woody.id])
+        # Количество по полу - с учетом бренда, но без фильтра по полу
+        self.assertEqual(self.counts(result, 'gender'), {'men': 1, 'women': 1})
+        self.assertEqual(
+            self.counts(result, 'brand'), {str(self.dior.id): 1, str(self.chanel.id): 1}
+        )
+
+    def test_notes_are_conjunctive(self):
+        result = self.index.query({'notes': ['woody', 'citrus']})
+        self.assertEqual(result.ids, [self.woody_citrus.id])
+        # Для нот количество считается вместе с уже выбранными семействами
+        self.assertEqual(self.counts(result, 'notes'), {'woody': 1, 'citrus': 1})
+
+    def test_price_range_bounds_are_inclusive(self):
+        self.assertEqual(self.index.query({'price_range': '0-5000'}).ids, [self.woody_citrus.id])
+        self.assertEqual(
+            set(self.index.query({'price_range': '5000-15000'}).ids),
+            {self.woody_citrus.id, self.woody.id}
+        )
+        # Диапазон считается по цене со скидкой: 40 000 - 50% = 20 000
+        self.assertEqual(self.index.query({'price_range': '15000-30000'}).ids, [self.floral.id])
+
+    def test_unknown_values_are_ignored(self):
+        result = self.index.query({'brand': '999', 'notes': ['bogus'], 'gender': '', 'color': 'red'})
+        self.assertEqual(result.filters, {})
+        self.assertEqual(result.total, 3)
+
+    def test_update_and_discard(self):
+        self.woody.in_stock = False
+        self.index.update_product(self.woody)
+        self.assertEqual(self.index.query({'notes': 'woody'}).ids, [self.woody_citrus.id])
+        self.hidden.in_stock = True
+        self.index.update_product(self.hidden)
+        self.assertEqual(
+            set(self.index.query({'notes': 'woody'}).ids), {self.woody_citrus.id, self.hidden.id}
+        )
+        self.index.discard(self.hidden.id)
+        self.assertEqual(self.index.query({'brand': str(self.dior.id)}).ids, [self.woody_citrus.id])
+
+    def test_matches_sql_filters(self):
+        """Индекс и SQL-фильтр (apply_filters) выбирают одни и те же товары"""
+        filters = [
+            {'notes': ['woody']},
+            {'notes': ['woody', 'citrus']},
+            {'category': str(self.niche.id), 'gender': 'women'},
+            {'price_range': '5000-15000', 'brand': str(self.dior.id)},
+            {'notes': ['floral'], 'price_range': '15000-30000'},
+        ]
+        for query in filters:
+            with self.subTest(filters=query):
+                result = self.index.query(query)
+                products = apply_filters(Product.objects.filter(in_stock=True), result.filters)
+                self.assertEqual(
+                    sorted(result.ids), sorted(products.values_list('id', flat=True))
+                )
+
+    def test_note_families_come_from_note_table(self):
+        """Семейство, исправленное в таблице нот, видят и индекс, и SQL-фильтр"""
+        Note.objects.filter(stem='сандал').update(family='oriental')
+        self.index.rebuild()
+        result = self.index.query({'notes': ['oriental']})
+        self.assertEqual(result.ids, [self.woody.id])
+        products = apply_filters(Product.objects.filter(in_stock=True), result.filters)
+        self.assertEqual(list(products.values_list('id', flat=True)), [self.woody.id])
+
+    def test_notes_are_resynced_only_when_changed(self):
+        note_ids = set(ProductNote.objects.filter(product=self.woody).values_list('id', flat=True))
+        self.woody.price = Decimal('13000')
+        self.woody.save()
+        self.assertEqual(
+            set(ProductNote.objects.filter(product=self.woody).values_list('id', flat=True)), note_ids
+        )
+        self.woody.notes_base = 'Роза'
+        self.woody.save()
+        self.assertEqual(
+            list(ProductNote.objects.filter(product=self.woody).values_list('note__stem', flat=True)),
+            ['роз']
+        )
+
+    def test_catalog_page_keeps_several_notes_checked(self):
+        catalog_index.rebuild()
+        response = self.client.get('/catalog/?notes=woody&notes=citrus')
+        self.assertEqual(list(response.context['products']), [self.woody_citrus])
+        self.assertContains(response, 'type="checkbox"', count=len(NOTE_FAMILIES))
+        self.assertContains(response, 'value="woody" onchange="this.form.submit()" checked')
+        self.assertContains(response, 'value="citrus" onchange="this.form.submit()" checked')
+
+
+class SuggestIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.chanel, cls.dior = make_brand('Chanel'), make_brand('Dior')
+        cls.guerlain = make_brand('Guerlain')
+        cls.bleu = make_product('bleu', cls.chanel, name='Bleu de Chanel', notes_top='Бергамот')
+        cls.sauvage = make_product('sauvage', cls.dior, name='Sauvage', is_bestseller=True)
+        cls.hidden = make_product('hidden', cls.dior, name='Dune', in_stock=False)
+
+    def setUp(self):
+        self.index = SuggestIndex()
+        self.index.rebuild()
+
+    def labels(self, query, limit=8):
+        return [suggestion.label for suggestion in self.index.suggest(query, limit)]
+
+    def test_prefix_ranks_brands_above_products(self):
+        self.assertEqual(self.labels('chan'), ['Chanel', 'Chanel - Bleu de Chanel'])
+
+    def test_matches_any_word_of_label(self):
+        self.assertEqual(self.labels('bleu'), ['Chanel - Bleu de Chanel'])
+        self.assertEqual(self.labels('de ch'), ['Chanel - Bleu de Chanel'])
+
+    def test_transliteration_and_typos(self):
+        self.assertEqual(self.labels('диор'), ['Dior', 'Dior - Sauvage'])
+        self.assertEqual(self.labels('гуэрлен'), ['Guerlain'])
+        self.assertEqual(self.labels('savage'), ['Dior - Sauvage'])
+        # Первая буква - обычная правка: опечатка и транслит через "ш"
+        self.assertEqual(self.labels('xhanel'), ['Chanel', 'Chanel - Bleu de Chanel'])
+        self.assertEqual(self.labels('шанель'), ['Chanel', 'Chanel - Bleu de Chanel'])
+        # Короткий запрос ищется только как точный префикс
+        self.assertEqual(self.labels('sx'), [])
+
+    def test_notes_and_out_of_stock_products(self):
+        self.assertEqual(self.labels('бергамот'), ['бергамот'])
+        self.assertEqual(self.labels('dune'), [])
+
+    def test_limit(self):
+        self.assertEqual(self.labels('d', limit=1), ['Dior'])
+
+    def test_incremental_updates(self):
+        self.sauvage.name = 'Fahrenheit'
+        self.index.update_product(self.sauvage)
+        self.assertEqual(self.labels('sauvage'), [])
+        self.assertEqual(self.labels('fahr'), ['Dior - Fahrenheit'])
+
+        self.sauvage.in_stock = False
+        self.index.update_product(self.sauvage)
+        self.assertEqual(self.labels('fahr'), [])
+
+        self.index.remove_brand(self.guerlain.pk)
+        self.assertEqual(self.labels('guerlain'), [])
+        self.chanel.name = 'Chanel Paris'
+        self.index.update_brand(self.chanel)
+        self.assertEqual(self.labels('paris'), ['Chanel Paris'])
+
+    def test_removal_refills_top_from_subtree(self):
+        waters = [
+            make_product(f'aqua-{number}', self.dior, name=f'Aqua {number:02}')
+            for number in range(suggest.TOP_PER_NODE + 1)
+        ]
+        self.index.rebuild()
+        waters[0].in_stock = False
+        self.index.update_product(waters[0])
+        self.assertEqual(
+            self.labels('aqua', limit=suggest.TOP_PER_NODE),
+            [f'Dior - Aqua {number:02}' for number in range(1, suggest.TOP_PER_NODE + 1)]
+        )
+
+    def test_stale_index_is_rebuilt_in_background(self):
+        index = suggest.suggest_index
+        index.rebuild()
+        with mock.patch.object(index, 'built_at', index.built_at - 3600), \
+                mock.patch.object(suggest.threading, 'Thread') as thread:
+            self.assertIs(suggest.get_suggest_index(), index)
+            # Пока идет перестройка, повторный запрос второй поток не запускает
+            suggest.get_suggest_index()
+        suggest._build_lock.release()
+        thread.assert_called_once_with(target=suggest._rebuild_in_background, daemon=True)
+        thread.return_value.start.assert_called_once_with()
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        brand = make_brand('Maison')
+        cls.in_description = make_product(
+            'musk', brand, name='Musk Cloud', description='Легкий шлейф с оттенком сандала'
+        )
+        cls.in_name = make_product('santal', brand, name='Сандал 33', notes_base='Кедр')
+        cls.in_notes = make_product('wood', brand, name='Wood Sage', notes_base='Сандал, мускус')
+        make_product('hidden', brand, name='Сандал Noir', in_stock=False)
+
+    def slugs(self, query):
+        return [product.slug for product in self.client.get('/search/', {'q': query}).context['products']]
+
+    def test_ranks_name_above_notes_and_description(self):
+        self.assertEqual(self.slugs('сандал'), ['santal', 'wood', 'musk'])
+
+    def test_adjective_forms_match_noun(self):
+        for query in ('сандаловый', 'сандаловая', 'Сандалового'):
+            with self.subTest(query=query):
+                self.assertEqual(self.slugs(query)[:2], ['santal', 'wood'])
+
+    def test_database_backend_fallback(self):
+        get_search_backend.cache_clear()
+        self.addCleanup(get_search_backend.cache_clear)
+        with override_settings(SEARCH_BACKEND='shop.search.DatabaseSearchBackend'):
+            self.assertIsInstance(get_search_backend(), DatabaseSearchBackend)
+            self.assertEqual(set(self.slugs('Сандал')), {'santal', 'wood'})
+            self.assertEqual(self.slugs('мускус'), ['wood'])
+
+
+class ProductRatingTests(TestCase):
+    def setUp(self):
+        self.product = make_product('rated', make_brand())
+
+    def rating(self):
+        product = Product.objects.get(pk=self.product.pk)
+        return (
+            product.rating_sum, product.rating_count, product.rating_average,
+            dict(product.rating_histogram),
+        )
+
+    def histogram(self, **counts):
+        return {rating: counts.get(f'r{rating}', 0) for rating in range(1, 6)}
+
+    def test_add_change_and_remove(self):
+        Product.change_rating(self.product.pk, added=5)
+        Product.change_rating(self.product.pk, added=3)
+        self.assertEqual(self.rating(), (8, 2, 4.0, self.histogram(r5=1, r3=1)))
+
+        Product.change_rating(self.product.pk, added=1, removed=5)
+        self.assertEqual(self.rating(), (4, 2, 2.0, self.histogram(r3=1, r1=1)))
+
+        # Та же оценка добавлена и убрана - гистограмма не меняется
+        Product.change_rating(self.product.pk, added=3, removed=3)
+        self.assertEqual(self.rating(), (4, 2, 2.0, self.histogram(r3=1, r1=1)))
+
+        Product.change_rating(self.product.pk, removed=3)
+        Product.change_rating(self.product.pk, removed=1)
+        # Без оценок среднее - 0, а не деление на ноль
+        self.assertEqual(self.rating(), (0, 0, 0.0, self.histogram()))
+
+    def test_reviews_keep_rating_in_sync(self):
+        first, second = make_user('first'), make_user('second')
+        review = Review.objects.create(product=self.product, user=first, rating=4, text='Хорошо')
+        Review.objects.create(product=self.product, user=second, rating=5, text='Отлично')
+        self.assertEqual(self.rating(), (9, 2, 4.5, self.histogram(r4=1, r5=1)))
+
+        review.rating = 2
+        review.save()
+        self.assertEqual(self.rating(), (7, 2, 3.5, self.histogram(r2=1, r5=1)))
+
+        review.delete()
+        self.assertEqual(self.rating(), (5, 1, 5.0, self.histogram(r5=1)))
+
+    def test_product_save_does_not_overwrite_rating(self):
+        stale = Product.objects.get(pk=self.product.pk)
+        Review.objects.create(product=self.product, user=make_user('critic'), rating=3, text='Средне')
+        stale.price = Decimal('1200')
+        stale.save()
+        self.assertEqual(self.rating(), (3, 1, 3.0, self.histogram(r3=1)))
+
+    def test_save_of_deleted_row_inserts_it_again(self):
+        product = Product.objects.get(pk=self.product.pk)
+        Product.objects.filter(pk=product.pk).delete()
+        product.save()
+        self.assertTrue(Product.objects.filter(pk=product.pk).exists())
+
+    def test_reconcile_fixes_drift_only(self):
+        user = make_user('critic')
+        for rating, slug in ((5, 'first'), (4, 'second'), (4, 'third')):
+            Review.objects.create(
+                product=make_product(slug, self.product.brand), user=user, rating=rating, text='-'
+            )
+        Review.objects.create(product=self.product, user=user, rating=2, text='-')
+        Review.objects.create(product=self.product, user=make_user('fan'), rating=3, text='-')
+        Product.objects.filter(slug='first').update(rating_sum=1, rating_5=0, rating_1=1)
+
+        output = StringIO()
+        call_command('reconcile_ratings', chunk_size=2, stdout=output)
+        self.assertIn('исправлено 1', output.getvalue())
+        first = Product.objects.get(slug='first')
+        self.assertEqual((first.rating_sum, first.rating_1, first.rating_5), (5, 0, 1))
+        self.assertEqual(self.rating(), (5, 2, 2.5, self.histogram(r2=1, r3=1)))
+
+        output = StringIO()
+        call_command('reconcile_ratings', stdout=output)
+        self.assertIn('исправлено 0', output.getvalue())
+
+
+class OrderSummaryTests(TestCase):
+    def setUp(self):
+        self.max_length = Order._meta.get_field('items_summary').max_length
+
+    def test_short_summary(self):
+        self.assertEqual(Order.build_items_summary([]), '')
+        self.assertEqual(
+            Order.build_items_summary([('Sauvage', 1), ('Bleu de Chanel', 2)]),
+            'Sauvage × 1, Bleu de Chanel × 2'
+        )
+
+    def test_lines_that_do_not_fit_are_counted(self):
+        lines = [(f'Парфюм номер {number}', 1) for number in range(40)]
+        summary = Order.build_items_summary(lines)
+        self.assertLessEqual(len(summary), self.max_length)
+        shown, rest = summary.rsplit(' и еще ', 1)
+        self.assertTrue(rest.endswith(' поз.'))
+        self.assertEqual(len(shown.split(', ')) + int(rest.split()[0]), len(lines))
+
+    def test_long_first_name_is_truncated(self):
+        long_name = 'Очень длинное название ' * 20
+        summary = Order.build_items_summary([(long_name, 1), ('Sauvage', 1)])
+        self.assertEqual(len(summary), self.max_length)
+        self.assertTrue(summary.endswith('… и еще 1 поз.'))
+
+        summary = Order.build_items_summary([(long_name, 1)])
+        self.assertEqual(len(summary), self.max_length)
+        self.assertTrue(summary.endswith('…'))
+
+    def test_refreshed_from_order_items(self):
+        user = make_user('summary')
+        product = make_product('summary', make_brand())
+        order = Order.objects.create(
+            user=user, payment_method='cash', total_price=0, full_name='Иван Петров',
+            email=user.email, address='-', city='-',
+        )
+        for name, quantity in (('Sauvage', 2), ('Bleu de Chanel', 1)):
+            OrderItem.objects.create(
+                order=order, product=product, product_name=name,
+                product_price=Decimal('1000'), quantity=quantity,
+            )
+        order.refresh_from_db()
+        self.assertEqual(order.total_items, 3)
+        self.assertEqual(order.items_summary, 'Sauvage × 2, Bleu de Chanel × 1')
+
+        # Удаление одной позиции пересчитывает заказ
+        order.items.get(product_name='Sauvage').delete()
+        order.refresh_from_db()
+        self.assertEqual((order.total_items, order.items_summary), (1, 'Bleu de Chanel × 1'))
+
+        # Удаление заказа не пересчитывает его для каждой удаляемой позиции
+        with CaptureQueriesContext(connection) as queries:
+            order.delete()
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
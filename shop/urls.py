@@ -4,7 +4,11 @@ from . import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('catalog/', views.catalog, name='catalog'),
+    path('api/catalog/', views.catalog_api, name='catalog_api'),
     path('product/<slug:slug>/', views.product_detail, name='product_detail'),
+    path('api/product/<slug:slug>/reviews/', views.product_reviews_api, name='product_reviews_api'),
+    path('search/', views.search, name='search'),
+    path('api/suggest/', views.suggest_api, name='suggest_api'),
     path('contacts/', views.contacts, name='contacts'),
     path('register/', views.register_view, name='register'),
     path('login/', views.login_view, name='login'),
@@ -13,11 +17,15 @@ urlpatterns = [
     path('api/login/', views.login_api, name='login_api'),
     path('cart/', views.cart_view, name='cart'),
     path('checkout/', views.checkout_view, name='checkout'),
+    path('api/cart/count/', views.cart_count_api, name='cart_count_api'),
+    path('api/cart/summary/', views.cart_summary_api, name='cart_summary_api'),
+    path('api/cart/batch/', views.cart_batch_api, name='cart_batch_api'),
     path('api/cart/add/<int:product_id>/', views.add_to_cart_api, name='add_to_cart_api'),
     path('api/cart/update/<int:item_id>/', views.update_cart_item_api, name='update_cart_item_api'),
     path('api/cart/remove/<int:item_id>/', views.remove_from_cart_api, name='remove_from_cart_api'),
     path('api/order/create/', views.create_order_api, name='create_order_api'),
     path('account/', views.account_view, name='account'),
+    path('api/orders/<int:order_id>/items/', views.order_items_api, name='order_items_api'),
     path('api/order/delete/<int:order_id>/', views.delete_order_api, name='delete_order_api'),
     path('order/delete/<int:order_id>/', views.delete_order, name='delete_order'),
     path('order/cancel/<int:order_id>/', views.cancel_order, name='cancel_order'),
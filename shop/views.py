@@ -1,24 +1,43 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth import authenticate, login, logout
+from django.conf import settings
+from django.contrib.auth import authenticate, login, logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse, Http404
 from django.views.decorators.csrf import csrf_exempt, ensure_csrf_cookie
 from django.views.decorators.http import require_http_methods
-from django.db.models import Q
+from django.db.models import Count, Sum
+from django.template.loader import render_to_string
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.contrib import messages
-from django.db import transaction
 import json
+import logging
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
+from . import cart as cart_ops
+from .copurchase import recommend_for_cart
 from .forms import RegistrationForm, LoginForm
+from .idempotency import idempotent
+from .orders import OrderError, create_order
+from .facets import FACETS, apply_filters, get_catalog_index
+from .pagination import KeysetPaginator
+from .product_cache import (
+    get_first_reviews_page, get_product_bundle, page_products, store_first_reviews_page,
+)
+from .ratelimit import rate_limit
+from .reauth import is_recently_reauthenticated, mark_reauthenticated
+from .search import get_search_backend
+from .stats import EMPTY_STATS, get_brand_stats
+from .suggest import get_suggest_index
 from .models import (
     CustomUser, Product, Brand, Category, 
-    Cart, CartItem, Order, OrderItem, Review, Wishlist
+    Cart, CartItem, Order, Review, Wishlist
 )
 
 
+logger = logging.getLogger(__name__)
+
+
 def index(request):
     """Главная страница"""
     # Получаем популярные парфюмы для главной страницы
@@ -39,157 +58,193 @@ def index(request):
     return render(request, 'shop/index.html', context)
 
 
-def catalog(request):
-    """Страница каталога парфюмерии с сортировкой и фильтрацией"""
+# Сортировки каталога: значение параметра sort -> порядок полей.
+# Последним полем идет id, чтобы порядок был однозначным для keyset-пагинации.
+CATALOG_ORDERINGS = {
+    'newest': ('-created_at', '-id'),
+    'year': ('-created_at', '-id'),
+    'name': ('name', 'id'),
+    'price': ('effective_price', 'id'),
+    'price_desc': ('-effective_price', '-id'),
+    'brand': ('brand__name', 'id'),
+    'popular': ('-is_bestseller', '-created_at', '-id'),
+    'rating': ('-rating_average', '-rating_count', '-id'),
+}
+
+
+def _catalog_page(request):
+    """Отфильтровать каталог по параметрам запроса и получить страницу товаров"""
+    # Фасетный индекс отвечает на фильтры и считает количество товаров по опциям
+    filters = {facet: request.GET.get(facet, '') for facet in FACETS}
+    # Семейств нот можно выбрать несколько: ?notes=woody&notes=citrus
+    filters['notes'] = [notes for notes in request.GET.getlist('notes') if notes]
+    facet_result = get_catalog_index().query(filters)
+    
     # Получаем только парфюмы в наличии
-    products = Product.objects.filter(in_stock=True)
-    
-    # Фильтрация по категории (Люкс/Ниша)
-    category_id = request.GET.get('category', '')
-    if category_id:
-        try:
-            category = Category.objects.get(id=category_id)
-            products = products.filter(category=category)
-        except (Category.DoesNotExist, ValueError):
-            pass
-    
-    # Фильтрация по концентрации
-    concentration = request.GET.get('concentration', '')
-    if concentration:
-        products = products.filter(concentration=concentration)
-    
-    # Фильтрация по полу
-    gender = request.GET.get('gender', '')
-    if gender:
-        products = products.filter(gender=gender)
-    
-    # Фильтрация по бренду
-    brand_id = request.GET.get('brand', '')
-    if brand_id:
-        try:
-            brand = Brand.objects.get(id=brand_id)
-            products = products.filter(brand=brand)
-        except (Brand.DoesNotExist, ValueError):
-            pass
-    
-    # Фильтрация по нотам
-    notes = request.GET.get('notes', '')
-    if notes:
-        if notes == 'woody':
-            products = products.filter(
-                Q(notes_top__icontains='древ') | 
-                Q(notes_middle__icontains='древ') | 
-                Q(notes_base__icontains='древ')
-            )
-        elif notes == 'floral':
-            products = products.filter(
-                Q(notes_top__icontains='цвет') | 
-                Q(notes_middle__icontains='цвет') | 
-                Q(notes_base__icontains='цвет')
-            )
-        elif notes == 'fresh':
-            products = products.filter(
-                Q(notes_top__icontains='свеж') | 
-                Q(notes_middle__icontains='свеж') | 
-                Q(notes_base__icontains='свеж')
-            )
-        elif notes == 'oriental':
-            products = products.filter(
-                Q(notes_top__icontains='вост') | 
-                Q(notes_middle__icontains='вост') | 
-                Q(notes_base__icontains='вост')
-            )
-        elif notes == 'citrus':
-            products = products.filter(
-                Q(notes_top__icontains='цитрус') | 
-                Q(notes_middle__icontains='цитрус') | 
-                Q(notes_base__icontains='цитрус')
-            )
-    
-    # Фильтрация по цене
-    price_range = request.GET.get('price_range', '')
-    if price_range:
-        if price_range == '0-5000':
-            products = products.filter(price__lte=5000)
-        elif price_range == '5000-15000':
-            products = products.filter(price__gte=5000, price__lte=15000)
-        elif price_range == '15000-30000':
-            products = products.filter(price__gte=15000, price__lte=30000)
-        elif price_range == '30000+':
-            products = products.filter(price__gte=30000)
+    products = apply_filters(
+        Product.objects.filter(in_stock=True).select_related('brand'),
+        facet_result.filters
+    )
     
-    # Сортировка
+    # Сортировка (по умолчанию - по новизне)
     sort_by = request.GET.get('sort', 'newest')
+    if sort_by not in CATALOG_ORDERINGS:
+        sort_by = 'newest'
+    
+    paginator = KeysetPaginator(
+        products,
+        CATALOG_ORDERINGS[sort_by],
+        per_page=settings.CATALOG_PAGE_SIZE,
+        count=facet_result.total
+    )
+    page = paginator.page(request.GET.get('cursor'))
+    return filters, sort_by, facet_result, page
+
+
+def _product_to_dict(product):
+    """Краткое представление товара для JSON API"""
+    return {
+        'id': product.id,
+        'name': product.name,
+        'slug': product.slug,
+        'brand': product.brand.name,
+        'volume': product.volume,
+        'notes_short': product.notes_short,
+        'price': product.price,
+        'discount': product.discount,
+        'discounted_price': product.effective_price,
+        'image': product.image.url if product.image else '',
+        'url': product.get_absolute_url(),
+        'is_new': product.is_new,
+        'is_bestseller': product.is_bestseller,
+        'rating': product.rating_average,
+        'rating_count': product.rating_count,
+    }
+
+
+def catalog(request):
+    """Страница каталога парфюмерии с сортировкой и фильтрацией"""
+    filters, sort_by, facet_result, page = _catalog_page(request)
     
-    if sort_by == 'year':
-        # По году (используем год создания записи)
-        products = products.order_by('-created_at')
-    elif sort_by == 'name':
-        # По наименованию (А-Я)
-        products = products.order_by('name')
-    elif sort_by == 'price':
-        # По цене (по возрастанию)
-        products = products.order_by('price')
-    elif sort_by == 'price_desc':
-        # По цене (по убыванию)
-        products = products.order_by('-price')
-    elif sort_by == 'brand':
-        # По бренду
-        products = products.order_by('brand__name')
-    else:  # newest (по умолчанию) или popular
-        if sort_by == 'popular':
-            # По популярности (хиты продаж)
-            products = products.order_by('-is_bestseller', '-created_at')
-        else:
-            # По новизне (дата добавления)
-            products = products.order_by('-created_at')
-    
-    # Получаем все данные для фильтров
-    categories = Category.objects.all().order_by('name')
-    brands = Brand.objects.all().order_by('name')
-    
-    # Для фильтра концентрации
-    CONCENTRATION_CHOICES = Product.CONCENTRATION_CHOICES if hasattr(Product, 'CONCENTRATION_CHOICES') else []
+    # Параметры запроса без курсора - для ссылок пагинации
+    query = request.GET.copy()
+    query.pop('cursor', None)
     
     context = {
-        'products': products,
-        'categories': categories,  # QuerySet объектов Category
-        'concentration_choices': CONCENTRATION_CHOICES,  # Для фильтра концентрации
-        'brands': brands,
-        'current_category': category_id,
-        'current_concentration': concentration,
-        'current_gender': gender,
-        'current_brand': brand_id,
-        'current_notes': notes,
-        'current_price_range': price_range,
+        'products': page,
+        'products_total': facet_result.total,
+        'facets': facet_result.options,
+        'query_string': query.urlencode(),
+        'current_category': filters['category'],
+        'current_concentration': filters['concentration'],
+        'current_gender': filters['gender'],
+        'current_brand': filters['brand'],
+        'current_notes': filters['notes'],
+        'current_price_range': filters['price_range'],
         'current_sort': sort_by,
     }
     
     return render(request, 'shop/catalog.html', context)
 
 
+def catalog_api(request):
+    """API каталога: те же фильтры, сортировки и страницы, что и на странице каталога"""
+    filters, sort_by, facet_result, page = _catalog_page(request)
+    
+    return JsonResponse({
+        'success': True,
+        'products': [_product_to_dict(product) for product in page],
+        'count': facet_result.total,
+        'page': page.number,
+        'num_pages': page.paginator.num_pages,
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+        'facets': {
+            facet: [option._asdict() for option in options]
+            for facet, options in facet_result.options.items()
+        },
+    })
+
+
 def product_detail(request, slug):
     """Страница парфюма"""
-    try:
-        product = Product.objects.get(slug=slug, in_stock=True)
-    except Product.DoesNotExist:
+    # Товар с брендом, категорией и id похожих товаров - из кэша
+    bundle = get_product_bundle(slug)
+    if bundle is None:
         raise Http404("Парфюм не найден или нет в наличии")
     
-    # Похожие парфюмы (той же категории или бренда)
-    similar_products = Product.objects.filter(
-        in_stock=True
-    ).exclude(id=product.id).filter(
-        Q(category=product.category) | Q(brand=product.brand)
-    )[:4]
-    
+    # Похожие парфюмы и "С этим товаром покупают" - одним запросом по id из набора
+    similar, bought_together = page_products(bundle)
     context = {
-        'product': product,
-        'similar_products': similar_products,
+        'product': bundle.product,
+        'similar_products': similar,
+        'bought_together': bought_together,
     }
     
     return render(request, 'shop/product_detail.html', context)
 
 
+# Поля отзыва и автора, которые показываются в ленте
+REVIEW_FIELDS = (
+    'id', 'rating', 'text', 'advantages', 'disadvantages', 'created_at', 'user__name',
+)
+
+
+def _review_to_dict(review):
+    """Отзыв для JSON API (автор - только имя)"""
+    return {
+        'id': review.id,
+        'author': review.user.name,
+        'rating': review.rating,
+        'text': review.text,
+        'advantages': review.advantages,
+        'disadvantages': review.disadvantages,
+        'created_at': review.created_at,
+    }
+
+
+@require_http_methods(["GET"])
+def product_reviews_api(request, slug):
+    """API ленты отзывов товара: от новых к старым, keyset-страницами"""
+    bundle = get_product_bundle(slug)
+    if bundle is None:
+        return JsonResponse({'success': False, 'error': 'Парфюм не найден'}, status=404)
+    product = bundle.product
+    
+    # Первая страница - самая частая, она хранится в кэше до изменения отзывов
+    cursor = request.GET.get('cursor')
+    if not cursor:
+        data = get_first_reviews_page(product.id)
+        if data is not None:
+            return JsonResponse(data)
+    
+    reviews = (
+        Review.objects.filter(product_id=product.id)
+        .select_related('user')
+        .only(*REVIEW_FIELDS)
+    )
+    # Количество отзывов уже есть в рейтинге товара - без COUNT(*)
+    paginator = KeysetPaginator(
+        reviews,
+        ['-created_at', '-id'],
+        per_page=settings.REVIEWS_PAGE_SIZE,
+        count=product.rating_count
+    )
+    page = paginator.page(cursor)
+    data = {
+        'success': True,
+        'reviews': [_review_to_dict(review) for review in page],
+        'count': paginator.count,
+        'page': page.number,
+        'num_pages': paginator.num_pages,
+        'next_cursor': page.next_cursor,
+        'previous_cursor': page.previous_cursor,
+    }
+    if not cursor:
+        store_first_reviews_page(product.id, data)
+    return JsonResponse(data)
+
+
 def contacts(request):
     """Страница контактов"""
     return render(request, 'shop/contacts.html')
@@ -213,6 +268,7 @@ def login_view(request):
 
 @require_http_methods(["POST"])
 @csrf_exempt
+@rate_limit('register')
 def register_api(request):
     """API для регистрации с AJAX валидацией"""
     if request.user.is_authenticated:
@@ -226,22 +282,24 @@ def register_api(request):
         
         form = RegistrationForm(data)
         
-        if form.is_valid():
-            user = form.save()
+        # save() возвращает None, если логин или email заняли параллельно
+        user = form.save() if form.is_valid() else None
+        if user is not None:
             login(request, user)
+            mark_reauthenticated(request, user)
             return JsonResponse({
                 'success': True,
                 'message': 'Регистрация успешна!',
                 'redirect': '/'
             })
-        else:
-            errors = {}
-            for field, error_list in form.errors.items():
-                errors[field] = error_list[0] if error_list else ''
-            return JsonResponse({
-                'success': False,
-                'errors': errors
-            })
+        
+        errors = {}
+        for field, error_list in form.errors.items():
+            errors[field] = error_list[0] if error_list else ''
+        return JsonResponse({
+            'success': False,
+            'errors': errors
+        })
     except Exception as e:
         return JsonResponse({
             'success': False,
@@ -251,6 +309,7 @@ def register_api(request):
 
 @require_http_methods(["POST"])
 @csrf_exempt
+@rate_limit('login')
 def login_api(request):
     """API для авторизации с AJAX валидацией"""
     if request.user.is_authenticated:
@@ -268,6 +327,7 @@ def login_api(request):
             
             if user is not None:
                 login(request, user)
+                mark_reauthenticated(request, user)
                 return JsonResponse({
                     'success': True,
                     'message': 'Авторизация успешна!',
@@ -308,38 +368,43 @@ def about(request):
 def search(request):
     """Поиск парфюмов"""
     query = request.GET.get('q', '').strip()
-    products = []
-    
-    if query:
-        products = Product.objects.filter(
-            Q(name__icontains=query) |
-            Q(brand__name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(notes_top__icontains=query) |
-            Q(notes_middle__icontains=query) |
-            Q(notes_base__icontains=query),
-            in_stock=True
-        ).order_by('-created_at')
+    
+    # Результаты ранжируются бэкендом поиска; количество считается
+    # отдельным запросом, без загрузки всех найденных товаров
+    products = get_search_backend().paginate(query, request.GET.get('page', 1))
     
     context = {
         'query': query,
         'products': products,
-        'results_count': len(products),
+        'results_count': products.paginator.count,
     }
     
     return render(request, 'shop/search.html', context)
 
 
+def suggest_api(request):
+    """API подсказок для строки поиска (вызывается на каждое нажатие клавиши)"""
+    query = request.GET.get('q', '').strip()[:100]
+    suggestions = get_suggest_index().suggest(query)
+    
+    return JsonResponse({
+        'success': True,
+        'suggestions': [
+            {'type': item.type, 'label': item.label, 'url': item.url}
+            for item in suggestions
+        ],
+    })
+
+
 def brands(request):
     """Страница с брендами"""
-    brands_list = Brand.objects.all().order_by('name')
+    brands_list = list(Brand.objects.all().order_by('name'))
     
-    # Считаем товары каждого бренда
+    # Статистика всех брендов считается одним запросом и кэшируется
+    stats = get_brand_stats()
     for brand in brands_list:
-        brand.product_count = Product.objects.filter(
-            brand=brand, 
-            in_stock=True
-        ).count()
+        brand.stats = stats.get(brand.pk, EMPTY_STATS)
+        brand.product_count = brand.stats.in_stock_count
     
     context = {
         'brands': brands_list,
@@ -356,9 +421,9 @@ def brand_detail(request, slug):
     # Сортировка
     sort_by = request.GET.get('sort', 'newest')
     if sort_by == 'price':
-        products = products.order_by('price')
+        products = products.order_by('effective_price', 'id')
     elif sort_by == 'price_desc':
-        products = products.order_by('-price')
+        products = products.order_by('-effective_price', '-id')
     elif sort_by == 'name':
         products = products.order_by('name')
     else:  # newest (по умолчанию)
@@ -381,9 +446,9 @@ def category_detail(request, slug):
     # Сортировка
     sort_by = request.GET.get('sort', 'newest')
     if sort_by == 'price':
-        products = products.order_by('price')
+        products = products.order_by('effective_price', 'id')
     elif sort_by == 'price_desc':
-        products = products.order_by('-price')
+        products = products.order_by('-effective_price', '-id')
     elif sort_by == 'name':
         products = products.order_by('name')
     else:  # newest (по умолчанию)
@@ -398,58 +463,85 @@ def category_detail(request, slug):
     return render(request, 'shop/category_detail.html', context)
 
 from django.contrib import messages
-from django.db import transaction
 
 @login_required
 def cart_view(request):
     """Страница корзины"""
     cart, created = Cart.objects.get_or_create(user=request.user)
-    items = cart.items.select_related('product').all()
+    items = list(cart.items.select_related('product'))
     
     context = {
         'cart': cart,
         'items': items,
+        'summary': cart.get_summary(),
+        # "С этими товарами покупают" по истории заказов
+        'recommendations': recommend_for_cart(item.product_id for item in items),
     }
     return render(request, 'shop/cart.html', context)
 
 
+def _cart_totals(user, cart_id, item_id=None):
+    """Итоги корзины для ответов API корзины (заодно обновляют значок в шапке)"""
+    summary = CartItem.objects.filter(cart_id=cart_id).summary(item_id=item_id)
+    cart_ops.remember_cart_count(user.pk, summary.total_items)
+    totals = {
+        'cart_total': summary.total_items,
+        'cart_total_price': summary.total_price,
+    }
+    if item_id is not None:
+        totals['item_total'] = summary.item_total
+    return totals
+
+
+@require_http_methods(["GET"])
+@login_required
+def cart_summary_api(request):
+    """API с итогами корзины: позиции, количество и стоимость со скидкой"""
+    summary = CartItem.objects.filter(cart__user=request.user).summary()
+    return JsonResponse({
+        'success': True,
+        'positions': summary.positions,
+        'cart_total': summary.total_items,
+        'cart_total_price': summary.total_price,
+    })
+
+
+@require_http_methods(["GET"])
+def cart_count_api(request):
+    """API с количеством товаров для значка корзины в шапке"""
+    count = cart_ops.get_cart_count(request.user) if request.user.is_authenticated else 0
+    return JsonResponse({
+        'success': True,
+        'count': count
+    })
+
+
 @require_http_methods(["POST"])
 @csrf_exempt
 @login_required
+@idempotent
 def add_to_cart_api(request, product_id):
     """API для добавления товара в корзину"""
     try:
-        product = Product.objects.get(id=product_id, in_stock=True)
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': 1}
-        )
+        # Корзина и дата ее изменения - один запрос, добавление - еще один
+        cart_id = cart_ops.touch_cart(request.user)
+        added = cart_ops.add_item(cart_id, product_id)
         
-        if not created:
-            cart_item.quantity += 1
-            cart_item.save()
-            message = 'Количество увеличено'
-        else:
-            message = 'Товар добавлен в корзину'
+        if added is None:
+            return JsonResponse({
+                'success': False,
+                'error': 'Товар не найден или нет в наличии'
+            })
         
-        cart.save()  # Обновляем дату изменения корзины
+        item_id, quantity = added
+        message = 'Товар добавлен в корзину' if quantity == 1 else 'Количество увеличено'
         
         return JsonResponse({
             'success': True,
             'message': message,
-            'cart_total': cart.get_total_items(),
-            'item_total': cart_item.get_total_price(),
-            'cart_total_price': cart.get_total_price()
+            **_cart_totals(request.user, cart_id, item_id)
         })
         
-    except Product.DoesNotExist:
-        return JsonResponse({
-            'success': False,
-            'error': 'Товар не найден или нет в наличии'
-        })
     except Exception as e:
         return JsonResponse({
             'success': False,
@@ -460,9 +552,7 @@ def add_to_cart_api(request, product_id):
 @require_http_methods(["POST"])
 @csrf_exempt
 @login_required
-@require_http_methods(["POST"])
-@csrf_exempt
-@login_required
+@idempotent
 def update_cart_item_api(request, item_id):
     """API для обновления количества товара в корзине"""
     try:
@@ -475,34 +565,25 @@ def update_cart_item_api(request, item_id):
                 'error': 'Количество должно быть положительным'
             })
         
-        cart_item = CartItem.objects.get(id=item_id, cart__user=request.user)
-        
-        # ЗАМЕНЯЕМ лимит с 10 на 100
-        if quantity > 100:  # Новый лимит 100 штук
+        if quantity > cart_ops.MAX_CART_QUANTITY:
             return JsonResponse({
                 'success': False,
-                'error': 'Максимальное количество - 100'
+                'error': f'Максимальное количество - {cart_ops.MAX_CART_QUANTITY}'
             })
         
-        cart_item.quantity = quantity
-        cart_item.save()
-        
-        cart = cart_item.cart
-        cart.save()
+        cart_id = cart_ops.touch_cart(request.user)
+        if not cart_ops.set_item_quantity(cart_id, item_id, quantity):
+            return JsonResponse({
+                'success': False,
+                'error': 'Товар не найден в корзине'
+            })
         
         return JsonResponse({
             'success': True,
             'message': 'Количество обновлено',
-            'item_total': cart_item.get_total_price(),
-            'cart_total_price': cart.get_total_price(),
-            'cart_total': cart.get_total_items()
+            **_cart_totals(request.user, cart_id, item_id)
         })
         
-    except CartItem.DoesNotExist:
-        return JsonResponse({
-            'success': False,
-            'error': 'Товар не найден в корзине'
-        })
     except Exception as e:
         return JsonResponse({
             'success': False,
@@ -513,25 +594,61 @@ def update_cart_item_api(request, item_id):
 @require_http_methods(["POST"])
 @csrf_exempt
 @login_required
+@idempotent
 def remove_from_cart_api(request, item_id):
     """API для удаления товара из корзины"""
     try:
-        cart_item = CartItem.objects.get(id=item_id, cart__user=request.user)
-        cart = cart_item.cart
-        cart_item.delete()
-        cart.save()
+        cart_id = cart_ops.touch_cart(request.user)
+        if not cart_ops.remove_item(cart_id, item_id):
+            return JsonResponse({
+                'success': False,
+                'error': 'Товар не найден в корзине'
+            })
         
         return JsonResponse({
             'success': True,
             'message': 'Товар удален из корзины',
-            'cart_total_price': cart.get_total_price(),
-            'cart_total': cart.get_total_items()
+            **_cart_totals(request.user, cart_id)
+        })
+        
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        })
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+@login_required
+@idempotent
+def cart_batch_api(request):
+    """
+    API для пакетного изменения корзины: список операций add / update / remove
+    применяется в одной транзакции, в ответе - одна сводка корзины.
+    """
+    try:
+        data = json.loads(request.body)
+        cart_id, results, touched = cart_ops.apply_batch(request.user, data.get('operations'))
+        
+        # Суммы затронутых позиций одним запросом
+        item_totals = (
+            CartItem.objects.filter(cart_id=cart_id, id__in=touched)
+            .with_line_total()
+            .values_list('id', 'line_total')
+        )
+        
+        return JsonResponse({
+            'success': True,
+            'results': results,
+            'items': {item_id: total for item_id, total in item_totals},
+            **_cart_totals(request.user, cart_id)
         })
         
-    except CartItem.DoesNotExist:
+    except (json.JSONDecodeError, AttributeError):
         return JsonResponse({
             'success': False,
-            'error': 'Товар не найден в корзине'
+            'error': 'Ошибка формата данных'
         })
     except Exception as e:
         return JsonResponse({
@@ -546,12 +663,14 @@ def checkout_view(request):
     cart, created = Cart.objects.get_or_create(user=request.user)
     items = cart.items.select_related('product').all()
     
-    if not items.exists():
+    if not items:
         return redirect('cart')
     
     context = {
         'cart': cart,
         'items': items,
+        'summary': cart.get_summary(),
+        'reauth_required': not is_recently_reauthenticated(request),
     }
     return render(request, 'shop/checkout.html', context)
 
@@ -559,94 +678,30 @@ def checkout_view(request):
 @require_http_methods(["POST"])
 @csrf_exempt
 @login_required
+@idempotent
 def create_order_api(request):
     """API для создания заказа с проверкой пароля"""
     try:
-        print("=== ORDER CREATION STARTED ===")  # Для отладки
         data = json.loads(request.body)
-        print("Request data:", data)  # Для отладки
-        
-        password = data.get('password', '')
+        password = data.get('password') or ''
         
-        # Проверка пароля
-        if not request.user.check_password(password):
-            print("Password check FAILED")  # Для отладки
-            return JsonResponse({
-                'success': False,
-                'error': 'Неверный пароль'
-            })
-        
-        print("Password check PASSED")  # Для отладки
-        
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        items = cart.items.select_related('product').all()
-        
-        if not items.exists():
-            return JsonResponse({
-                'success': False,
-                'error': 'Корзина пуста'
-            })
-        
-        # Проверяем наличие всех товаров
-        for item in items:
-            if not item.product.in_stock:
+        # Проверка пароля (не нужна, если пароль недавно подтверждался)
+        if not is_recently_reauthenticated(request):
+            if not password:
                 return JsonResponse({
                     'success': False,
-                    'error': f'Товар "{item.product.name}" отсутствует на складе'
+                    'error': 'Введите пароль для подтверждения заказа'
                 })
+            if not request.user.check_password(password):
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Неверный пароль'
+                })
+            # check_password мог перехешировать пароль: сессия остается действительной
+            update_session_auth_hash(request, request.user)
+            mark_reauthenticated(request)
         
-        # Создаем заказ
-        with transaction.atomic():
-            # Генерируем номер заказа
-            import datetime
-            date_str = datetime.datetime.now().strftime('%Y%m%d')
-            last_order = Order.objects.filter(order_number__startswith=f'ORD-{date_str}').order_by('-id').first()
-            if last_order:
-                last_num = int(last_order.order_number.split('-')[-1])
-                new_num = last_num + 1
-            else:
-                new_num = 1
-            order_number = f'ORD-{date_str}-{new_num:04d}'
-            
-            # Получаем данные из запроса
-            address = data.get('address', 'Не указан')
-            city = data.get('city', 'Не указан')
-            postal_code = data.get('postal_code', '')
-            comment = data.get('comment', '')
-            payment_method = data.get('payment_method', 'cash')  # По умолчанию наличные
-            
-            print(f"Creating order with payment method: {payment_method}")  # Для отладки
-            
-            order = Order.objects.create(
-                order_number=order_number,
-                user=request.user,
-                status='pending',
-                payment_method=payment_method,  # Используем переданный метод оплаты
-                total_price=cart.get_total_price(),
-                full_name=f"{request.user.surname} {request.user.name} {request.user.patronymic or ''}".strip(),
-                email=request.user.email,
-                phone=request.user.phone_number or '',
-                address=address,
-                city=city,
-                postal_code=postal_code,
-                comment=comment
-            )
-            
-            # Создаем элементы заказа
-            for item in items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=item.product,
-                    product_name=item.product.name,
-                    product_price=item.product.get_discounted_price(),
-                    quantity=item.quantity
-                )
-            
-            # Очищаем корзину
-            cart.items.all().delete()
-            cart.save()
-        
-        print(f"Order created successfully: {order_number}")  # Для отладки
+        order = create_order(request.user, data)
         
         return JsonResponse({
             'success': True,
@@ -655,79 +710,72 @@ def create_order_api(request):
             'redirect': '/'  # URL для страницы после оформления
         })
         
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {e}")  # Для отладки
+    except json.JSONDecodeError:
         return JsonResponse({
             'success': False,
             'error': 'Ошибка формата данных'
         })
-    except Exception as e:
-        print(f"Order creation error: {e}")  # Для отладки
+    except OrderError as e:
         return JsonResponse({
             'success': False,
             'error': str(e)
         })
-
-@require_http_methods(["POST"])
-@csrf_exempt
-@login_required
-def add_to_cart_api(request, product_id):
-    """API для добавления товара в корзину"""
-    try:
-        product = Product.objects.get(id=product_id, in_stock=True)
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': 1}
-        )
-        
-        if not created:
-            cart_item.quantity += 1
-            cart_item.save()
-            message = 'Количество увеличено'
-        else:
-            message = 'Товар добавлен в корзину'
-        
-        cart.save()  # Обновляем дату изменения корзины
-        
-        return JsonResponse({
-            'success': True,
-            'message': message,
-            'cart_total': cart.get_total_items(),
-            'item_total': cart_item.get_total_price(),
-            'cart_total_price': cart.get_total_price()
-        })
-        
-    except Product.DoesNotExist:
-        return JsonResponse({
-            'success': False,
-            'error': 'Товар не найден или нет в наличии'
-        })
     except Exception as e:
+        logger.exception('Order creation failed for user %s', request.user.pk)
         return JsonResponse({
             'success': False,
             'error': str(e)
         })
-    
+
+
 @login_required
 def account_view(request):
     """Страница личного кабинета"""
-    # Получаем заказы пользователя от новых к старым
-    orders = Order.objects.filter(user=request.user).order_by('-created_at').prefetch_related('items')
+    orders = Order.objects.filter(user=request.user)
     
-    # Считаем общее количество товаров во всех заказах
-    total_items = sum(order.items.count() for order in orders)
+    # Количество заказов и товаров во всех заказах - одним агрегатом
+    stats = orders.aggregate(orders_count=Count('id'), total_items=Sum('total_items'))
+    
+    # Заказы от новых к старым, постранично; позиции подгружаются по запросу
+    paginator = KeysetPaginator(
+        orders,
+        ['-created_at', '-id'],
+        per_page=settings.ACCOUNT_ORDERS_PAGE_SIZE,
+        count=stats['orders_count']
+    )
+    page = paginator.page(request.GET.get('cursor'))
     
     context = {
-        'orders': orders,
-        'total_items': total_items,
+        'orders': page,
+        'orders_count': stats['orders_count'],
+        'total_items': stats['total_items'] or 0,
     }
     
     return render(request, 'shop/account.html', context)
 
 
+@require_http_methods(["GET"])
+@login_required
+def order_items_api(request, order_id):
+    """API с позициями заказа для раскрытия заказа в личном кабинете"""
+    order = get_object_or_404(Order.objects.only('id'), id=order_id, user=request.user)
+    items = list(order.items.order_by('id'))
+    return JsonResponse({
+        'success': True,
+        'html': render_to_string('shop/order_items.html', {'items': items}),
+        'items': [
+            {
+                'product_id': item.product_id,
+                'name': item.product_name,
+                'price': item.product_price,
+                'quantity': item.quantity,
+                'total_price': item.get_total_price(),
+            }
+            for item in items
+        ],
+    })
+
+
 @csrf_exempt
 @require_POST
 def delete_order_api(request, order_id):
@@ -741,7 +789,7 @@ def delete_order_api(request, order_id):
         order = Order.objects.get(id=order_id, user=request.user)
         
         # Проверяем, можно ли удалить заказ
-        if order.status == 'pending':
+        if order.can_be_deleted():
             order.delete()
             return JsonResponse({
                 'success': True, 
@@ -772,7 +820,7 @@ def delete_order(request, order_id):
         order = Order.objects.get(id=order_id, user=request.user)
         
         # Проверяем, можно ли удалить заказ
-        if order.status == 'pending':
+        if order.can_be_deleted():
             order.delete()
             messages.success(request, f'Заказ №{order.order_number} успешно удален')
         else:
@@ -790,7 +838,7 @@ def cancel_order(request, order_id):
         order = Order.objects.get(id=order_id, user=request.user)
         
         # Проверяем, можно ли отменить заказ
-        if order.status in ['pending', 'confirmed']:
+        if order.can_be_cancelled():
             order.status = 'cancelled'
             order.save()
             messages.success(request, f'Заказ №{order.order_number} отменен')
@@ -813,6 +861,7 @@ def order_detail(request, order_id):
             'order': order,
             'items': items,
             'title': f'Заказ №{order.order_number}',
+            'description': f'{order.total_items} шт.: {order.items_summary}',
         }
         
         return render(request, 'shop/order_detail.html', context)
@@ -64,6 +64,38 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
     
+    // Order Items (lazy loading)
+    document.querySelectorAll('.order-items-toggle').forEach(btn => {
+        btn.addEventListener('click', function() {
+            const list = this.nextElementSibling;
+
+            // Items are loaded once, then the list is just toggled
+            if (list.dataset.loaded) {
+                list.hidden = !list.hidden;
+                return;
+            }
+
+            this.disabled = true;
+            fetch(this.dataset.url, { headers: { 'X-Requested-With': 'XMLHttpRequest' } })
+                .then(response => response.json())
+                .then(data => {
+                    if (!data.success) {
+                        throw new Error(data.error || 'Failed to load order items');
+                    }
+                    list.innerHTML = data.html;
+                    list.dataset.loaded = 'true';
+                    list.hidden = false;
+                })
+                .catch(error => {
+                    console.error('Error loading order items:', error);
+                    showNotification('Не удалось загрузить товары заказа', 'error');
+                })
+                .finally(() => {
+                    this.disabled = false;
+                });
+        });
+    });
+
     // Order Deletion
     document.querySelectorAll('.delete-btn').forEach(btn => {
         btn.addEventListener('click', function() {
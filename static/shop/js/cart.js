@@ -22,49 +22,18 @@ function updateQuantityInput(itemId, value) {
     updateCartItem(itemId, newValue);
 }
 
+// Очередь изменений корзины (queueCartOperation, flushCartOperations)
+// и отправка оставшихся изменений при закрытии страницы - в main.js
 function updateCartItem(itemId, quantity) {
-    fetch(`/api/cart/update/${itemId}/`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-            'X-CSRFToken': getCsrfToken()
-        },
-        body: JSON.stringify({ quantity: quantity })
-    })
-    .then(response => response.json())
-    .then(data => {
-        if (data.success) {
-            // Обновляем отображение суммы для товара
-            const totalElement = document.querySelector(`[data-item-id="${itemId}"] .total-price`);
-            if (totalElement) {
-                totalElement.textContent = data.item_total + ' ₽';
-            }
-            
-            // Обновляем сводку
-            updateCartSummary(data);
-            
-            // Обновляем счетчик в шапке
-            updateCartCounter(data.cart_total);
-        }
-    })
-    .catch(error => {
-        console.error('Error updating cart:', error);
-    });
+    queueCartOperation({ op: 'update', item_id: itemId, quantity: quantity });
 }
 
 function removeFromCart(itemId) {
     if (!confirm('Удалить товар из корзины?')) return;
     
-    fetch(`/api/cart/remove/${itemId}/`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-            'X-CSRFToken': getCsrfToken()
-        }
-    })
-    .then(response => response.json())
-    .then(data => {
-        if (data.success) {
+    queueCartOperation({ op: 'remove', item_id: itemId });
+    flushCartOperations().then(data => {
+        if (data && data.success) {
             // Удаляем строку из таблицы с анимацией
             const itemRow = document.querySelector(`[data-item-id="${itemId}"]`);
             if (itemRow) {
@@ -74,12 +43,6 @@ function removeFromCart(itemId) {
                 setTimeout(() => {
                     itemRow.remove();
                     
-                    // Обновляем сводку
-                    updateCartSummary(data);
-                    
-                    // Обновляем счетчик в шапке
-                    updateCartCounter(data.cart_total);
-                    
                     // Если корзина пуста, перезагружаем страницу
                     if (data.cart_total === 0) {
                         setTimeout(() => {
@@ -89,9 +52,6 @@ function removeFromCart(itemId) {
                 }, 300);
             }
         }
-    })
-    .catch(error => {
-        console.error('Error removing from cart:', error);
     });
 }
 
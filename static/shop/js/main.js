@@ -53,17 +53,37 @@
         showSlide(0);
     });
 
+    // Ключ идемпотентности добавления - один на намерение пользователя:
+    // пока добавление товара не получило ответа сервера (двойной клик,
+    // повтор после сетевой ошибки), отправляется тот же ключ
+    var addToCartKeys = new Map();
+
     function addToCart(productId) {
         console.log('Добавляем товар ID:', productId);
         
-        fetch(`/api/cart/add/${productId}/`, {
+        if (!addToCartKeys.has(productId)) {
+            addToCartKeys.set(productId, newIdempotencyKey());
+        }
+        const key = addToCartKeys.get(productId);
+        
+        fetchWithRetry(`/api/cart/add/${productId}/`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Idempotency-Key': key
             }
         })
-        .then(response => response.json())
+        .then(response => {
+            // 409 - запрос с этим ключом еще выполняется (повторный клик)
+            if (response.status === 409) return null;
+            // Сервер ответил: следующее нажатие - новое добавление
+            if (addToCartKeys.get(productId) === key) {
+                addToCartKeys.delete(productId);
+            }
+            return response.json();
+        })
         .then(data => {
+            if (!data) return;
             if (data.success) {
                 // ТОЛЬКО обновляем счетчик, без уведомлений
                 if (data.cart_total !== undefined) {
@@ -117,6 +137,28 @@
         return cookieValue;
     }
 
+    // Ключ идемпотентности: повтор запроса с тем же ключом не выполнится дважды
+    function newIdempotencyKey() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+    }
+
+    // Повтор запроса при сетевой ошибке с теми же заголовками (и тем же
+    // ключом идемпотентности): если первый запрос дошел до сервера,
+    // повтор получит его ответ, а не выполнится второй раз
+    var FETCH_RETRIES = 2;
+    var FETCH_RETRY_DELAY = 1000;
+
+    function fetchWithRetry(url, options, retries = FETCH_RETRIES) {
+        return fetch(url, options).catch(error => {
+            if (retries <= 0) throw error;
+            return new Promise(resolve => setTimeout(resolve, FETCH_RETRY_DELAY))
+                .then(() => fetchWithRetry(url, options, retries - 1));
+        });
+    }
+
     // Показ уведомлений
     function showNotification(message, type = 'info') {
         // Создаем элемент уведомления
@@ -145,25 +187,80 @@
 
     // При загрузке страницы обновляем счетчик корзины
     document.addEventListener('DOMContentLoaded', function() {
-        // Проверяем авторизацию по наличию cookie
-        const isAuthenticated = document.cookie.includes('sessionid');
+        if (!document.querySelector('.cart-counter')) return;
         
-        if (isAuthenticated) {
-            // Просто устанавливаем начальное значение 0, 
-            // реальное значение обновится при взаимодействии с корзиной
-            updateCartCounter(0);
-            
-            // Или можно добавить отдельный эндпоинт для получения количества
-            // fetch('/api/cart/count/')
-            //     .then(response => response.json())
-            //     .then(data => {
-            //         if (data.success) {
-            //             updateCartCounter(data.count);
-            //         }
-            //     });
-        }
+        fetch('/api/cart/count/')
+            .then(response => response.json())
+            .then(data => {
+                if (data.success) {
+                    updateCartCounter(data.count);
+                }
+            })
+            .catch(error => {
+                console.error('Error loading cart count:', error);
+            });
     });
 
+    // Подсказки в строке поиска
+    const SUGGESTION_TYPES = {brand: 'бренд', product: 'аромат', note: 'нота'};
+
+    function initSearchSuggestions() {
+        const input = document.querySelector('.search-input');
+        const list = document.querySelector('.search-suggestions');
+        if (!input || !list) return;
+
+        let debounceTimer = null;
+        let controller = null;
+
+        function hideSuggestions() {
+            list.style.display = 'none';
+            list.innerHTML = '';
+        }
+
+        function renderSuggestions(suggestions) {
+            list.innerHTML = '';
+            suggestions.forEach(item => {
+                const li = document.createElement('li');
+                const link = document.createElement('a');
+                link.href = item.url;
+                link.textContent = item.label;
+                const type = document.createElement('span');
+                type.className = 'suggestion-type';
+                type.textContent = SUGGESTION_TYPES[item.type] || '';
+                link.appendChild(type);
+                li.appendChild(link);
+                list.appendChild(li);
+            });
+            list.style.display = suggestions.length ? 'block' : 'none';
+        }
+
+        input.addEventListener('input', () => {
+            clearTimeout(debounceTimer);
+            const query = input.value.trim();
+            if (!query) {
+                hideSuggestions();
+                return;
+            }
+            // Ждем паузу в наборе и отменяем устаревший запрос
+            debounceTimer = setTimeout(() => {
+                if (controller) controller.abort();
+                controller = new AbortController();
+                fetch(`/api/suggest/?q=${encodeURIComponent(query)}`, {signal: controller.signal})
+                    .then(response => response.json())
+                    .then(data => {
+                        if (data.success) renderSuggestions(data.suggestions);
+                    })
+                    .catch(error => {
+                        if (error.name !== 'AbortError') console.error('Ошибка подсказок:', error);
+                    });
+            }, 120);
+        });
+
+        input.addEventListener('blur', () => setTimeout(hideSuggestions, 200));
+    }
+
+    document.addEventListener('DOMContentLoaded', initSearchSuggestions);
+
     // Добавьте эти стили для уведомлений в ваш CSS
     const notificationStyles = `
         .notification {
@@ -267,23 +364,50 @@ function updateQuantityInput(itemId, value) {
     updateCartItem(itemId, newValue);
 }
 
-function updateCartItem(itemId, quantity) {
-    fetch(`/api/cart/update/${itemId}/`, {
+// Изменения корзины копятся и уходят на сервер одним запросом:
+// быстрые клики по +/- превращаются в одну операцию на товар
+var CART_BATCH_DELAY = 400;
+var pendingCartOperations = new Map();
+var cartBatchTimer = null;
+
+function queueCartOperation(operation) {
+    pendingCartOperations.set(operation.item_id, operation);
+    clearTimeout(cartBatchTimer);
+    cartBatchTimer = setTimeout(flushCartOperations, CART_BATCH_DELAY);
+}
+
+function takeCartOperations() {
+    clearTimeout(cartBatchTimer);
+    cartBatchTimer = null;
+    const operations = Array.from(pendingCartOperations.values());
+    pendingCartOperations.clear();
+    return operations;
+}
+
+function flushCartOperations() {
+    const operations = takeCartOperations();
+    if (operations.length === 0) return Promise.resolve(null);
+    
+    // Один ключ на пакет: повтор после сетевой ошибки не применит его дважды
+    return fetchWithRetry('/api/cart/batch/', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
-            'X-CSRFToken': getCsrfToken()
+            'X-CSRFToken': getCsrfToken(),
+            'Idempotency-Key': newIdempotencyKey()
         },
-        body: JSON.stringify({ quantity: quantity })
+        body: JSON.stringify({ operations: operations })
     })
     .then(response => response.json())
     .then(data => {
         if (data.success) {
-            // Обновляем отображение суммы для товара
-            const totalElement = document.querySelector(`[data-item-id="${itemId}"] .total-price`);
-            if (totalElement) {
-                totalElement.textContent = data.item_total + ' ₽';
-            }
+            // Обновляем суммы измененных товаров
+            Object.entries(data.items).forEach(([itemId, total]) => {
+                const totalElement = document.querySelector(`[data-item-id="${itemId}"] .total-price`);
+                if (totalElement) {
+                    totalElement.textContent = total + ' ₽';
+                }
+            });
             
             // Обновляем сводку
             updateCartSummary(data);
@@ -291,25 +415,33 @@ function updateCartItem(itemId, quantity) {
             // Обновляем счетчик в шапке
             updateCartCounter(data.cart_total);
         }
+        return data;
     })
     .catch(error => {
         console.error('Error updating cart:', error);
+        return null;
     });
 }
 
+// Не теряем изменения, если страницу закрыли до отправки
+window.addEventListener('pagehide', function() {
+    const operations = takeCartOperations();
+    if (operations.length > 0) {
+        const body = new Blob([JSON.stringify({ operations: operations })], { type: 'application/json' });
+        navigator.sendBeacon('/api/cart/batch/', body);
+    }
+});
+
+function updateCartItem(itemId, quantity) {
+    queueCartOperation({ op: 'update', item_id: itemId, quantity: quantity });
+}
+
 function removeFromCart(itemId) {
     if (!confirm('Удалить товар из корзины?')) return;
     
-    fetch(`/api/cart/remove/${itemId}/`, {
-        method: 'POST',
-        headers: {
-            'Content-Type': 'application/json',
-            'X-CSRFToken': getCsrfToken()
-        }
-    })
-    .then(response => response.json())
-    .then(data => {
-        if (data.success) {
+    queueCartOperation({ op: 'remove', item_id: itemId });
+    flushCartOperations().then(data => {
+        if (data && data.success) {
             // Удаляем строку из таблицы с анимацией
             const itemRow = document.querySelector(`[data-item-id="${itemId}"]`);
             if (itemRow) {
@@ -319,12 +451,6 @@ function removeFromCart(itemId) {
                 setTimeout(() => {
                     itemRow.remove();
                     
-                    // Обновляем сводку
-                    updateCartSummary(data);
-                    
-                    // Обновляем счетчик в шапке
-                    updateCartCounter(data.cart_total);
-                    
                     // Если корзина пуста, перезагружаем страницу
                     if (data.cart_total === 0) {
                         setTimeout(() => {
@@ -334,9 +460,6 @@ function removeFromCart(itemId) {
                 }, 300);
             }
         }
-    })
-    .catch(error => {
-        console.error('Error removing from cart:', error);
     });
 }
 